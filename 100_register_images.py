@@ -1,34 +1,45 @@
 import oci
 import cohere
 import oracledb
-from PIL import Image
-from io import BytesIO
-import base64
 import os
 import array
 import time
-import glob
 import sys
+import argparse
+import hashlib
+import threading
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv, find_dotenv
+from app.ingestion_pipeline import IngestionPipeline, PipelineStage
+from app.batch_embedder import BatchEmbedder
+from app.bulk_writer import BulkImageWriter
+from app.image_payload import ImagePayload
+from app.image_renditions import make_renditions
+from app.ingestion_manifest import IngestionManifest
+from app.model_output_cache import ModelOutputCache
+from app.async_ingestion import ProviderGate, AsyncEmbeddingBatcher
+from app.image_scanner import scan_images
+from app.stage_metrics import StageMetrics
+from app.vector_quantization import quantize_binary, quantize_int8
+from app.embedding_dimension import FULL_EMBEDDING_DIMENSION, SUPPORTED_EMBEDDING_DIMENSIONS, truncate_embedding, validate_embedding_dimension
+from util_compress_image import compress_image
+from app.fake_clients import FakeGenerativeAiInferenceClient, FakeCohereClient, FakeDbPool
 
-def image_to_base64_data_url(image_data):
-    """画像データをBase64エンコードしてData URLに変換"""
-    img = Image.open(BytesIO(image_data))
-    buffered = BytesIO()
-    img.save(buffered, format="JPEG")
-    img_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
-    data_url = f"data:image/jpeg;base64,{img_base64}"
-    return data_url
-
-def get_image_caption(generative_ai_inference_client, image_data):
-    """画像データからキャプションを生成する関数"""
-    #PROMPT = "画像に描かれているものを詳しく説明してください。"
-    PROMPT = "画像からすべてのテキストを抽出して、画像に描かれているものを教えてください。固有の名称を教えてください。画像を説明してください。"
+# キャプション生成に使用するプロンプト（キャッシュのキーにも使用する）
+#CAPTION_PROMPT = "画像に描かれているものを詳しく説明してください。"
+CAPTION_PROMPT = "画像からすべてのテキストを抽出して、画像に描かれているものを教えてください。固有の名称を教えてください。画像を説明してください。"
+
+# 埋め込みモデルのID
+EMBED_MODEL_ID = "embed-v4.0"
+
+def get_image_caption(generative_ai_inference_client, image_payload):
+    """画像ペイロードからキャプションを生成する関数"""
     content1 = oci.generative_ai_inference.models.TextContent()
-    content1.text = PROMPT
+    content1.text = CAPTION_PROMPT
     content2 = oci.generative_ai_inference.models.ImageContent()
     image_url = oci.generative_ai_inference.models.ImageUrl()
-    image_url.url = image_to_base64_data_url(image_data)
+    image_url.url = image_payload.data_url
     content2.image_url = image_url
     message = oci.generative_ai_inference.models.UserMessage()
     message.content = [content1,content2]
@@ -90,78 +101,360 @@ def get_image_caption(generative_ai_inference_client, image_data):
     # すべての方法が失敗した場合
     return "画像の説明を生成できませんでした。"
 
-def get_image_embedding(co, image_data):
-    """画像データからCohere Embed 3を使用して埋め込みベクトルを生成"""
-    # 画像データをBase64エンコードしてData URLに変換
-    data_url = image_to_base64_data_url(image_data)
-    
-    # Cohere APIを使用して画像の埋め込みベクトルを取得
-    response = co.embed(
-        images=[data_url],
-        model="embed-v4.0",
-        input_type="image",
-        embedding_types=["float"],
-    )
-    
-    return response.embeddings.float[0]
-
-def get_text_embedding(co, text):
-    """テキストからCohere Embed 3を使用して埋め込みベクトルを生成"""
-    response = co.embed(
-        texts=[text],
-        model="embed-v4.0",
-        input_type="search_document"
-    )
-    
-    return response.embeddings[0]
-
-def is_image_registered(db_connection, file_name):
-    """画像が既にデータベースに登録されているかチェック"""
+def load_registered_keys(db_connection, fetch_size=10000):
+    """登録済みのファイル名とコンテンツハッシュを1回のクエリでまとめて取得し、集合として返す"""
     cursor = db_connection.cursor()
     try:
-        cursor.execute("SELECT COUNT(*) FROM IMAGES WHERE file_name = :1", [file_name])
-        count = cursor.fetchone()[0]
-        return count > 0
+        # 大きなフェッチサイズで全件をストリーミングし、往復回数を最小限にする
+        cursor.arraysize = fetch_size
+        cursor.prefetchrows = fetch_size
+        cursor.execute("SELECT file_name, content_hash FROM IMAGES")
+        file_names = set()
+        content_hashes = set()
+        while True:
+            rows = cursor.fetchmany()
+            if not rows:
+                break
+            for file_name, content_hash in rows:
+                file_names.add(file_name)
+                if content_hash is not None:
+                    content_hashes.add(content_hash)
+        return file_names, content_hashes
     finally:
         cursor.close()
 
-def insert_image_to_db(generative_ai_inference_client, cohere_client, db_connection, image_data, file_name):
-    """画像とその説明文をOracle Databaseに挿入"""
-    caption = get_image_caption(generative_ai_inference_client, image_data)
-    # 画像とテキストの埋め込みベクトルを取得
-    image_embedding = array.array('f', get_image_embedding(cohere_client, image_data))
-    caption_embedding = array.array('f', get_text_embedding(cohere_client, caption))
-    
-    cursor = db_connection.cursor()
-    try:
-        # 画像データを挿入
-        cursor.execute("""
-            INSERT INTO IMAGES (file_name, caption, caption_embedding, image_data, image_embedding)
-            VALUES (:1, :2, :3, :4, :5)
-        """, (
-            file_name,
-            caption,
-            caption_embedding,
-            image_data,
-            image_embedding
+def embedding_cache_key(record, kind):
+    """埋め込みベクトルのマニフェスト・永続キャッシュ用の (入力のハッシュ, input_type) を返す"""
+    if kind == "image":
+        return record["content_hash"], "image"
+    # キャプションの埋め込みはキャプション本文の内容で識別する
+    return hashlib.sha256(record["caption"].encode("utf-8")).hexdigest(), "search_document"
+
+def lookup_caption(manifest, cache, content_hash):
+    """マニフェスト・永続キャッシュから生成済みのキャプションを探す（見つからなければNone）"""
+    caption = manifest.get_caption(content_hash, MLLM_MODEL_ID, CAPTION_PROMPT)
+    if caption is None and cache is not None:
+        caption = cache.get_caption(content_hash, MLLM_MODEL_ID, CAPTION_PROMPT)
+        if caption is not None:
+            manifest.put_caption(content_hash, MLLM_MODEL_ID, CAPTION_PROMPT, caption)
+    return caption
+
+def store_caption(manifest, cache, content_hash, caption):
+    """生成したキャプションをマニフェストと永続キャッシュに記録"""
+    manifest.put_caption(content_hash, MLLM_MODEL_ID, CAPTION_PROMPT, caption)
+    if cache is not None:
+        cache.put_caption(content_hash, MLLM_MODEL_ID, CAPTION_PROMPT, caption)
+
+def lookup_embedding(manifest, cache, record, kind):
+    """マニフェスト・永続キャッシュから生成済みの埋め込みベクトルを探す（見つからなければNone）"""
+    input_hash, input_type = embedding_cache_key(record, kind)
+    vector = manifest.get_embedding(input_hash, kind, EMBED_MODEL_ID)
+    if vector is None and cache is not None:
+        vector = cache.get_embedding(input_hash, EMBED_MODEL_ID, input_type)
+        if vector is not None:
+            manifest.put_embedding(input_hash, kind, EMBED_MODEL_ID, vector)
+    return vector
+
+def store_embedding(manifest, cache, record, kind, vector):
+    """生成した埋め込みベクトルをマニフェストと永続キャッシュに記録"""
+    input_hash, input_type = embedding_cache_key(record, kind)
+    manifest.put_embedding(input_hash, kind, EMBED_MODEL_ID, vector)
+    if cache is not None:
+        cache.put_embedding(input_hash, EMBED_MODEL_ID, input_type, vector)
+
+def create_ingestion_stages(generative_ai_inference_client, batch_embedder, bulk_writer, manifest, cache, registered_hashes, metrics, args, stats, stats_lock):
+    """読み込み・キャプション生成・埋め込み・書き込みの各ステージを作成"""
+    # 今回の実行で処理中・処理済みのコンテンツハッシュ（名前を変えただけの重複画像を検出する）
+    seen_hashes = set()
+
+    def read_stage(record):
+        # 画像データを読み込む（JPEG以外はJPEGに変換して登録する）
+        # --compress 指定時は元画像をメモリ上で縮小・圧縮し、ディスクを経由せずに登録する
+        start = time.perf_counter()
+        if not args.compress and record["image_path"].lower().endswith((".jpg", ".jpeg")):
+            with open(record["image_path"], "rb") as image_file:
+                record["image_data"] = image_file.read()
+        else:
+            record["image_data"] = compress_image(record["image_path"])
+        metrics.record("read", time.perf_counter() - start, len(record["image_data"]))
+
+        # キャプション生成と埋め込みで共有するペイロードを一度だけ構築
+        with metrics.measure("encode"):
+            record["payload"] = ImagePayload(record["image_data"])
+        record["content_hash"] = record["payload"].content_hash
+
+        # 同じ内容の画像が登録済み・処理中であればスキップ
+        with stats_lock:
+            is_duplicate = record["content_hash"] in registered_hashes or record["content_hash"] in seen_hashes
+            if is_duplicate:
+                stats["duplicate_content"] += 1
+            else:
+                seen_hashes.add(record["content_hash"])
+        if is_duplicate:
+            print(f"画像 '{record['file_name']}' は同じ内容の画像が既に登録されています。スキップします。")
+            return None
+
+        print(f"画像 '{record['file_name']}' を処理中...")
+
+        # ギャラリー表示用の縮小版画像を生成
+        with metrics.measure("rendition"):
+            record["renditions"] = make_renditions(record["image_data"])
+        return record
+
+    def caption_stage(record):
+        # マニフェスト・永続キャッシュに記録済みのキャプションがあれば再生成しない
+        caption = lookup_caption(manifest, cache, record["content_hash"])
+        if caption is None:
+            with metrics.measure("caption", len(record["payload"].data_url)):
+                caption = get_image_caption(generative_ai_inference_client, record["payload"])
+            store_caption(manifest, cache, record["content_hash"], caption)
+        else:
+            with stats_lock:
+                stats["resumed_calls"] += 1
+        record["caption"] = caption
+        return record
+
+    def embed_stage(records):
+        # マニフェスト・永続キャッシュに記録済みの埋め込みベクトルを再利用
+        for record in records:
+            record["image_embedding"] = lookup_embedding(manifest, cache, record, "image")
+            record["caption_embedding"] = lookup_embedding(manifest, cache, record, "caption")
+        image_targets = [record for record in records if record["image_embedding"] is None]
+        caption_targets = [record for record in records if record["caption_embedding"] is None]
+        with stats_lock:
+            stats["resumed_calls"] += (len(records) - len(image_targets)) + (len(records) - len(caption_targets))
+
+        # 未生成の画像とテキストの埋め込みベクトルをバッチ単位でまとめて取得
+        image_embeddings, image_errors, caption_embeddings, caption_errors = [], {}, [], {}
+        if image_targets:
+            data_urls = [record["payload"].data_url for record in image_targets]
+            with metrics.measure("image_embed", sum(len(data_url) for data_url in data_urls)):
+                image_embeddings, image_errors = batch_embedder.embed_images(data_urls)
+        if caption_targets:
+            captions = [record["caption"] for record in caption_targets]
+            with metrics.measure("text_embed", sum(len(caption.encode("utf-8")) for caption in captions)):
+                caption_embeddings, caption_errors = batch_embedder.embed_texts(captions, "search_document")
+
+        errors = {}
+        for i, record in enumerate(image_targets):
+            if i in image_errors:
+                errors[id(record)] = image_errors[i]
+                continue
+            record["image_embedding"] = array.array('f', image_embeddings[i])
+            store_embedding(manifest, cache, record, "image", record["image_embedding"])
+        for i, record in enumerate(caption_targets):
+            if i in caption_errors:
+                errors.setdefault(id(record), caption_errors[i])
+                continue
+            record["caption_embedding"] = array.array('f', caption_embeddings[i])
+            store_embedding(manifest, cache, record, "caption", record["caption_embedding"])
+
+        return [errors.get(id(record), record) for record in records]
+
+    def write_stage(record):
+        # 行をバッファに追加し、一定件数・一定時間ごとにまとめて挿入・コミットする
+        # マニフェスト・永続キャッシュにはモデルの出力のまま記録し、書き込む直前に指定の次元数に切り詰める
+        bulk_writer.add((
+            record["file_name"],
+            record["caption"],
+            truncate_embedding(record["caption_embedding"], args.embedding_dimension),
+            record["image_data"],
+            truncate_embedding(record["image_embedding"], args.embedding_dimension),
+            record["content_hash"],
+            record["renditions"]["thumbnail"],
+            record["renditions"]["preview"]
         ))
-        
-        db_connection.commit()
-        print(f"画像 '{file_name}' が正常に挿入されました。")
-        return True
-    except Exception as e:
-        print(f"画像 '{file_name}' の挿入中にエラーが発生しました: {str(e)}")
-        raise
-    finally:
-        cursor.close()
+        return record
+
+    return [
+        PipelineStage("read", read_stage, args.read_workers),
+        PipelineStage("caption", caption_stage, args.caption_workers),
+        PipelineStage("embed", embed_stage, args.embed_workers, batch_size=args.embed_batch_size, batch_timeout=args.embed_batch_timeout),
+        PipelineStage("write", write_stage, 1)
+    ]
+
+async def run_async_ingestion(records, read_stage, write_stage, generative_ai_inference_client, batch_embedder, manifest, cache, metrics, args, stats, stats_lock):
+    """asyncioでレコードを並行処理し、プロバイダーごとにレートと同時実行数を調整する
+
+    埋め込みは同時に処理中のレコードの分を AsyncEmbeddingBatcher でまとめ、パイプラインモードと同じく
+    BatchEmbedder（1回あたり最大96件・不正な入力の二分割・一時的なエラーの再試行）で取得する。
+    レート制限だけは BatchEmbedder では再試行せず、ProviderGate が同時実行数を下げて再試行する。
+    """
+    # スレッドに逃がすOCI GenAI呼び出しが既定のスレッド数で頭打ちにならないようにする
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=args.max_concurrency * 2 + args.read_workers))
+
+    oci_gate = ProviderGate("OCI GenAI", args.oci_rate, args.caption_workers, args.max_concurrency)
+    cohere_gate = ProviderGate("Cohere", args.cohere_rate, args.embed_workers, args.max_concurrency)
+    in_flight = asyncio.Semaphore(args.max_in_flight)
+    errors = []
+
+    async def embed_image_batch(data_urls):
+        return await cohere_gate.call(
+            lambda: asyncio.to_thread(batch_embedder.embed_images, data_urls),
+            metrics, "image_embed", sum(len(data_url) for data_url in data_urls)
+        )
+
+    async def embed_text_batch(captions):
+        return await cohere_gate.call(
+            lambda: asyncio.to_thread(batch_embedder.embed_texts, captions, "search_document"),
+            metrics, "text_embed", sum(len(caption.encode("utf-8")) for caption in captions)
+        )
+
+    image_batcher = AsyncEmbeddingBatcher(embed_image_batch, batch_embedder.max_images_per_call, args.embed_batch_timeout)
+    text_batcher = AsyncEmbeddingBatcher(embed_text_batch, batch_embedder.max_texts_per_call, args.embed_batch_timeout)
+
+    async def embed_image(record):
+        vector = lookup_embedding(manifest, cache, record, "image")
+        if vector is not None:
+            with stats_lock:
+                stats["resumed_calls"] += 1
+            return vector
+        vector = array.array('f', await image_batcher.embed(record["payload"].data_url))
+        store_embedding(manifest, cache, record, "image", vector)
+        return vector
+
+    async def embed_caption(record):
+        vector = lookup_embedding(manifest, cache, record, "caption")
+        if vector is not None:
+            with stats_lock:
+                stats["resumed_calls"] += 1
+            return vector
+        vector = array.array('f', await text_batcher.embed(record["caption"]))
+        store_embedding(manifest, cache, record, "caption", vector)
+        return vector
+
+    async def process(record):
+        try:
+            record = await asyncio.to_thread(read_stage, record)
+            if record is None:
+                return
+
+            # マニフェスト・永続キャッシュに記録済みのキャプションがあれば再生成しない
+            caption = lookup_caption(manifest, cache, record["content_hash"])
+            if caption is None:
+                caption = await oci_gate.call(lambda: asyncio.to_thread(
+                    get_image_caption, generative_ai_inference_client, record["payload"]
+                ), metrics, "caption", len(record["payload"].data_url))
+                store_caption(manifest, cache, record["content_hash"], caption)
+            else:
+                with stats_lock:
+                    stats["resumed_calls"] += 1
+            record["caption"] = caption
+
+            # 画像とキャプションの埋め込みを並行して取得
+            record["image_embedding"], record["caption_embedding"] = await asyncio.gather(
+                embed_image(record), embed_caption(record)
+            )
+            await asyncio.to_thread(write_stage, record)
+        except Exception as e:
+            print(f"画像 '{record['file_name']}' の処理中にエラーが発生しました: {type(e).__name__}: {e}")
+            errors.append(("async", record, e))
+        finally:
+            in_flight.release()
+
+    tasks = set()
+    for record in records:
+        await in_flight.acquire()
+        task = asyncio.create_task(process(record))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+    if tasks:
+        await asyncio.gather(*tasks)
+
+    print("\n===== プロバイダー別の計測値 =====")
+    print(oci_gate.summary())
+    print(cohere_gate.summary())
+    return errors
+
+def reembed_captions(db_pool, batch_embedder, batch_size=96, quantize=False, dimension=FULL_EMBEDDING_DIMENSION):
+    """登録済みの全キャプションをバッチ単位で再埋め込みし、caption_embedding（quantize=Trueの場合は量子化版の列も）を更新"""
+    updated = 0
+    failed = 0
+    with db_pool.acquire() as db_connection:
+        read_cursor = db_connection.cursor()
+        write_cursor = db_connection.cursor()
+        try:
+            read_cursor.arraysize = batch_size
+            read_cursor.execute("SELECT image_id, caption FROM IMAGES ORDER BY image_id")
+            while True:
+                rows = read_cursor.fetchmany(batch_size)
+                if not rows:
+                    break
+                embeddings, errors = batch_embedder.embed_texts([caption for _, caption in rows], "search_document")
+                update_rows = []
+                for i, (image_id, _) in enumerate(rows):
+                    if i in errors:
+                        print(f"画像ID {image_id} のキャプションの再埋め込みに失敗しました: {errors[i]}")
+                        failed += 1
+                        continue
+                    embedding = truncate_embedding(embeddings[i], dimension)
+                    if quantize:
+                        update_rows.append((embedding, quantize_int8(embedding), quantize_binary(embedding), image_id))
+                    else:
+                        update_rows.append((embedding, image_id))
+                if update_rows:
+                    if quantize:
+                        write_cursor.executemany("""
+                            UPDATE IMAGES SET caption_embedding = :1, caption_embedding_int8 = :2, caption_embedding_bin = :3
+                            WHERE image_id = :4
+                        """, update_rows)
+                    else:
+                        write_cursor.executemany("UPDATE IMAGES SET caption_embedding = :1 WHERE image_id = :2", update_rows)
+                    db_connection.commit()
+                    updated += len(update_rows)
+                print(f"{updated} 件のキャプションを再埋め込みしました。")
+        finally:
+            read_cursor.close()
+            write_cursor.close()
+    return updated, failed
+
+def parse_args():
+    """コマンドライン引数を解析"""
+    parser = argparse.ArgumentParser(description="画像ディレクトリ内の画像をキャプション・埋め込みベクトルとともにOracle Databaseに登録します。")
+    parser.add_argument("--image-dir", default="images", help="画像ディレクトリのパス")
+    parser.add_argument("--no-recursive", action="store_true", help="サブディレクトリを走査しない")
+    parser.add_argument("--compress", action="store_true", help="元画像（images_original など）を読み込み時に縮小・JPEG圧縮して登録する")
+    parser.add_argument("--read-workers", type=int, default=2, help="読み込みステージの並列数")
+    parser.add_argument("--caption-workers", type=int, default=4, help="キャプション生成ステージの並列数")
+    parser.add_argument("--embed-workers", type=int, default=4, help="埋め込みステージの並列数")
+    parser.add_argument("--embed-batch-size", type=int, default=BatchEmbedder.MAX_TEXTS_PER_CALL, help="1回のembed呼び出しにまとめる最大件数")
+    parser.add_argument("--embed-batch-timeout", type=float, default=0.5, help="埋め込みバッチが揃うまで待つ最大秒数")
+    parser.add_argument("--image-embed-batch-size", type=int, default=BatchEmbedder.MAX_IMAGES_PER_CALL, help="1回のembed呼び出しにまとめる最大画像数（プロバイダーの上限以下）")
+    parser.add_argument("--write-batch-size", type=int, default=50, help="1回の配列DML・コミットでまとめて挿入する最大行数")
+    parser.add_argument("--write-flush-interval", type=float, default=5.0, help="バッファ内の行を書き込むまでの最大秒数")
+    parser.add_argument("--manifest", default="ingestion_manifest.sqlite", help="完了したモデル呼び出しを記録するマニフェストファイルのパス")
+    parser.add_argument("--cache-path", default="~/.cache/devday25_multimodal/model_outputs.sqlite", help="キャプション・埋め込みベクトルの永続キャッシュファイルのパス")
+    parser.add_argument("--cache-max-mb", type=int, default=2048, help="永続キャッシュの最大サイズ（MB）")
+    parser.add_argument("--no-cache", action="store_true", help="永続キャッシュを使用しない（フェイクモードでは常に使用しない）")
+    parser.add_argument("--report", default=None, help="ステージ別計測結果のJSONレポートの出力先（省略時は ingest_report_<日時>.json）")
+    parser.add_argument("--reembed-captions", action="store_true", help="画像登録の代わりに登録済みキャプションの埋め込みベクトルを再生成する")
+    parser.add_argument("--quantize", action="store_true", help="埋め込みベクトルのint8・バイナリ量子化版の列も書き込む（sql/alter_images_add_quantized_embeddings.sql の適用が必要）")
+    parser.add_argument("--embedding-dimension", type=int, choices=SUPPORTED_EMBEDDING_DIMENSIONS, default=None, help="書き込む埋め込みベクトルの次元数（省略時は環境変数 EMBEDDING_DIMENSION、未設定なら1536。IMAGESの列の次元数と合わせる）")
+    parser.add_argument("--queue-size", type=int, default=16, help="ステージ間キューの最大長")
+    parser.add_argument("--async-mode", action="store_true", help="asyncioで並行処理し、プロバイダーごとにレートと同時実行数を自動調整する")
+    parser.add_argument("--oci-rate", type=float, default=2.0, help="非同期モードでのOCI GenAIへの最大リクエストレート（件/秒）")
+    parser.add_argument("--cohere-rate", type=float, default=10.0, help="非同期モードでのCohereへの最大リクエストレート（件/秒）")
+    parser.add_argument("--max-concurrency", type=int, default=32, help="非同期モードでのプロバイダーごとの最大同時実行数")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="非同期モードで同時に処理する最大画像数")
+    parser.add_argument("--fake-throttle-rate", type=float, default=0.0, help="フェイクモードでレート制限（429）を返す確率")
+    parser.add_argument("--fake", action="store_true", help="OCI GenAI・Cohere・データベースをフェイククライアントに置き換えてオフラインで計測する")
+    return parser.parse_args()
 
 if __name__ == "__main__":
+    args = parse_args()
+
     # 処理開始時間を記録
     start_time = time.time()
     
     # 環境変数を読み込む
     load_dotenv(find_dotenv())
     
+    # 書き込む埋め込みベクトルの次元数（検索側の EMBEDDING_DIMENSION と同じ値にする）
+    if args.embedding_dimension is None:
+        args.embedding_dimension = validate_embedding_dimension(os.getenv("EMBEDDING_DIMENSION", str(FULL_EMBEDDING_DIMENSION)))
+    print(f"埋め込みベクトルの次元数: {args.embedding_dimension}")
+    
     # 必要な環境変数のリスト
     required_env_vars = [
         "COHERE_API_KEY",
@@ -175,11 +468,12 @@ if __name__ == "__main__":
         "OCI_GENAI_MLLM_MODEL_ID"
     ]
     
-    # 環境変数の存在確認
+    # 環境変数の存在確認（フェイクモードでは不要）
     missing_vars = []
-    for var in required_env_vars:
-        if not os.getenv(var):
-            missing_vars.append(var)
+    if not args.fake:
+        for var in required_env_vars:
+            if not os.getenv(var):
+                missing_vars.append(var)
     
     if missing_vars:
         print("エラー: 以下の環境変数が設定されていません:")
@@ -194,77 +488,177 @@ if __name__ == "__main__":
     DSN = os.getenv("DB_DSN")
     
     # 画像ディレクトリのパス
-    IMAGE_DIR = "images"
+    IMAGE_DIR = args.image_dir
     
     # 統計情報の初期化
-    total_images = 0
-    already_registered = 0
-    newly_registered = 0
-    failed_registrations = 0
+    stats = {
+        "total_images": 0,
+        "already_registered": 0,
+        "duplicate_content": 0,
+        "resumed_calls": 0,
+        "newly_registered": 0,
+        "failed_registrations": 0
+    }
+    stats_lock = threading.Lock()
+    metrics = StageMetrics()
 
-    # OCI Config の設定
-    CONFIG_PROFILE = os.getenv("OCI_CONFIG_PROFILE")
-    config = oci.config.from_file(file_location='~/.oci/config', profile_name=CONFIG_PROFILE)
-    config["region"] = os.getenv("OCI_REGION")
+    def on_flush(written, failed):
+        # 配列DMLの書き込み結果を統計情報に反映
+        with stats_lock:
+            stats["newly_registered"] += len(written)
+            stats["failed_registrations"] += len(failed)
 
     COMPARTMENT_ID = os.getenv("OCI_COMPARTMENT_ID") 
     MLLM_MODEL_ID = os.getenv("OCI_GENAI_MLLM_MODEL_ID")
     
     try:
-        # OCI GenAIクライアントを初期化
-        generative_ai_inference_client = oci.generative_ai_inference.GenerativeAiInferenceClient(config=config, retry_strategy=oci.retry.NoneRetryStrategy(), timeout=(10,240)) 
+        if args.fake:
+            # フェイククライアントを初期化（リモート呼び出しの遅延のみを再現）
+            generative_ai_inference_client = FakeGenerativeAiInferenceClient(throttle_rate=args.fake_throttle_rate)
+            # フェイクのキャプションが実際のモデルの結果として記録されないよう、モデルIDを区別する
+            MLLM_MODEL_ID = f"fake:{MLLM_MODEL_ID}"
+            cohere_client = FakeCohereClient(throttle_rate=args.fake_throttle_rate)
+            db_pool = FakeDbPool()
+            print("フェイクモードで実行します。")
+        else:
+            # OCI Config の設定
+            CONFIG_PROFILE = os.getenv("OCI_CONFIG_PROFILE")
+            config = oci.config.from_file(file_location='~/.oci/config', profile_name=CONFIG_PROFILE)
+            config["region"] = os.getenv("OCI_REGION")
 
-        # Cohereクライアントを初期化
-        cohere_client = cohere.Client(api_key=COHERE_API_KEY)
+            # OCI GenAIクライアントを初期化
+            generative_ai_inference_client = oci.generative_ai_inference.GenerativeAiInferenceClient(config=config, retry_strategy=oci.retry.NoneRetryStrategy(), timeout=(10,240)) 
 
-        # Oracle接続を確立
-        db_connection = oracledb.connect(user=USERNAME, password=PASSWORD, dsn=DSN)
-        print("データベース接続成功!")
-        
-        # images ディレクトリ内のすべての画像ファイルを取得
-        image_files = glob.glob(os.path.join(IMAGE_DIR, "*.jpg"))
-        total_images = len(image_files)
-        
-        print(f"処理対象の画像ファイル数: {total_images}")
+            # Cohereクライアントを初期化
+            cohere_client = cohere.Client(api_key=COHERE_API_KEY)
+
+            # Oracle接続プールを作成（登録済みファイルの取得と書き込みで使用）
+            db_pool = oracledb.create_pool(
+                user=USERNAME,
+                password=PASSWORD,
+                dsn=DSN,
+                min=1,
+                max=2,
+                increment=1,
+                getmode=oracledb.POOL_GETMODE_WAIT
+            )
+            print("データベース接続成功!")
         
-        # 各画像ファイルを処理
-        for image_path in image_files:
-            file_name = os.path.basename(image_path)
-            
-            # 既に登録されているかチェック
-            if is_image_registered(db_connection, file_name):
-                print(f"画像 '{file_name}' は既に登録されています。スキップします。")
-                already_registered += 1
-                continue
-            
-            print(f"画像 '{file_name}' を処理中...")
-            
+        batch_embedder = BatchEmbedder(
+            cohere_client,
+            model=EMBED_MODEL_ID,
+            max_texts_per_call=args.embed_batch_size,
+            max_images_per_call=args.image_embed_batch_size,
+            # asyncモードではレート制限の再試行を ProviderGate に任せる
+            retry_throttles=not args.async_mode
+        )
+
+        if args.reembed_captions:
+            updated, failed = reembed_captions(db_pool, batch_embedder, quantize=args.quantize, dimension=args.embedding_dimension)
+            print("\n===== 再埋め込み結果サマリー =====")
+            print(f"再埋め込みしたキャプション数: {updated}")
+            print(f"再埋め込みに失敗したキャプション数: {failed}")
+            print(f"embed呼び出し回数: {batch_embedder.api_calls}")
+            print(f"処理時間: {time.time() - start_time:.2f} 秒")
+            sys.exit(0)
+
+        # 登録済みのファイル名とコンテンツハッシュを1回のクエリでまとめて取得
+        with db_pool.acquire() as db_connection:
+            registered_file_names, registered_hashes = load_registered_keys(db_connection)
+        print(f"登録済みの画像数: {len(registered_file_names)}")
+
+        # 中断された実行の結果を再利用するためのマニフェストを開く
+        # フェイクモードの結果を実際の実行で再利用しないよう、フェイクモードでは別のファイルに記録する
+        manifest_path = "{0}_fake{1}".format(*os.path.splitext(args.manifest)) if args.fake else args.manifest
+        manifest = IngestionManifest(manifest_path)
+
+        # 環境を作り直しても再利用できるよう、モデル呼び出しの結果を永続キャッシュする
+        # フェイクモードの結果は実際のモデルの結果と区別できないため、永続キャッシュには記録しない
+        cache = None if args.no_cache or args.fake else ModelOutputCache(args.cache_path, max_bytes=args.cache_max_mb * 1024 * 1024)
+
+        def iter_unregistered_records():
+            # images ディレクトリ配下を逐次走査し、見つけた画像から順にパイプラインへ流す
+            # 既に登録されている画像はパイプラインに流さずにスキップ
+            for image_path, file_name in scan_images(IMAGE_DIR, recursive=not args.no_recursive):
+                stats["total_images"] += 1
+                if file_name in registered_file_names:
+                    print(f"画像 '{file_name}' は既に登録されています。スキップします。")
+                    stats["already_registered"] += 1
+                    continue
+                yield {"file_name": file_name, "image_path": image_path}
+
+        # 各画像ファイルをステージ間で並列に処理
+        records = iter_unregistered_records()
+        writer_connection = db_pool.acquire()
+        bulk_writer = BulkImageWriter(
+            writer_connection,
+            max_rows=args.write_batch_size,
+            max_interval=args.write_flush_interval,
+            on_flush=on_flush,
+            metrics=metrics,
+            quantize=args.quantize
+        )
+        stages = create_ingestion_stages(
+            generative_ai_inference_client, batch_embedder, bulk_writer, manifest, cache, registered_hashes, metrics, args, stats, stats_lock
+        )
+        try:
+            if args.async_mode:
+                # 読み込み・書き込みはスレッドで、モデル呼び出しはasyncioで並行処理
+                ingestion_errors = asyncio.run(run_async_ingestion(
+                    records, stages[0].func, stages[-1].func,
+                    generative_ai_inference_client, batch_embedder, manifest, cache, metrics, args, stats, stats_lock
+                ))
+            else:
+                pipeline = IngestionPipeline(stages, queue_size=args.queue_size)
+                pipeline.run(records)
+                ingestion_errors = pipeline.errors
+            # 残りのバッファを書き込む（失敗した行はサマリーに含め、例外はレポート出力後に送出する）
+            bulk_writer.close()
+        finally:
+            # 処理中の例外を隠さないよう、ここでの後始末の失敗は表示するだけにする
             try:
-                # 画像データを読み込む
-                with open(image_path, "rb") as image_file:
-                    image_data = image_file.read()
-                
-                # 画像データを挿入
-                if insert_image_to_db(generative_ai_inference_client, cohere_client, db_connection, image_data, file_name):
-                    newly_registered += 1
-                else:
-                    failed_registrations += 1
-                    
+                bulk_writer.close()
             except Exception as e:
-                print(f"画像 '{file_name}' の処理中にエラーが発生しました: {str(e)}")
-                raise
-        
+                print(f"一括挿入の終了処理中にエラーが発生しました: {e}")
+            writer_connection.close()
+            manifest.close()
+            if cache is not None:
+                cache_stats = cache.stats()
+                print(f"永続キャッシュ: ヒット {cache_stats['hits']} 件, ミス {cache_stats['misses']} 件, 削除 {cache_stats['evictions']} 件, サイズ {cache_stats['total_bytes'] / 1024 / 1024:.1f} MB")
+                cache.close()
+        failed_registrations = stats["failed_registrations"] + len(ingestion_errors)
+
         # 処理時間を計算
         end_time = time.time()
         processing_time = end_time - start_time
         
         # 統計情報を表示
         print("\n===== 処理結果サマリー =====")
-        print(f"ディレクトリ内の画像ファイル総数: {total_images}")
-        print(f"既に登録済みの画像数: {already_registered}")
-        print(f"今回新規登録した画像数: {newly_registered}")
+        print(f"ディレクトリ内の画像ファイル総数: {stats['total_images']}")
+        print(f"既に登録済みの画像数: {stats['already_registered']}")
+        print(f"内容が重複していた画像数: {stats['duplicate_content']}")
+        print(f"マニフェスト・キャッシュから再利用したモデル呼び出し数: {stats['resumed_calls']}")
+        print(f"今回新規登録した画像数: {stats['newly_registered']}")
         print(f"登録に失敗した画像数: {failed_registrations}")
         print(f"処理時間: {processing_time:.2f} 秒")
+        print(f"embed呼び出し回数: {batch_embedder.api_calls}")
+        if processing_time > 0:
+            print(f"スループット: {stats['newly_registered'] / processing_time:.2f} 枚/秒")
+
+        # ステージ別の計測結果をJSONレポートとして出力
+        report = metrics.report(processing_time, stats["newly_registered"], {
+            "mode": "async" if args.async_mode else "pipeline",
+            "summary": dict(stats, failed_registrations=failed_registrations)
+        })
+        metrics.print_summary(report)
+        report_path = args.report or time.strftime("ingest_report_%Y%m%d_%H%M%S.json")
+        metrics.write_json(report_path, report)
+        print(f"計測レポートを {report_path} に出力しました。")
+
+        if ingestion_errors:
+            _, _, first_error = ingestion_errors[0]
+            raise first_error
+        bulk_writer.raise_for_errors()
         
     except Exception as e:
         print("エラーが発生しました！")
@@ -274,6 +668,6 @@ if __name__ == "__main__":
         sys.exit(1)
     
     finally:
-        # DB接続を閉じる
-        if 'db_connection' in locals():
-            db_connection.close()
+        # DB接続プールを閉じる
+        if 'db_pool' in locals():
+            db_pool.close()
@@ -0,0 +1,79 @@
+import oracledb
+import time
+import sys
+import argparse
+from app.config import Config
+from app.image_renditions import make_renditions
+
+def backfill_renditions(db_connection, batch_size=50):
+    """縮小版画像が未生成の行について縮小版画像を生成し、まとめて更新する"""
+    updated = 0
+    failed = 0
+    last_image_id = -1
+    read_cursor = db_connection.cursor()
+    write_cursor = db_connection.cursor()
+    try:
+        while True:
+            # 未生成の行を画像IDの順に一定件数ずつ取得（キーセット方式で先へ進むため、失敗した行は読み飛ばす）
+            read_cursor.execute(f"""
+                SELECT image_id, image_data FROM IMAGES
+                WHERE thumbnail_data IS NULL
+                AND image_id > :1
+                ORDER BY image_id
+                FETCH FIRST {int(batch_size)} ROWS ONLY
+            """, [last_image_id])
+            rows = read_cursor.fetchall()
+            if not rows:
+                break
+            last_image_id = rows[-1][0]
+
+            update_rows = []
+            for image_id, image_data in rows:
+                try:
+                    renditions = make_renditions(image_data.read())
+                except Exception as e:
+                    print(f"画像ID {image_id} の縮小版画像の生成中にエラーが発生しました: {str(e)}")
+                    failed += 1
+                    continue
+                update_rows.append((renditions["thumbnail"], renditions["preview"], image_id))
+
+            if update_rows:
+                write_cursor.setinputsizes(oracledb.DB_TYPE_LONG_RAW, oracledb.DB_TYPE_LONG_RAW, None)
+                write_cursor.executemany(
+                    "UPDATE IMAGES SET thumbnail_data = :1, preview_data = :2 WHERE image_id = :3",
+                    update_rows
+                )
+                db_connection.commit()
+                updated += len(update_rows)
+            print(f"{updated} 件の画像の縮小版画像を生成しました。")
+    finally:
+        read_cursor.close()
+        write_cursor.close()
+    return updated, failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="登録済み画像のギャラリー用縮小版画像（サムネイル・プレビュー）を生成します。")
+    parser.add_argument("--batch-size", type=int, default=50, help="1回の更新・コミットでまとめて処理する行数")
+    args = parser.parse_args()
+
+    # 処理開始時間を記録
+    start_time = time.time()
+    config = Config()
+    try:
+        db_connection = config.get_db_connection()
+        print("データベース接続成功!")
+        updated, failed = backfill_renditions(db_connection, args.batch_size)
+        
+        print("\n===== 処理結果サマリー =====")
+        print(f"縮小版画像を生成した画像数: {updated}")
+        print(f"生成に失敗した画像数: {failed}")
+        print(f"処理時間: {time.time() - start_time:.2f} 秒")
+    except Exception as e:
+        print("エラーが発生しました！")
+        print(f"エラーの種類: {type(e).__name__}")
+        print(f"エラーの内容: {str(e)}")
+        sys.exit(1)
+    finally:
+        # DB接続を閉じる
+        if 'db_connection' in locals():
+            db_connection.close()
@@ -0,0 +1,34 @@
+import time
+import sys
+import argparse
+from app.config import Config
+from app.embedding_snapshot import export_snapshot, prune_snapshots
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="登録済み画像の埋め込みベクトルをメモリマップ可能なスナップショットに書き出します。")
+    parser.add_argument("--output", default="embedding_snapshots", help="スナップショットの出力先ディレクトリ")
+    parser.add_argument("--batch-size", type=int, default=1000, help="1回のフェッチで読み込む行数")
+    parser.add_argument("--keep", type=int, default=2, help="残しておくスナップショットの数")
+    args = parser.parse_args()
+
+    # 処理開始時間を記録
+    start_time = time.time()
+    config = Config()
+    try:
+        db_connection = config.get_db_connection()
+        print("データベース接続成功!")
+        snapshot_path = export_snapshot(db_connection, args.output, args.batch_size)
+        prune_snapshots(args.output, args.keep)
+
+        print("\n===== 処理結果サマリー =====")
+        print(f"スナップショット: {snapshot_path}")
+        print(f"処理時間: {time.time() - start_time:.2f} 秒")
+    except Exception as e:
+        print("エラーが発生しました！")
+        print(f"エラーの種類: {type(e).__name__}")
+        print(f"エラーの内容: {str(e)}")
+        sys.exit(1)
+    finally:
+        # DB接続を閉じる
+        if 'db_connection' in locals():
+            db_connection.close()
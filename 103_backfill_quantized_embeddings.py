@@ -0,0 +1,77 @@
+import time
+import sys
+import argparse
+from app.config import Config
+from app.vector_quantization import quantize_binary, quantize_int8
+
+def backfill_quantized_embeddings(db_connection, batch_size=500):
+    """量子化版の埋め込みベクトルが未生成の行について、float32の埋め込みベクトルから生成してまとめて更新する"""
+    updated = 0
+    last_image_id = -1
+    read_cursor = db_connection.cursor()
+    write_cursor = db_connection.cursor()
+    try:
+        while True:
+            # 画像IDの順に一定件数ずつ取得（キーセット方式で先へ進む）
+            read_cursor.execute(f"""
+                SELECT image_id, caption_embedding, image_embedding FROM IMAGES
+                WHERE (caption_embedding_bin IS NULL OR image_embedding_bin IS NULL)
+                AND image_id > :1
+                ORDER BY image_id
+                FETCH FIRST {int(batch_size)} ROWS ONLY
+            """, [last_image_id])
+            rows = read_cursor.fetchall()
+            if not rows:
+                break
+            last_image_id = rows[-1][0]
+
+            update_rows = []
+            for image_id, caption_embedding, image_embedding in rows:
+                if caption_embedding is None or image_embedding is None:
+                    print(f"画像ID {image_id} は埋め込みベクトルがないためスキップします。")
+                    continue
+                update_rows.append((
+                    quantize_int8(caption_embedding), quantize_binary(caption_embedding),
+                    quantize_int8(image_embedding), quantize_binary(image_embedding),
+                    image_id
+                ))
+
+            if update_rows:
+                write_cursor.executemany("""
+                    UPDATE IMAGES SET caption_embedding_int8 = :1, caption_embedding_bin = :2,
+                        image_embedding_int8 = :3, image_embedding_bin = :4
+                    WHERE image_id = :5
+                """, update_rows)
+                db_connection.commit()
+                updated += len(update_rows)
+            print(f"{updated} 件の画像の量子化版の埋め込みベクトルを生成しました。")
+    finally:
+        read_cursor.close()
+        write_cursor.close()
+    return updated
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="登録済み画像の埋め込みベクトルのint8・バイナリ量子化版を生成します。")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回の更新・コミットでまとめて処理する行数")
+    args = parser.parse_args()
+
+    # 処理開始時間を記録
+    start_time = time.time()
+    config = Config()
+    try:
+        db_connection = config.get_db_connection()
+        print("データベース接続成功!")
+        updated = backfill_quantized_embeddings(db_connection, args.batch_size)
+
+        print("\n===== 処理結果サマリー =====")
+        print(f"量子化版を生成した画像数: {updated}")
+        print(f"処理時間: {time.time() - start_time:.2f} 秒")
+    except Exception as e:
+        print("エラーが発生しました！")
+        print(f"エラーの種類: {type(e).__name__}")
+        print(f"エラーの内容: {str(e)}")
+        sys.exit(1)
+    finally:
+        # DB接続を閉じる
+        if 'db_connection' in locals():
+            db_connection.close()
@@ -0,0 +1,209 @@
+import time
+import sys
+import argparse
+from app.config import Config
+from app.batch_embedder import BatchEmbedder
+from app.image_payload import ImagePayload
+from app.embedding_dimension import SUPPORTED_EMBEDDING_DIMENSIONS, truncate_embedding
+from app.vector_quantization import quantize_binary, quantize_int8
+
+# 埋め込みモデルのID
+EMBED_MODEL_ID = "embed-v4.0"
+EMBEDDING_COLUMNS = ("caption_embedding", "image_embedding")
+# 埋め込みベクトルの列ごとの Vector index
+VECTOR_INDEXES = {"caption_embedding": "idx_caption_embedding", "image_embedding": "idx_image_embedding"}
+
+def load_image_columns(db_connection):
+    """IMAGESテーブルの列名（小文字）の集合を返す"""
+    cursor = db_connection.cursor()
+    try:
+        cursor.execute("SELECT LOWER(column_name) FROM USER_TAB_COLUMNS WHERE table_name = 'IMAGES'")
+        return {row[0] for row in cursor.fetchall()}
+    finally:
+        cursor.close()
+
+def new_column_definitions(dimension, quantized):
+    """移行先の次元数で作成する一時的な列（列名_new）とその型"""
+    definitions = {}
+    for column in EMBEDDING_COLUMNS:
+        definitions[f"{column}_new"] = f"VECTOR({dimension}, FLOAT32)"
+        if quantized:
+            definitions[f"{column}_int8_new"] = "VECTOR(*, INT8)"
+            definitions[f"{column}_bin_new"] = f"VECTOR({dimension}, BINARY)"
+    return definitions
+
+def swap_statements(dimension, quantized):
+    """Vector indexを削除して一時的な列を元の列名に置き換え、Vector indexを作り直すDDL"""
+    old_columns = [name[:-len("_new")] for name in new_column_definitions(dimension, quantized)]
+    statements = [f"DROP INDEX IF EXISTS {VECTOR_INDEXES[column]}" for column in EMBEDDING_COLUMNS]
+    statements.append(f"ALTER TABLE IMAGES DROP ({', '.join(old_columns)})")
+    statements.extend(f"ALTER TABLE IMAGES RENAME COLUMN {column}_new TO {column}" for column in old_columns)
+    for column in EMBEDDING_COLUMNS:
+        statements.append(
+            f"CREATE VECTOR INDEX {VECTOR_INDEXES[column]} ON IMAGES ({column}) "
+            f"ORGANIZATION NEIGHBOR PARTITIONS WITH DISTANCE DOT WITH TARGET ACCURACY 95"
+        )
+    return statements
+
+def fill_new_columns(db_connection, dimension, quantized, batch_embedder=None, batch_size=500):
+    """移行先の列が未設定の行について、既存の埋め込みベクトルを切り詰めて（batch_embedderを渡すと再埋め込みして）書き込む"""
+    updated = 0
+    skipped = 0
+    failed = 0
+    last_image_id = -1
+    read_cursor = db_connection.cursor()
+    write_cursor = db_connection.cursor()
+    assignments = ["caption_embedding_new = :1", "image_embedding_new = :2"]
+    if quantized:
+        assignments += [
+            "caption_embedding_int8_new = :3", "caption_embedding_bin_new = :4",
+            "image_embedding_int8_new = :5", "image_embedding_bin_new = :6"
+        ]
+    update_sql = f"UPDATE IMAGES SET {', '.join(assignments)} WHERE image_id = :{len(assignments) + 1}"
+    try:
+        while True:
+            # 画像IDの順に一定件数ずつ取得（キーセット方式で先へ進む）
+            read_cursor.execute(f"""
+                SELECT image_id, caption, caption_embedding, image_embedding FROM IMAGES
+                WHERE caption_embedding_new IS NULL
+                AND image_id > :1
+                ORDER BY image_id
+                FETCH FIRST {int(batch_size)} ROWS ONLY
+            """, [last_image_id])
+            rows = read_cursor.fetchall()
+            if not rows:
+                break
+            last_image_id = rows[-1][0]
+
+            originals = {image_id: (caption_embedding, image_embedding) for image_id, _, caption_embedding, image_embedding in rows}
+            sources = reembed_rows(db_connection, batch_embedder, rows) if batch_embedder is not None else originals
+
+            update_rows = []
+            for image_id, (caption_embedding, image_embedding) in sources.items():
+                if None in originals[image_id]:
+                    print(f"画像ID {image_id} は埋め込みベクトルがないためスキップします。")
+                    skipped += 1
+                    continue
+                if caption_embedding is None or image_embedding is None:
+                    failed += 1
+                    continue
+                if min(len(caption_embedding), len(image_embedding)) < dimension:
+                    # 切り詰めでは次元数を増やせないため、再埋め込みが必要
+                    print(f"画像ID {image_id} の埋め込みベクトルは {dimension} 次元より短いため移行できません（--reembed で再生成してください）。")
+                    failed += 1
+                    continue
+                caption_embedding = truncate_embedding(caption_embedding, dimension)
+                image_embedding = truncate_embedding(image_embedding, dimension)
+                if quantized:
+                    update_rows.append((
+                        caption_embedding, image_embedding,
+                        quantize_int8(caption_embedding), quantize_binary(caption_embedding),
+                        quantize_int8(image_embedding), quantize_binary(image_embedding),
+                        image_id
+                    ))
+                else:
+                    update_rows.append((caption_embedding, image_embedding, image_id))
+
+            if update_rows:
+                write_cursor.executemany(update_sql, update_rows)
+                db_connection.commit()
+                updated += len(update_rows)
+            print(f"{updated} 件の画像の埋め込みベクトルを {dimension} 次元に移行しました。")
+    finally:
+        read_cursor.close()
+        write_cursor.close()
+    return updated, skipped, failed
+
+def reembed_rows(db_connection, batch_embedder, rows):
+    """キャプションと画像を埋め込み直し、画像IDごとの (キャプション, 画像) の埋め込みベクトルを返す（失敗した方はNone）"""
+    image_ids = [row[0] for row in rows]
+    caption_embeddings, caption_errors = batch_embedder.embed_texts([row[1] for row in rows], "search_document")
+    data_urls = []
+    cursor = db_connection.cursor()
+    try:
+        for image_id in image_ids:
+            cursor.execute("SELECT image_data FROM IMAGES WHERE image_id = :1", [image_id])
+            data_urls.append(ImagePayload(cursor.fetchone()[0].read()).data_url)
+    finally:
+        cursor.close()
+    image_embeddings, image_errors = batch_embedder.embed_images(data_urls)
+    for i, error in list(caption_errors.items()) + list(image_errors.items()):
+        print(f"画像ID {image_ids[i]} の再埋め込みに失敗しました: {error}")
+    return {
+        image_id: (
+            None if i in caption_errors else caption_embeddings[i],
+            None if i in image_errors else image_embeddings[i]
+        )
+        for i, image_id in enumerate(image_ids)
+    }
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="登録済み画像の埋め込みベクトルの次元数を変更し、列とVector indexを作り直します。")
+    parser.add_argument("--dimension", type=int, required=True, choices=SUPPORTED_EMBEDDING_DIMENSIONS, help="移行先の埋め込みベクトルの次元数")
+    parser.add_argument("--reembed", action="store_true", help="既存のベクトルを切り詰める代わりにCohereで再埋め込みする（次元数を増やす場合は必須）")
+    parser.add_argument("--batch-size", type=int, default=500, help="1回の更新・コミットでまとめて処理する行数")
+    parser.add_argument("--no-swap", action="store_true", help="移行先の列への書き込みだけを行い、列の置き換えとVector indexの再作成は行わない")
+    parser.add_argument("--dry-run", action="store_true", help="実行するDDLを表示するだけで変更しない")
+    args = parser.parse_args()
+
+    # 処理開始時間を記録
+    start_time = time.time()
+    config = Config()
+    try:
+        db_connection = config.get_db_connection()
+        print("データベース接続成功!")
+        columns = load_image_columns(db_connection)
+        # 量子化版の列がある場合はそれも移行先の次元数で作り直す
+        quantized = "caption_embedding_bin" in columns
+        definitions = new_column_definitions(args.dimension, quantized)
+        missing = {name: column_type for name, column_type in definitions.items() if name not in columns}
+        add_statement = f"ALTER TABLE IMAGES ADD ({', '.join(f'{name} {column_type}' for name, column_type in missing.items())})" if missing else None
+        statements = swap_statements(args.dimension, quantized)
+
+        if args.dry_run:
+            print("\n===== 実行するDDL =====")
+            for statement in ([add_statement] if add_statement else []) + ([] if args.no_swap else statements):
+                print(statement + ";")
+            sys.exit(0)
+
+        # 1. 移行先の次元数の列を追加（中断後の再実行では追加済みの列をそのまま使う）
+        cursor = db_connection.cursor()
+        if add_statement:
+            cursor.execute(add_statement)
+            print(f"移行先の列を追加しました: {', '.join(missing)}")
+
+        # 2. 移行先の列に書き込む（検索は移行前の列で続けられる）
+        batch_embedder = None
+        if args.reembed:
+            batch_embedder = BatchEmbedder(config.get_cohere_client(), model=EMBED_MODEL_ID)
+        updated, skipped, failed = fill_new_columns(db_connection, args.dimension, quantized, batch_embedder, args.batch_size)
+
+        # 3. 列を置き換えてVector indexを作り直す（移行できなかった行がある場合は元の列を残す）
+        swapped = not args.no_swap and failed == 0
+        if swapped:
+            for statement in statements:
+                print(statement)
+                cursor.execute(statement)
+        cursor.close()
+
+        print("\n===== 処理結果サマリー =====")
+        print(f"移行先の次元数: {args.dimension}")
+        print(f"移行した画像数: {updated}")
+        print(f"埋め込みベクトルがなくスキップした画像数: {skipped}")
+        print(f"移行に失敗した画像数: {failed}")
+        if batch_embedder is not None:
+            print(f"embed呼び出し回数: {batch_embedder.api_calls}")
+        if not swapped:
+            print("列の置き換えは行っていません。失敗した画像を解消してから --no-swap なしで再実行すると置き換えます。")
+        else:
+            print(f"環境変数 EMBEDDING_DIMENSION を {args.dimension} に設定し、スナップショットを使う場合は 102_export_embedding_snapshot.py で出力し直してください。")
+        print(f"処理時間: {time.time() - start_time:.2f} 秒")
+    except Exception as e:
+        print("エラーが発生しました！")
+        print(f"エラーの種類: {type(e).__name__}")
+        print(f"エラーの内容: {str(e)}")
+        sys.exit(1)
+    finally:
+        # DB接続を閉じる
+        if 'db_connection' in locals():
+            db_connection.close()
@@ -0,0 +1,81 @@
+import hashlib
+import time
+import sys
+import argparse
+from app.config import Config
+
+def backfill_content_hash(db_connection, batch_size=100):
+    """コンテンツハッシュが未設定の行について、登録済みの画像データのSHA-256を計算してまとめて更新する"""
+    updated = 0
+    last_image_id = -1
+    read_cursor = db_connection.cursor()
+    write_cursor = db_connection.cursor()
+    try:
+        while True:
+            # 画像IDの順に一定件数ずつ取得（キーセット方式で先へ進む）
+            read_cursor.execute(f"""
+                SELECT image_id, image_data FROM IMAGES
+                WHERE content_hash IS NULL
+                AND image_id > :1
+                ORDER BY image_id
+                FETCH FIRST {int(batch_size)} ROWS ONLY
+            """, [last_image_id])
+            rows = read_cursor.fetchall()
+            if not rows:
+                break
+            last_image_id = rows[-1][0]
+
+            # 登録時（ImagePayload）と同じく、IMAGESに格納した画像データそのもののハッシュを使う
+            update_rows = [(hashlib.sha256(image_data.read()).hexdigest(), image_id) for image_id, image_data in rows]
+            write_cursor.executemany("UPDATE IMAGES SET content_hash = :1 WHERE image_id = :2", update_rows)
+            db_connection.commit()
+            updated += len(update_rows)
+            print(f"{updated} 件の画像のコンテンツハッシュを設定しました。")
+    finally:
+        read_cursor.close()
+        write_cursor.close()
+    return updated
+
+def count_duplicate_hashes(db_connection):
+    """同じ内容で重複して登録されている画像のグループ数と余分な行数を返す"""
+    cursor = db_connection.cursor()
+    try:
+        cursor.execute("""
+            SELECT COUNT(*), COALESCE(SUM(cnt - 1), 0) FROM (
+                SELECT COUNT(*) AS cnt FROM IMAGES
+                WHERE content_hash IS NOT NULL
+                GROUP BY content_hash
+                HAVING COUNT(*) > 1
+            )
+        """)
+        return cursor.fetchone()
+    finally:
+        cursor.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="登録済み画像のコンテンツハッシュ（SHA-256）を生成します（sql/alter_images_add_content_hash.sql の適用後に実行）。")
+    parser.add_argument("--batch-size", type=int, default=100, help="1回の更新・コミットでまとめて処理する行数")
+    args = parser.parse_args()
+
+    # 処理開始時間を記録
+    start_time = time.time()
+    config = Config()
+    try:
+        db_connection = config.get_db_connection()
+        print("データベース接続成功!")
+        updated = backfill_content_hash(db_connection, args.batch_size)
+        duplicate_groups, duplicate_rows = count_duplicate_hashes(db_connection)
+
+        print("\n===== 処理結果サマリー =====")
+        print(f"コンテンツハッシュを設定した画像数: {updated}")
+        print(f"同じ内容で重複登録されている画像: {duplicate_groups} 組（余分な行 {duplicate_rows} 件）")
+        print(f"処理時間: {time.time() - start_time:.2f} 秒")
+    except Exception as e:
+        print("エラーが発生しました！")
+        print(f"エラーの種類: {type(e).__name__}")
+        print(f"エラーの内容: {str(e)}")
+        sys.exit(1)
+    finally:
+        # DB接続を閉じる
+        if 'db_connection' in locals():
+            db_connection.close()
@@ -0,0 +1,208 @@
+import asyncio
+import time
+
+def is_throttle_error(error):
+    """レート制限（429）またはタイムアウトによるエラーかどうかを判定"""
+    for attr in ("status", "status_code", "http_status"):
+        if getattr(error, attr, None) == 429:
+            return True
+    if isinstance(error, (asyncio.TimeoutError, TimeoutError)):
+        return True
+    return "timeout" in type(error).__name__.lower() or "toomanyrequests" in type(error).__name__.lower()
+
+class TokenBucket:
+    """一定レートでトークンを補充し、リクエスト送信レートの上限を守るトークンバケット"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        """トークンを1つ取得できるまで待機する"""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+class AdaptiveConcurrencyLimiter:
+    """AIMD方式で同時実行数を調整するリミッター
+
+    成功が続くと同時実行数を1ずつ増やし（加算増加）、
+    レート制限・タイムアウトを受けると半分に減らす（乗算減少）。
+    """
+
+    def __init__(self, initial=4, minimum=1, maximum=64, increase_every=None):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase_every = increase_every
+        self.in_flight = 0
+        self._successes = 0
+        self._condition = asyncio.Condition()
+
+    async def acquire(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+
+    async def release(self):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    async def on_success(self):
+        async with self._condition:
+            self._successes += 1
+            # 現在の同時実行数ぶん成功したら1増やす（1ウィンドウあたり+1）
+            if self._successes >= (self.increase_every or self.limit):
+                self._successes = 0
+                if self.limit < self.maximum:
+                    self.limit += 1
+                    self._condition.notify_all()
+
+    async def on_throttle(self):
+        async with self._condition:
+            self._successes = 0
+            self.limit = max(self.minimum, self.limit // 2)
+
+class ProviderStats:
+    """プロバイダーごとのリクエスト数・レイテンシー・スループットの計測値"""
+
+    def __init__(self, name):
+        self.name = name
+        self.requests = 0
+        self.throttled = 0
+        self.errors = 0
+        self.latencies = []
+        self.started = time.monotonic()
+
+    def record(self, latency):
+        self.requests += 1
+        self.latencies.append(latency)
+
+    def summary(self):
+        elapsed = time.monotonic() - self.started
+        latencies = sorted(self.latencies)
+        p50 = latencies[len(latencies) // 2] if latencies else 0.0
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))] if latencies else 0.0
+        average = sum(latencies) / len(latencies) if latencies else 0.0
+        throughput = self.requests / elapsed if elapsed > 0 else 0.0
+        return (
+            f"{self.name}: リクエスト {self.requests} 件, レート制限 {self.throttled} 件, エラー {self.errors} 件, "
+            f"平均 {average:.3f} 秒, p50 {p50:.3f} 秒, p95 {p95:.3f} 秒, スループット {throughput:.2f} 件/秒"
+        )
+
+class ProviderGate:
+    """トークンバケット・AIMDリミッター・計測をまとめたプロバイダーごとの呼び出し口"""
+
+    def __init__(self, name, rate, initial_concurrency=4, max_concurrency=64, max_retries=5, backoff=1.0):
+        self.name = name
+        self.bucket = TokenBucket(rate)
+        self.limiter = AdaptiveConcurrencyLimiter(initial=initial_concurrency, maximum=max_concurrency)
+        self.stats = ProviderStats(name)
+        self.max_retries = max_retries
+        self.backoff = backoff
+
+    async def call(self, operation, metrics=None, stage=None, nbytes=0):
+        """operation（コルーチンを返す関数）を実行し、レート制限時は同時実行数を下げて再試行する
+
+        metrics と stage を指定すると、成功した呼び出しの所要時間をプロバイダーの応答時間として stage に、
+        同時実行数・レートの制限やバックオフによる待ち時間（再試行した呼び出しを含む）を
+        "<stage>_gate_wait" に分けて記録する。
+        """
+        retries = 0
+        call_start = time.perf_counter()
+        while True:
+            await self.limiter.acquire()
+            try:
+                await self.bucket.acquire()
+                start = time.monotonic()
+                service_start = time.perf_counter()
+                result = await operation()
+                service_seconds = time.perf_counter() - service_start
+                self.stats.record(time.monotonic() - start)
+                await self.limiter.on_success()
+                if metrics is not None and stage is not None:
+                    metrics.record(stage, service_seconds, nbytes)
+                    metrics.record(f"{stage}_gate_wait", time.perf_counter() - call_start - service_seconds)
+                return result
+            except Exception as e:
+                if not is_throttle_error(e) or retries >= self.max_retries:
+                    self.stats.errors += 1
+                    raise
+                self.stats.throttled += 1
+                await self.limiter.on_throttle()
+                retries += 1
+                delay = self.backoff * (2 ** (retries - 1))
+                print(f"{self.name}: レート制限を検出しました（リトライ {retries}/{self.max_retries}、同時実行数 {self.limiter.limit}）")
+            finally:
+                await self.limiter.release()
+            await asyncio.sleep(delay)
+
+    def summary(self):
+        return f"{self.stats.summary()}, 同時実行数 {self.limiter.limit}"
+
+class AsyncEmbeddingBatcher:
+    """同時に届いた埋め込みの要求を短い時間枠でまとめ、1回のバッチ呼び出しで処理するクラス
+
+    embed_batch は入力のリストを受け取り、(入力順の埋め込みリスト, 失敗した入力のインデックス→例外) を返す
+    コルーチン関数（BatchEmbedder.embed_texts / embed_images と同じ戻り値）。
+    max_batch 件そろうか、最初の要求から window 秒が経つとまとめて呼び出す。
+    """
+
+    def __init__(self, embed_batch, max_batch, window=0.5):
+        self.embed_batch = embed_batch
+        self.max_batch = max(1, int(max_batch))
+        self.window = window
+        self.requests = 0
+        self.batches = 0
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def embed(self, item):
+        """入力の埋め込みベクトルを返す（他の同時の要求とまとめて取得する）"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.requests += 1
+        self._pending.append((item, future))
+        if len(self._pending) >= self.max_batch:
+            self._start_flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._start_flush)
+        return await future
+
+    def _start_flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            self.batches += 1
+            task = asyncio.create_task(self._flush(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _flush(self, batch):
+        try:
+            embeddings, errors = await self.embed_batch([item for item, _ in batch])
+        except Exception as e:
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for i, (_, future) in enumerate(batch):
+            if future.done():
+                continue
+            if i in errors:
+                future.set_exception(errors[i])
+            else:
+                future.set_result(embeddings[i])
@@ -0,0 +1,113 @@
+import threading
+import time
+from app.async_ingestion import is_throttle_error
+
+def is_input_error(error):
+    """入力の内容が原因のエラー（レート制限・タイムアウト以外の4xx、件数の不一致など）かどうかを判定"""
+    if is_throttle_error(error):
+        return False
+    for attr in ("status", "status_code", "http_status"):
+        status = getattr(error, attr, None)
+        if isinstance(status, int):
+            return 400 <= status < 500 and status != 408
+    return isinstance(error, (ValueError, TypeError))
+
+class BatchEmbedder:
+    """Cohere embedをバッチ単位でまとめて呼び出すクラス
+
+    入力をプロバイダーの1リクエストあたりの上限ごとに分割して呼び出し、
+    結果を入力順に対応づけて返す。入力が原因のエラーでバッチが失敗した場合は二分割して再試行し、
+    原因となった入力だけを失敗として切り分ける。レート制限・タイムアウトなどの一時的なエラーは
+    分割せずに同じバッチを指数バックオフで再試行する。
+    retry_throttles=False の場合はレート制限を再試行せずに送出し、
+    同時実行数の調整と再試行を呼び出し元（asyncモードの ProviderGate）に任せる。
+    """
+
+    # Cohere Embed APIの1リクエストあたりの上限
+    MAX_TEXTS_PER_CALL = 96
+    MAX_IMAGES_PER_CALL = 1
+
+    def __init__(self, cohere_client, model="embed-v4.0", max_texts_per_call=None, max_images_per_call=None, max_retries=5, backoff=1.0, retry_throttles=True):
+        self.cohere_client = cohere_client
+        self.model = model
+        self.max_texts_per_call = max_texts_per_call or self.MAX_TEXTS_PER_CALL
+        self.max_images_per_call = max_images_per_call or self.MAX_IMAGES_PER_CALL
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.retry_throttles = retry_throttles
+        self.api_calls = 0
+        # 複数の埋め込みワーカーから呼ばれるため、呼び出し回数の更新はロックで保護する
+        self._stats_lock = threading.Lock()
+
+    def _count_call(self):
+        with self._stats_lock:
+            self.api_calls += 1
+
+    def _call_texts(self, texts, input_type):
+        self._count_call()
+        response = self.cohere_client.embed(
+            texts=texts,
+            model=self.model,
+            input_type=input_type
+        )
+        return list(response.embeddings)
+
+    def _call_images(self, data_urls):
+        self._count_call()
+        response = self.cohere_client.embed(
+            images=data_urls,
+            model=self.model,
+            input_type="image",
+            embedding_types=["float"],
+        )
+        return list(response.embeddings.float)
+
+    def _call_with_retry(self, call, inputs):
+        """バッチを呼び出し、一時的なエラーの場合は同じバッチを指数バックオフで再試行する"""
+        retries = 0
+        while True:
+            try:
+                vectors = call(inputs)
+                if len(vectors) != len(inputs):
+                    raise ValueError(f"埋め込みベクトル数が入力数と一致しません（入力 {len(inputs)} 件、結果 {len(vectors)} 件）")
+                return vectors
+            except Exception as e:
+                if is_input_error(e) or retries >= self.max_retries or (is_throttle_error(e) and not self.retry_throttles):
+                    raise
+                retries += 1
+                delay = self.backoff * (2 ** (retries - 1))
+                print(f"Cohere embed: 一時的なエラーのため {delay:.1f} 秒後に再試行します（リトライ {retries}/{self.max_retries}）: {e}")
+                time.sleep(delay)
+
+    def _embed_with_split(self, call, inputs, offset, embeddings, errors):
+        """バッチを呼び出し、入力が原因の失敗時は二分割して不正な入力を特定する"""
+        try:
+            vectors = self._call_with_retry(call, inputs)
+            for i, vector in enumerate(vectors):
+                embeddings[offset + i] = vector
+        except Exception as e:
+            if is_throttle_error(e) and not self.retry_throttles:
+                raise
+            if len(inputs) == 1 or not is_input_error(e):
+                # 再試行しても解消しない一時的なエラーは分割せず、バッチ全体を失敗とする
+                for i in range(len(inputs)):
+                    errors[offset + i] = e
+                return
+            middle = len(inputs) // 2
+            self._embed_with_split(call, inputs[:middle], offset, embeddings, errors)
+            self._embed_with_split(call, inputs[middle:], offset + middle, embeddings, errors)
+
+    def _embed(self, call, inputs, batch_size):
+        embeddings = [None] * len(inputs)
+        errors = {}
+        for start in range(0, len(inputs), batch_size):
+            self._embed_with_split(call, inputs[start:start + batch_size], start, embeddings, errors)
+        return embeddings, errors
+
+    def embed_texts(self, texts, input_type="search_document"):
+        """テキストのリストを埋め込み、(入力順の埋め込みリスト, 失敗した入力のインデックス→例外) を返す"""
+        return self._embed(lambda batch: self._call_texts(batch, input_type), list(texts), self.max_texts_per_call)
+
+    def embed_images(self, data_urls):
+        """画像Data URLのリストを埋め込み、(入力順の埋め込みリスト, 失敗した入力のインデックス→例外) を返す"""
+        return self._embed(self._call_images, list(data_urls), self.max_images_per_call)
@@ -0,0 +1,132 @@
+import threading
+import time
+import oracledb
+from app.vector_quantization import quantize_binary, quantize_int8
+
+class BulkImageWriter:
+    """IMAGES表への挿入をバッファリングし、配列DMLでまとめて書き込むクラス
+
+    バッファが max_rows 件に達するか、最後のフラッシュから max_interval 秒が経過すると
+    executemany（batcherrors有効）で一括挿入し、1回だけコミットする。
+    idx_image_caption は SYNC (ON COMMIT) のため、コミット回数を減らすことで
+    Oracle Text の同期回数も減る。
+    quantize=True の場合は埋め込みベクトルのint8・バイナリ量子化版の列も書き込む。
+    """
+
+    INSERT_SQL = """
+        INSERT INTO IMAGES (file_name, caption, caption_embedding, image_data, image_embedding, content_hash,
+            thumbnail_data, preview_data)
+        VALUES (:1, :2, :3, :4, :5, :6, :7, :8)
+    """
+
+    QUANTIZED_INSERT_SQL = """
+        INSERT INTO IMAGES (file_name, caption, caption_embedding, image_data, image_embedding, content_hash,
+            thumbnail_data, preview_data,
+            caption_embedding_int8, caption_embedding_bin, image_embedding_int8, image_embedding_bin)
+        VALUES (:1, :2, :3, :4, :5, :6, :7, :8, :9, :10, :11, :12)
+    """
+
+    def __init__(self, db_connection, max_rows=50, max_interval=5.0, on_flush=None, metrics=None, quantize=False):
+        self.db_connection = db_connection
+        self.quantize = quantize
+        self.insert_sql = self.QUANTIZED_INSERT_SQL if quantize else self.INSERT_SQL
+        self.metrics = metrics
+        self.max_rows = max(1, int(max_rows))
+        self.max_interval = max_interval
+        self.on_flush = on_flush
+        self.rows_written = 0
+        self.rows_failed = 0
+        self.flush_count = 0
+        # 書き込みに失敗した配列DML・コミットの例外（close() で呼び出し元に送出する）
+        self.errors = []
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._last_flush = time.time()
+        self._closed = threading.Event()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="bulk-writer-flush", daemon=True)
+        self._flush_thread.start()
+
+    def add(self, row):
+        """1行分の値（INSERT_SQLのバインド順）をバッファに追加する"""
+        if self.quantize:
+            caption_embedding, image_embedding = row[2], row[4]
+            row = tuple(row) + (
+                quantize_int8(caption_embedding), quantize_binary(caption_embedding),
+                quantize_int8(image_embedding), quantize_binary(image_embedding)
+            )
+        with self._lock:
+            self._buffer.append(row)
+            if len(self._buffer) >= self.max_rows:
+                self._flush_locked()
+
+    def flush(self):
+        """バッファ内の行をすべて書き込む"""
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_loop(self):
+        """一定時間書き込みがない場合にもバッファをフラッシュするバックグラウンドスレッド"""
+        while not self._closed.wait(min(self.max_interval, 1.0)):
+            with self._lock:
+                if self._buffer and time.time() - self._last_flush >= self.max_interval:
+                    self._flush_locked()
+
+    def _flush_locked(self):
+        self._last_flush = time.time()
+        if not self._buffer:
+            return
+        rows, self._buffer = self._buffer, []
+
+        try:
+            cursor = self.db_connection.cursor()
+            try:
+                # BLOB列はLONG RAWとしてバインドし、一時LOBを作らずに配列で送る
+                cursor.setinputsizes(*[oracledb.DB_TYPE_LONG_RAW if isinstance(value, bytes) else None for value in rows[0]])
+                start = time.perf_counter()
+                cursor.executemany(self.insert_sql, rows, batcherrors=True)
+                failed = [(rows[error.offset], error.message) for error in cursor.getbatcherrors()]
+                inserted = time.perf_counter()
+                self.db_connection.commit()
+                if self.metrics is not None:
+                    nbytes = sum(len(value) for row in rows for value in row if isinstance(value, bytes))
+                    self.metrics.record("insert", inserted - start, nbytes)
+                    self.metrics.record("commit", time.perf_counter() - inserted)
+            finally:
+                cursor.close()
+        except Exception as e:
+            # バッファから取り出した行をすべて失敗として報告し、フラッシュスレッドは止めない
+            self.errors.append(e)
+            try:
+                self.db_connection.rollback()
+            except Exception:
+                pass
+            failed = [(row, str(e)) for row in rows]
+
+        self.flush_count += 1
+        self.rows_failed += len(failed)
+        self.rows_written += len(rows) - len(failed)
+
+        failed_ids = {id(row) for row, _ in failed}
+        written = [row for row in rows if id(row) not in failed_ids]
+        for row, message in failed:
+            print(f"画像 '{row[0]}' の挿入中にエラーが発生しました: {message}")
+        print(f"{len(written)} 件の画像をまとめて挿入しました（失敗 {len(failed)} 件）。")
+        if self.on_flush is not None:
+            self.on_flush(written, failed)
+
+    def close(self):
+        """バックグラウンドスレッドを停止し、残りのバッファを書き込む（2回目以降は何もしない）
+
+        書き込みの失敗はここでは送出しないため、例外の処理中に finally から呼んでも元の例外を隠さない。
+        失敗の有無は raise_for_errors で確認する。
+        """
+        if self._closed.is_set():
+            return
+        self._closed.set()
+        self._flush_thread.join()
+        self.flush()
+
+    def raise_for_errors(self):
+        """一括挿入・コミットに失敗していた場合は最後の例外を送出する"""
+        if self.errors:
+            raise RuntimeError(f"{len(self.errors)} 回の一括挿入に失敗しました（{self.rows_failed} 行）: {self.errors[-1]}") from self.errors[-1]
@@ -8,6 +8,11 @@ class Config:
     def __init__(self):
         # 環境変数を読み込む
         load_dotenv(find_dotenv())
+        # localバックエンドでスナップショットと画像ディレクトリを指定した場合はデータベースに接続しない
+        self.requires_database = not (
+            os.getenv("SEARCH_BACKEND", "oracle") == "local"
+            and os.getenv("LOCAL_SNAPSHOT_DIR") and os.getenv("LOCAL_IMAGE_DIR")
+        )
         self._validate_env_vars()
         self._init_config()
         
@@ -24,6 +29,8 @@ class Config:
             "OCI_COMPARTMENT_ID",
             "OCI_GENAI_MLLM_MODEL_ID"
         ]
+        if not self.requires_database:
+            required_env_vars = [var for var in required_env_vars if var not in ("TNS_ADMIN", "DB_USER", "DB_PASSWORD", "DB_DSN")]
         
         # 環境変数の存在確認
         missing_vars = []
@@ -55,6 +62,58 @@ class Config:
         self.compartment_id = os.getenv("OCI_COMPARTMENT_ID") 
         self.mllm_model_id = os.getenv("OCI_GENAI_MLLM_MODEL_ID")
         
+        # ギャラリーのタイルの最大辺（この大きさに収まる最小の縮小版画像を表示する）
+        self.gallery_tile_size = int(os.getenv("GALLERY_TILE_SIZE", "256"))
+        
+        # デコード済み画像キャッシュの上限（MB）
+        self.image_cache_max_mb = int(os.getenv("IMAGE_CACHE_MAX_MB", "256"))
+        # デコード済み画像キャッシュの有効期限（秒）。行が書き換えられた場合もこの時間が経てば取得し直す
+        self.image_cache_ttl = float(os.getenv("IMAGE_CACHE_TTL", "300"))
+        
+        # キャッシュの統計情報を出力する間隔（秒、0の場合は出力しない）
+        self.cache_stats_interval = float(os.getenv("CACHE_STATS_INTERVAL", "0"))
+        
+        # 画像の総数キャッシュの許容する古さ（秒）。これを過ぎるとバックグラウンドで再取得する
+        self.image_count_max_staleness = float(os.getenv("IMAGE_COUNT_MAX_STALENESS", "30"))
+        
+        # ハイブリッド検索でベクトル検索・全文検索それぞれの結果を待つ上限（秒）
+        self.hybrid_branch_timeout = float(os.getenv("HYBRID_BRANCH_TIMEOUT", "10"))
+        
+        # ハイブリッド検索の方式（parallel: 2つのSQLを並行実行、rrf: 1つのSQLでRRFにより統合）
+        self.hybrid_search_mode = os.getenv("HYBRID_SEARCH_MODE", "parallel")
+        
+        # クエリーの埋め込みベクトルのキャッシュ件数と、再起動後も再利用するためのキャッシュファイル（空の場合は保存しない）
+        self.query_embedding_cache_size = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "1024"))
+        self.query_embedding_cache_path = os.getenv("QUERY_EMBEDDING_CACHE_PATH", "")
+        
+        # 同時に届いたクエリーの埋め込みをまとめる時間枠（ミリ秒、0の場合はまとめない）
+        self.query_embedding_batch_window_ms = float(os.getenv("QUERY_EMBEDDING_BATCH_WINDOW_MS", "5"))
+        
+        # 埋め込みベクトルの次元数（256/512/1024/1536、登録済みのベクトルとIMAGESの列の次元数と合わせる）
+        # 新規に作成する場合は sql/create_tables.sql の embedding_dimension も同じ値にする（作成後の変更は 104_migrate_embedding_dimension.py）
+        self.embedding_dimension = int(os.getenv("EMBEDDING_DIMENSION", "1536"))
+        
+        # 検索のバックエンド（oracle: データベースで検索、local: 起動時に読み込んだNumPy配列で検索）
+        self.search_backend = os.getenv("SEARCH_BACKEND", "oracle")
+        # localの場合に画像を読み込むディレクトリ（空の場合はデータベースから取得する）
+        self.local_image_dir = os.getenv("LOCAL_IMAGE_DIR", "") or None
+        # localの場合のベクトル検索の方式（exact: 全件の内積、hnsw: HNSWによる近似最近傍探索）とHNSWのパラメーター
+        self.local_ann_index = os.getenv("LOCAL_ANN_INDEX", "exact")
+        self.hnsw_params = {
+            "M": int(os.getenv("HNSW_M", "16")),
+            "ef_construction": int(os.getenv("HNSW_EF_CONSTRUCTION", "100")),
+            "ef_search": int(os.getenv("HNSW_EF_SEARCH", "64"))
+        }
+        # HNSWインデックスの保存先（指定すると次回の起動時は差分だけ追加する）
+        self.local_ann_index_path = os.getenv("LOCAL_ANN_INDEX_PATH", "") or None
+        # localの場合に埋め込みベクトルを読み込むスナップショットのディレクトリ（空の場合はデータベースから読み込む）
+        self.local_snapshot_dir = os.getenv("LOCAL_SNAPSHOT_DIR", "") or None
+        
+        # ベクトル検索の方式（float: float32で検索、binary/int8: 量子化版で候補を絞り込んでからfloat32で再スコアリング）
+        self.vector_search_mode = os.getenv("VECTOR_SEARCH_MODE", "float")
+        # 2段階検索で1段目に取得する候補数の倍率（top_k × overfetch 件）
+        self.vector_search_overfetch = int(os.getenv("VECTOR_SEARCH_OVERFETCH", "10"))
+        
     def get_db_connection(self):
         # データベース接続を確立
         db_connection = oracledb.connect(
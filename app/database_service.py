@@ -2,10 +2,30 @@ import time
 from io import BytesIO
 from PIL import Image
 import oracledb
+from app.image_renditions import RENDITION_COLUMNS
+from app.vector_quantization import quantize_binary, quantize_int8
+
+# 縮小版画像が未生成のためオリジナル画像で代用した場合のキャッシュの有効期限（秒）
+FALLBACK_CACHE_TTL = 30.0
+
+def _fetch_blobs_as_bytes(cursor, metadata):
+    """BLOB列をLOBロケーターではなくバイト列として取得する（行ごとのLOB読み出しの往復をなくす）"""
+    if metadata.type_code is oracledb.DB_TYPE_BLOB:
+        return cursor.var(oracledb.DB_TYPE_LONG_RAW, arraysize=cursor.arraysize)
 
 class DatabaseService:
-    def __init__(self, db_pool):
+    # 2段階検索の1段目で使う量子化版の列・クエリーの量子化関数・距離
+    QUANTIZED_SEARCH = {
+        "binary": ("_bin", quantize_binary, "HAMMING"),
+        "int8": ("_int8", quantize_int8, "COSINE")
+    }
+    
+    def __init__(self, db_pool, image_cache=None, vector_search_mode="float", overfetch=10):
         self.db_pool = db_pool
+        self.image_cache = image_cache
+        # ベクトル検索の方式（float: float32の列を直接検索、binary/int8: 量子化版の列で候補を多めに絞り込んでからfloat32で再スコアリング）
+        self.vector_search_mode = vector_search_mode
+        self.overfetch = overfetch
         self.max_retries = 3
         self.retry_delay = 1  # 秒
         
@@ -35,14 +55,61 @@ class DatabaseService:
         # 最大リトライ回数に達した場合
         raise last_error
         
+    def _search_two_stage(self, column, query_embedding, top_k, vector_threshold, search_mode):
+        """量子化版の列で top_k × overfetch 件の候補を選び、float32の列の内積で並べ直す2段階のベクトル検索"""
+        suffix, quantize, metric = self.QUANTIZED_SEARCH[self.vector_search_mode]
+        candidates = top_k * self.overfetch
+        
+        def operation():
+            with self.db_pool.acquire() as conn:
+                cursor = conn.cursor()
+                try:
+                    sql = f"""
+                        WITH candidates AS (
+                            SELECT image_id
+                            FROM IMAGES
+                            ORDER BY VECTOR_DISTANCE({column}{suffix}, :1, {metric})
+                            FETCH FIRST :2 ROWS ONLY
+                        )
+                        SELECT a.image_id, a.file_name, a.caption,
+                            VECTOR_DISTANCE(a.{column}, :3, DOT) as distance
+                        FROM IMAGES a
+                        JOIN candidates c ON a.image_id = c.image_id
+                        WHERE VECTOR_DISTANCE(a.{column}, :4, DOT) <= :5
+                        ORDER BY distance
+                        FETCH FIRST :6 ROWS ONLY
+                    """
+                    cursor.execute(sql, [
+                        quantize(query_embedding),
+                        candidates,
+                        query_embedding,
+                        query_embedding,
+                        -1 * vector_threshold,
+                        top_k
+                    ])
+                    
+                    executed_sql = sql.replace(":1", f":embedding{suffix}").replace(":2", str(candidates)) \
+                                      .replace(":3", ":embedding").replace(":4", ":embedding") \
+                                      .replace(":5", str(-1 * vector_threshold)).replace(":6", str(top_k))
+                    
+                    results = self._process_query_results(cursor, search_mode)
+                    return results, executed_sql
+                finally:
+                    cursor.close()
+        
+        return self._execute_with_retry(operation)
+            
     def search_by_caption_vector(self, query_embedding, top_k=5, vector_threshold=0.5):
         """ベクトル埋め込みによるキャプション検索"""
+        if self.vector_search_mode in self.QUANTIZED_SEARCH:
+            return self._search_two_stage("caption_embedding", query_embedding, top_k, vector_threshold, "ベクトル検索")
+            
         def operation():
             with self.db_pool.acquire() as conn:
                 cursor = conn.cursor()
                 try:
                     sql = """
-                        SELECT a.image_id, a.file_name, a.caption, a.image_data,
+                        SELECT a.image_id, a.file_name, a.caption,
                             VECTOR_DISTANCE(a.caption_embedding, :1, DOT) as distance
                         FROM IMAGES a
                         WHERE VECTOR_DISTANCE(a.caption_embedding, :2, DOT) <= :3
@@ -73,7 +140,7 @@ class DatabaseService:
                 cursor = conn.cursor()
                 try:
                     sql = """
-                        SELECT a.image_id, a.file_name, a.caption, a.image_data,
+                        SELECT a.image_id, a.file_name, a.caption,
                             score(1) as distance
                         FROM IMAGES a
                         WHERE CONTAINS(caption, :1, 1) > 0
@@ -96,12 +163,15 @@ class DatabaseService:
             
     def search_by_image_vector(self, query_embedding, top_k=5, vector_threshold=0.5):
         """画像ベクトルによる検索"""
+        if self.vector_search_mode in self.QUANTIZED_SEARCH:
+            return self._search_two_stage("image_embedding", query_embedding, top_k, vector_threshold, "画像")
+            
         def operation():
             with self.db_pool.acquire() as conn:
                 cursor = conn.cursor()
                 try:
                     sql = """
-                        SELECT a.image_id, a.file_name, a.caption, a.image_data,
+                        SELECT a.image_id, a.file_name, a.caption,
                             VECTOR_DISTANCE(a.image_embedding, :1, DOT) as distance
                         FROM IMAGES a
                         WHERE VECTOR_DISTANCE(a.image_embedding, :2, DOT) <= :3
@@ -125,6 +195,103 @@ class DatabaseService:
         
         return self._execute_with_retry(operation)
             
+    def search_hybrid_rrf(self, query_embedding, search_query, top_k=5, vector_threshold=0.5, keyword_threshold=0, rrf_k=60):
+        """キャプションのベクトル検索と全文検索を1つのSQLで実行し、Reciprocal Rank Fusionで統合する
+        
+        (統合結果, ベクトル検索結果, 全文検索結果, 実行したSQL) を返す。
+        統合結果はRRFスコアの降順で、各行に 'rrf_score'・'vector_distance'・'keyword_score' を持つ。
+        """
+        def operation():
+            with self.db_pool.acquire() as conn:
+                cursor = conn.cursor()
+                try:
+                    sql = """
+                        WITH vector_hits AS (
+                            SELECT image_id,
+                                VECTOR_DISTANCE(caption_embedding, :query_embedding, DOT) as distance
+                            FROM IMAGES
+                            WHERE VECTOR_DISTANCE(caption_embedding, :query_embedding, DOT) <= :max_distance
+                            ORDER BY distance
+                            FETCH APPROX FIRST :top_k ROWS ONLY
+                        ),
+                        keyword_hits AS (
+                            SELECT image_id, score(1) as keyword_score
+                            FROM IMAGES
+                            WHERE CONTAINS(caption, :search_query, 1) > 0
+                            AND score(1) >= :keyword_threshold
+                            ORDER BY score(1) DESC
+                            FETCH FIRST :top_k ROWS ONLY
+                        ),
+                        vector_ranked AS (
+                            SELECT image_id, distance,
+                                ROW_NUMBER() OVER (ORDER BY distance, image_id) as vector_rank
+                            FROM vector_hits
+                        ),
+                        keyword_ranked AS (
+                            SELECT image_id, keyword_score,
+                                ROW_NUMBER() OVER (ORDER BY keyword_score DESC, image_id) as keyword_rank
+                            FROM keyword_hits
+                        ),
+                        fused AS (
+                            SELECT COALESCE(v.image_id, k.image_id) as image_id,
+                                v.distance, v.vector_rank, k.keyword_score, k.keyword_rank,
+                                NVL(1 / (:rrf_k + v.vector_rank), 0) + NVL(1 / (:rrf_k + k.keyword_rank), 0) as rrf_score
+                            FROM vector_ranked v
+                            FULL OUTER JOIN keyword_ranked k ON v.image_id = k.image_id
+                        )
+                        SELECT a.image_id, a.file_name, a.caption,
+                            f.rrf_score, f.distance, f.vector_rank, f.keyword_score, f.keyword_rank
+                        FROM fused f
+                        JOIN IMAGES a ON a.image_id = f.image_id
+                        ORDER BY f.rrf_score DESC, a.image_id
+                    """
+                    cursor.execute(sql, {
+                        "query_embedding": query_embedding,
+                        "max_distance": -1 * vector_threshold,
+                        "top_k": top_k,
+                        "search_query": search_query,
+                        "keyword_threshold": keyword_threshold,
+                        "rrf_k": rrf_k
+                    })
+                    
+                    executed_sql = sql.replace(":query_embedding", ":embedding") \
+                                      .replace(":max_distance", str(-1 * vector_threshold)) \
+                                      .replace(":top_k", str(top_k)) \
+                                      .replace(":search_query", f"'{search_query}'") \
+                                      .replace(":keyword_threshold", str(keyword_threshold)) \
+                                      .replace(":rrf_k", str(rrf_k))
+                    
+                    combined_results = []
+                    vector_results = []
+                    keyword_results = []
+                    for image_id, file_name, caption, rrf_score, distance, vector_rank, keyword_score, keyword_rank in cursor:
+                        base = {
+                            'image_id': image_id,
+                            'file_name': file_name,
+                            'caption': caption,
+                            'image': None,
+                            'rrf_score': rrf_score,
+                            'vector_distance': distance,
+                            'keyword_score': keyword_score
+                        }
+                        # 統合結果の 'distance' は、ベクトル検索でヒットした行はベクトル距離、それ以外は全文検索のスコアとする
+                        if vector_rank is not None:
+                            combined_results.append(dict(base, distance=distance, search_mode="ベクトル検索"))
+                            vector_results.append((vector_rank, dict(base, distance=distance, search_mode="ベクトル検索")))
+                        else:
+                            combined_results.append(dict(base, distance=keyword_score, search_mode="全文検索"))
+                        if keyword_rank is not None:
+                            keyword_results.append((keyword_rank, dict(base, distance=keyword_score, search_mode="全文検索")))
+                    
+                    # ギャラリー表示用に、それぞれの検索での順位に並べ直す
+                    vector_results = [result for _, result in sorted(vector_results, key=lambda item: item[0])]
+                    keyword_results = [result for _, result in sorted(keyword_results, key=lambda item: item[0])]
+                    return combined_results, vector_results, keyword_results, executed_sql
+                finally:
+                    cursor.close()
+        
+        return self._execute_with_retry(operation)
+            
     def get_recent_images(self, top_k=12, offset=0):
         """最近アップロードされた画像を取得"""
         def operation():
@@ -132,7 +299,7 @@ class DatabaseService:
                 cursor = conn.cursor()
                 try:
                     sql = """
-                        SELECT image_id, file_name, caption, image_data,
+                        SELECT image_id, file_name, caption,
                             NULL as distance
                         FROM IMAGES
                         ORDER BY upload_date DESC
@@ -148,6 +315,66 @@ class DatabaseService:
         
         return self._execute_with_retry(operation)
             
+    def get_recent_images_page(self, top_k=12, cursor_key=None, direction="next"):
+        """最近アップロードされた画像をキーセット方式で1ページ分取得
+        
+        cursor_keyは (upload_date, image_id)。direction="next" ではその行より古い画像、
+        "prev" ではその行より新しい画像を取得する。どちらも新しい順に並べて返す。
+        OFFSETを使わないため、何ページ目でも idx_images_upload_date (upload_date, image_id) の範囲走査だけで済む。
+        （sql/alter_images_upload_date_index.sql）
+        """
+        def operation():
+            with self.db_pool.acquire() as conn:
+                cursor = conn.cursor()
+                try:
+                    if cursor_key is None:
+                        sql = """
+                            SELECT image_id, file_name, caption,
+                                NULL as distance, upload_date
+                            FROM IMAGES
+                            ORDER BY upload_date DESC, image_id DESC
+                            FETCH FIRST :1 ROWS ONLY
+                        """
+                        params = [top_k]
+                        executed_sql = sql.replace(":1", str(top_k))
+                    else:
+                        upload_date, image_id = cursor_key
+                        # ORで書くとインデックスの範囲走査にならないことがあるため、先頭列の範囲条件をANDで独立させる
+                        if direction == "prev":
+                            sql = """
+                                SELECT image_id, file_name, caption,
+                                    NULL as distance, upload_date
+                                FROM IMAGES
+                                WHERE upload_date >= :1
+                                AND (upload_date > :2 OR image_id > :3)
+                                ORDER BY upload_date ASC, image_id ASC
+                                FETCH FIRST :4 ROWS ONLY
+                            """
+                        else:
+                            sql = """
+                                SELECT image_id, file_name, caption,
+                                    NULL as distance, upload_date
+                                FROM IMAGES
+                                WHERE upload_date <= :1
+                                AND (upload_date < :2 OR image_id < :3)
+                                ORDER BY upload_date DESC, image_id DESC
+                                FETCH FIRST :4 ROWS ONLY
+                            """
+                        params = [upload_date, upload_date, image_id, top_k]
+                        executed_sql = sql.replace(":1", f"'{upload_date}'").replace(":2", f"'{upload_date}'") \
+                                          .replace(":3", str(image_id)).replace(":4", str(top_k))
+                    cursor.execute(sql, params)
+                    
+                    results = self._process_query_results(cursor, "最近のアップロード")
+                    if direction == "prev" and cursor_key is not None:
+                        # 古い順に取得した前ページを新しい順に並べ替える
+                        results.reverse()
+                    return results, executed_sql
+                finally:
+                    cursor.close()
+        
+        return self._execute_with_retry(operation)
+            
     def get_total_image_count(self):
         """画像の総数を取得"""
         def operation():
@@ -163,20 +390,77 @@ class DatabaseService:
         
         return self._execute_with_retry(operation)
             
+    def fetch_images(self, image_ids, rendition="original", batch_size=500):
+        """画像IDのリストに対応する画像をまとめて取得し、{image_id: PILイメージ} を返す
+        
+        renditionに "thumbnail" または "preview" を指定すると縮小版画像を取得する。
+        縮小版画像が未生成の行はオリジナル画像で代用する。
+        BLOBはバイト列としてフェッチするため、1バッチあたりのデータベースとの往復は1回で済む。
+        """
+        rendition_column = RENDITION_COLUMNS[rendition]
+        images = {}
+        image_ids = list(dict.fromkeys(image_ids))
+        
+        # キャッシュにある画像はデータベースから読み出さない
+        if self.image_cache is not None:
+            for image_id in image_ids:
+                image = self.image_cache.get(image_id, rendition)
+                if image is not None:
+                    images[image_id] = image
+            image_ids = [image_id for image_id in image_ids if image_id not in images]
+        if not image_ids:
+            return images
+            
+        def operation():
+            with self.db_pool.acquire() as conn:
+                cursor = conn.cursor()
+                cursor.outputtypehandler = _fetch_blobs_as_bytes
+                cursor.arraysize = batch_size
+                cursor.prefetchrows = batch_size
+                try:
+                    # オリジナル画像は縮小版画像が未生成の行についてのみ取得する
+                    if rendition == "original":
+                        columns = "image_data, NULL"
+                    else:
+                        columns = f"{rendition_column}, CASE WHEN {rendition_column} IS NULL THEN image_data END"
+                    # IN句のバインド数を抑えるため一定件数ごとに分割して取得
+                    for start in range(0, len(image_ids), batch_size):
+                        batch = image_ids[start:start + batch_size]
+                        binds = ", ".join(f":{i + 1}" for i in range(len(batch)))
+                        cursor.execute(
+                            f"SELECT image_id, {columns} FROM IMAGES WHERE image_id IN ({binds})",
+                            batch
+                        )
+                        for image_id, rendition_data, image_data in cursor:
+                            # バイト列をPILイメージに変換
+                            data = rendition_data if rendition_data is not None else image_data
+                            images[image_id] = Image.open(BytesIO(data))
+                            if self.image_cache is not None:
+                                # 代用したオリジナル画像は縮小版画像のバックフィル後に早く入れ替わるよう短い期限でキャッシュする
+                                fallback = rendition != "original" and rendition_data is None
+                                self.image_cache.put(image_id, rendition, images[image_id], ttl=FALLBACK_CACHE_TTL if fallback else None)
+                    return images
+                finally:
+                    cursor.close()
+        
+        return self._execute_with_retry(operation)
+            
     def _process_query_results(self, cursor, search_mode):
-        """クエリ結果を処理してオブジェクトのリストを返す"""
+        """クエリ結果を処理してオブジェクトのリストを返す（画像は描画時に fetch_images で取得する）"""
         results = []
         for row in cursor:
-            image_id, file_name, caption, image_data, distance = row
-            # BLOBデータをPILイメージに変換
-            img = Image.open(BytesIO(image_data.read()))
+            image_id, file_name, caption, distance = row[:4]
             caption_text = caption
-            results.append({
+            result = {
                 'image_id': image_id,
                 'file_name': file_name,
                 'caption': caption_text,
-                'image': img,
+                'image': None,
                 'distance': distance,
                 'search_mode': search_mode
-            })
+            }
+            # ページング用の列（upload_date）がある場合は保持する
+            if len(row) > 4:
+                result['upload_date'] = row[4]
+            results.append(result)
         return results 
\ No newline at end of file
@@ -0,0 +1,65 @@
+import threading
+import time
+from concurrent.futures import Future
+
+class TextEmbeddingCoalescer:
+    """同時に届いたテキスト埋め込みの要求を短い時間枠でまとめ、1回のembed呼び出しで処理するクラス
+
+    時間枠の最初の要求を出したスレッドが window 秒待ってから、その間に届いた要求を
+    BatchEmbedder でまとめて埋め込み、結果を各要求に返す。
+    同じテキストへの同時の要求は1件にまとめる。
+    """
+
+    def __init__(self, batch_embedder, window=0.005):
+        self.batch_embedder = batch_embedder
+        self.window = window
+        self.requests = 0
+        self.deduplicated = 0
+        self.batches = 0
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def embed(self, text, input_type="search_query"):
+        """テキストの埋め込みベクトルを返す（他の同時の要求とまとめて取得する）"""
+        with self._lock:
+            self.requests += 1
+            batch = self._pending.setdefault(input_type, {})
+            future = batch.get(text)
+            if future is not None:
+                self.deduplicated += 1
+                is_leader = False
+            else:
+                future = Future()
+                batch[text] = future
+                is_leader = len(batch) == 1
+
+        if is_leader:
+            time.sleep(self.window)
+            self._flush(input_type)
+        return future.result()
+
+    def _flush(self, input_type):
+        with self._lock:
+            batch = self._pending.pop(input_type, {})
+            self.batches += 1
+        texts = list(batch)
+        try:
+            embeddings, errors = self.batch_embedder.embed_texts(texts, input_type)
+        except Exception as e:
+            for future in batch.values():
+                future.set_exception(e)
+            return
+        for i, text in enumerate(texts):
+            if i in errors:
+                batch[text].set_exception(errors[i])
+            else:
+                batch[text].set_result(embeddings[i])
+
+    def stats(self):
+        with self._lock:
+            return {
+                "requests": self.requests,
+                "deduplicated": self.deduplicated,
+                "batches": self.batches,
+                "api_calls": self.batch_embedder.api_calls
+            }
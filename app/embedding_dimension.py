@@ -0,0 +1,35 @@
+import array
+import numpy as np
+
+# Cohere Embed 4.0 が出力できる埋め込みベクトルの次元数（Matryoshka表現のため先頭から切り詰めても意味を保つ）
+SUPPORTED_EMBEDDING_DIMENSIONS = (256, 512, 1024, 1536)
+FULL_EMBEDDING_DIMENSION = 1536
+
+def validate_embedding_dimension(dimension):
+    """対応している次元数かを確認して int で返す"""
+    dimension = int(dimension)
+    if dimension not in SUPPORTED_EMBEDDING_DIMENSIONS:
+        supported = ", ".join(str(value) for value in SUPPORTED_EMBEDDING_DIMENSIONS)
+        raise ValueError(f"埋め込みベクトルの次元数 {dimension} には対応していません（対応: {supported}）")
+    return dimension
+
+def truncate_embedding(vector, dimension):
+    """埋め込みベクトルを先頭の dimension 次元に切り詰め、内積で比較できるようL2正規化し直す"""
+    values = np.asarray(vector, dtype=np.float32)
+    if dimension is None or values.size <= dimension:
+        return array.array('f', values.tobytes())
+    values = values[:dimension]
+    norm = float(np.linalg.norm(values))
+    if norm > 0:
+        values = values / norm
+    return array.array('f', values.astype(np.float32).tobytes())
+
+def truncate_matrix(matrix, dimension):
+    """行ごとに truncate_embedding と同じ切り詰めと正規化を行った float32 の行列"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if dimension is None or matrix.shape[1] <= dimension:
+        return matrix
+    truncated = matrix[:, :dimension]
+    norms = np.linalg.norm(truncated, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (truncated / norms).astype(np.float32)
@@ -1,20 +1,117 @@
 from io import BytesIO
 import base64
+import hashlib
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
 from PIL import Image
+from app.batch_embedder import BatchEmbedder
+from app.embedding_coalescer import TextEmbeddingCoalescer
+from app.embedding_dimension import FULL_EMBEDDING_DIMENSION, truncate_embedding, validate_embedding_dimension
 
 class EmbeddingService:
-    def __init__(self, cohere_client):
+    def __init__(self, cohere_client, model="embed-v4.0", cache_size=1024, persistent_cache=None, batch_window=0.005, dimension=FULL_EMBEDDING_DIMENSION):
         self.cohere_client = cohere_client
+        self.model = model
+        # 検索に使う次元数（モデルの出力を先頭から切り詰めて正規化し直す）
+        self.dimension = validate_embedding_dimension(dimension)
+        # 同時に届いたクエリーをbatch_window秒の間まとめて1回のembed呼び出しにする（0の場合はまとめない）
+        # 検索の応答を待たせすぎないよう、一時的なエラーの再試行は1回までにする
+        self.coalescer = TextEmbeddingCoalescer(BatchEmbedder(cohere_client, model, max_retries=1, backoff=0.2), batch_window) if batch_window > 0 else None
+        # クエリーの埋め込みベクトルのLRUキャッシュ（persistent_cacheにModelOutputCacheを渡すと再起動後も再利用する）
+        self.cache_size = cache_size
+        self.persistent_cache = persistent_cache
+        self.cache_hits = 0
+        self.persistent_hits = 0
+        self.cache_misses = 0
+        self._cache = OrderedDict()
+        self._cache_lock = threading.Lock()
+        
+    @staticmethod
+    def normalize_query(text):
+        """全角・半角や空白の違いを吸収したキャッシュ用のクエリーテキスト"""
+        return re.sub(r'\s+', ' ', unicodedata.normalize("NFKC", text)).strip()
+        
+    def _cache_get(self, key):
+        with self._cache_lock:
+            embedding = self._cache.get(key)
+            if embedding is not None:
+                self._cache.move_to_end(key)
+                self.cache_hits += 1
+            return embedding
+        
+    def _cache_put(self, key, embedding):
+        if self.cache_size <= 0:
+            return
+        with self._cache_lock:
+            self._cache[key] = embedding
+            self._cache.move_to_end(key)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
         
     def get_text_embedding(self, text, input_type="search_query"):
         """クエリーテキストからCohere Embed 4.0を使用しての埋め込みベクトルを生成"""
-        response = self.cohere_client.embed(
-            texts=[text],
-            model="embed-v4.0",
-            input_type=input_type
-        )
+        normalized = self.normalize_query(text)
+        key = (normalized, input_type, self.model, self.dimension)
+        embedding = self._cache_get(key)
+        if embedding is not None:
+            return embedding
         
-        return response.embeddings[0]
+        # メモリ上になければディスク上のキャッシュを確認する（ディスクには次元数を変えても使えるようモデルの出力のまま保存する）
+        text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        if self.persistent_cache is not None:
+            stored = self.persistent_cache.get_embedding(text_hash, self.model, input_type)
+            if stored is not None:
+                embedding = tuple(truncate_embedding(stored, self.dimension))
+                with self._cache_lock:
+                    self.persistent_hits += 1
+                self._cache_put(key, embedding)
+                return embedding
+        
+        with self._cache_lock:
+            self.cache_misses += 1
+        # 正規化したテキストはキャッシュのキーにだけ使い、Cohereには入力されたテキストをそのまま送る
+        if self.coalescer is not None:
+            full_embedding = self.coalescer.embed(text, input_type)
+        else:
+            response = self.cohere_client.embed(
+                texts=[text],
+                model=self.model,
+                input_type=input_type
+            )
+            full_embedding = response.embeddings[0]
+            
+        embedding = tuple(truncate_embedding(full_embedding, self.dimension))
+        self._cache_put(key, embedding)
+        if self.persistent_cache is not None:
+            self.persistent_cache.put_embedding(text_hash, self.model, input_type, full_embedding)
+        return embedding
+        
+    def cache_stats(self):
+        with self._cache_lock:
+            total = self.cache_hits + self.persistent_hits + self.cache_misses
+            return {
+                "hits": self.cache_hits,
+                "persistent_hits": self.persistent_hits,
+                "misses": self.cache_misses,
+                "hit_rate": (self.cache_hits + self.persistent_hits) / total if total else 0.0,
+                "entries": len(self._cache)
+            }
+        
+    def cache_summary(self):
+        stats = self.cache_stats()
+        summary = (
+            f"クエリー埋め込みキャッシュ: ヒット {stats['hits']} 件, ディスクからのヒット {stats['persistent_hits']} 件, "
+            f"ミス {stats['misses']} 件, ヒット率 {stats['hit_rate']:.1%}, {stats['entries']} 件"
+        )
+        if self.coalescer is not None:
+            coalescer_stats = self.coalescer.stats()
+            summary += (
+                f"\nクエリー埋め込みのまとめ処理: 要求 {coalescer_stats['requests']} 件, 重複 {coalescer_stats['deduplicated']} 件, "
+                f"バッチ {coalescer_stats['batches']} 回, API呼び出し {coalescer_stats['api_calls']} 回"
+            )
+        return summary
         
     def get_image_embedding(self, image):
         """アップロードされた画像からCohere Embed 4.0を使用して埋め込みベクトルを生成"""
@@ -27,9 +124,9 @@ class EmbeddingService:
         # Cohere APIを使用して画像の埋め込みベクトルを取得
         response = self.cohere_client.embed(
             images=[data_url],
-            model="embed-v4.0",
+            model=self.model,
             input_type="image",
             embedding_types=["float"],
         )
         
-        return response.embeddings.float[0] 
\ No newline at end of file
+        return truncate_embedding(response.embeddings.float[0], self.dimension)
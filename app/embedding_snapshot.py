@@ -0,0 +1,155 @@
+import json
+import os
+import shutil
+import time
+from datetime import datetime
+import numpy as np
+
+# スナップショットのファイル形式のバージョン（ファイル構成を変えたら上げる）
+SNAPSHOT_FORMAT_VERSION = 1
+# 最新のスナップショットのディレクトリ名を記録するファイル
+LATEST_FILE_NAME = "LATEST"
+EMBEDDING_COLUMNS = ("caption_embedding", "image_embedding")
+
+class EmbeddingSnapshot:
+    """エクスポートした埋め込みベクトルを読み取り専用でメモリマップしたスナップショット
+
+    image_ids は int64 の .npy、各埋め込み列は行優先の float32 の生ファイルで、
+    どちらもメモリマップするため読み込み時にデシリアライズせず、
+    複数のプロセスでOSのページキャッシュ上の同じデータを共有できる。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as meta_file:
+            self.meta = json.load(meta_file)
+        if self.meta["format_version"] != SNAPSHOT_FORMAT_VERSION:
+            raise ValueError(f"スナップショットの形式のバージョンが異なります: {self.meta['format_version']}（対応: {SNAPSHOT_FORMAT_VERSION}）")
+        self.rows = self.meta["rows"]
+        self.dimension = self.meta["dimension"]
+        self.image_ids = np.load(os.path.join(path, "image_ids.npy"), mmap_mode="r")
+        self.embeddings = {
+            column: self._memmap(os.path.join(path, f"{column}.f32"))
+            for column in EMBEDDING_COLUMNS
+        }
+
+    def _memmap(self, file_path):
+        if self.rows == 0 or self.dimension == 0:
+            return np.empty((self.rows, self.dimension), dtype=np.float32)
+        return np.memmap(file_path, dtype=np.float32, mode="r", shape=(self.rows, self.dimension))
+
+    @property
+    def caption_embeddings(self):
+        return self.embeddings["caption_embedding"]
+
+    @property
+    def image_embeddings(self):
+        return self.embeddings["image_embedding"]
+
+    def iter_metadata(self):
+        """(image_id, file_name, caption, upload_date) を image_ids と同じ順に返す"""
+        with open(os.path.join(self.path, "metadata.jsonl"), encoding="utf-8") as metadata_file:
+            for line in metadata_file:
+                record = json.loads(line)
+                upload_date = datetime.fromisoformat(record["upload_date"]) if record["upload_date"] else None
+                yield record["image_id"], record["file_name"], record["caption"], upload_date
+
+def export_snapshot(db_connection, output_dir, batch_size=1000, dimension=None):
+    """IMAGESの埋め込みベクトルを画像ID順にストリーミングでファイルに書き出し、作成したディレクトリを返す
+
+    書き込み中は一時ディレクトリに出力し、完了後に名前を変えてから LATEST を更新するため、
+    読み込み側が書きかけのスナップショットを開くことはない。
+    dimension を省略すると、最初に見つかった埋め込みベクトルの次元数を使う。
+    """
+    os.makedirs(output_dir, exist_ok=True)
+    # 同じ秒に続けて出力しても衝突しないようマイクロ秒まで含める（名前順が作成順になる）
+    version = datetime.now().strftime("%Y%m%d-%H%M%S-%f")
+    final_path = os.path.join(output_dir, version)
+    work_path = final_path + ".tmp"
+    os.makedirs(work_path)
+    start = time.monotonic()
+
+    rows = 0
+    # 次元数が分かる前に現れた埋め込みベクトルのない行の数（次元数が分かった時点でゼロベクトルを書き出す）
+    pending_rows = 0
+    image_ids = []
+    cursor = db_connection.cursor()
+    try:
+        cursor.arraysize = batch_size
+        cursor.execute("""
+            SELECT image_id, file_name, caption, upload_date, caption_embedding, image_embedding
+            FROM IMAGES
+            ORDER BY image_id
+        """)
+        with open(os.path.join(work_path, "caption_embedding.f32"), "wb") as caption_file, \
+             open(os.path.join(work_path, "image_embedding.f32"), "wb") as image_file, \
+             open(os.path.join(work_path, "metadata.jsonl"), "w", encoding="utf-8") as metadata_file:
+            while True:
+                batch = cursor.fetchmany()
+                if not batch:
+                    break
+                for image_id, file_name, caption, upload_date, caption_embedding, image_embedding in batch:
+                    if dimension is None:
+                        if caption_embedding is None and image_embedding is None:
+                            pending_rows += 1
+                        else:
+                            dimension = len(caption_embedding if caption_embedding is not None else image_embedding)
+                            zeros = np.zeros((pending_rows, dimension), dtype=np.float32).tobytes()
+                            caption_file.write(zeros)
+                            image_file.write(zeros)
+                            pending_rows = 0
+                    # 埋め込みベクトルがない行はゼロベクトルとして書き出す（内積が0になり検索結果に出ない）
+                    if dimension is not None:
+                        for vector, vector_file in ((caption_embedding, caption_file), (image_embedding, image_file)):
+                            if vector is None or len(vector) != dimension:
+                                vector_file.write(np.zeros(dimension, dtype=np.float32).tobytes())
+                            else:
+                                vector_file.write(np.asarray(vector, dtype=np.float32).tobytes())
+                    metadata_file.write(json.dumps({
+                        "image_id": image_id,
+                        "file_name": file_name,
+                        "caption": caption,
+                        "upload_date": upload_date.isoformat() if upload_date else None
+                    }, ensure_ascii=False) + "\n")
+                    image_ids.append(image_id)
+                    rows += 1
+                print(f"{rows} 件の埋め込みベクトルを書き出しました。")
+    finally:
+        cursor.close()
+
+    np.save(os.path.join(work_path, "image_ids.npy"), np.array(image_ids, dtype=np.int64))
+    with open(os.path.join(work_path, "meta.json"), "w", encoding="utf-8") as meta_file:
+        json.dump({
+            "format_version": SNAPSHOT_FORMAT_VERSION,
+            "version": version,
+            "rows": rows,
+            "dimension": dimension or 0,
+            "dtype": "float32",
+            "columns": list(EMBEDDING_COLUMNS),
+            "created_at": datetime.now().isoformat(),
+            "export_seconds": time.monotonic() - start
+        }, meta_file, ensure_ascii=False, indent=2)
+
+    os.rename(work_path, final_path)
+    latest_path = os.path.join(output_dir, LATEST_FILE_NAME)
+    with open(latest_path + ".tmp", "w", encoding="utf-8") as latest_file:
+        latest_file.write(version)
+    os.replace(latest_path + ".tmp", latest_path)
+    return final_path
+
+def prune_snapshots(output_dir, keep=2):
+    """最新の keep 個を残して古いスナップショットを削除する"""
+    versions = sorted(
+        name for name in os.listdir(output_dir)
+        if os.path.isdir(os.path.join(output_dir, name)) and not name.endswith(".tmp")
+    )
+    for name in versions[:-keep] if keep > 0 else versions:
+        shutil.rmtree(os.path.join(output_dir, name))
+        print(f"古いスナップショット {name} を削除しました。")
+
+def load_snapshot(snapshot_dir, version=None):
+    """スナップショットを読み取り専用でメモリマップして返す（versionを省略すると最新のもの）"""
+    if version is None:
+        with open(os.path.join(snapshot_dir, LATEST_FILE_NAME), encoding="utf-8") as latest_file:
+            version = latest_file.read().strip()
+    return EmbeddingSnapshot(os.path.join(snapshot_dir, version))
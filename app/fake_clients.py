@@ -0,0 +1,131 @@
+import random
+import time
+from types import SimpleNamespace
+
+# オフラインでスループットを計測するためのフェイククライアント群
+# 実サービスと同じ呼び出し形式・レスポンス構造を模倣し、遅延だけを再現する
+
+def _sleep(latency, jitter):
+    if latency > 0:
+        time.sleep(max(0.0, random.uniform(latency - jitter, latency + jitter)))
+
+class FakeThrottleError(Exception):
+    """レート制限（HTTP 429）を模倣する例外"""
+
+    def __init__(self):
+        super().__init__("Too Many Requests")
+        self.status = 429
+
+def _maybe_throttle(throttle_rate):
+    if throttle_rate > 0 and random.random() < throttle_rate:
+        raise FakeThrottleError()
+
+class FakeGenerativeAiInferenceClient:
+    """OCI GenAIのchat呼び出しを模倣するクライアント"""
+
+    def __init__(self, latency=2.0, jitter=0.5, throttle_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+
+    def chat(self, chat_detail):
+        _sleep(self.latency, self.jitter)
+        _maybe_throttle(self.throttle_rate)
+        content = SimpleNamespace(text="フェイクキャプション: 画像の説明文です。")
+        message = SimpleNamespace(content=[content])
+        choice = SimpleNamespace(message=message)
+        chat_response = SimpleNamespace(choices=[choice])
+        return SimpleNamespace(data=SimpleNamespace(chat_response=chat_response))
+
+class FakeCohereClient:
+    """Cohereのembed呼び出しを模倣するクライアント"""
+
+    def __init__(self, latency=0.3, jitter=0.1, dimension=1536, throttle_rate=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.dimension = dimension
+        self.throttle_rate = throttle_rate
+
+    def _vector(self):
+        return [random.uniform(-1.0, 1.0) for _ in range(self.dimension)]
+
+    def _response(self, texts, images, embedding_types):
+        _maybe_throttle(self.throttle_rate)
+        count = len(texts) if texts is not None else len(images)
+        vectors = [self._vector() for _ in range(count)]
+        if embedding_types:
+            return SimpleNamespace(embeddings=SimpleNamespace(float=vectors))
+        return SimpleNamespace(embeddings=vectors)
+
+    def embed(self, texts=None, images=None, model=None, input_type=None, embedding_types=None):
+        _sleep(self.latency, self.jitter)
+        return self._response(texts, images, embedding_types)
+
+class FakeCursor:
+    """oracledbのカーソルを模倣するクラス"""
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.arraysize = 100
+        self._rows = []
+
+    def execute(self, sql, params=None):
+        _sleep(self.connection.latency, 0)
+        self._rows = [(0,)] if "COUNT(*)" in sql else []
+
+    def setinputsizes(self, *args, **kwargs):
+        pass
+
+    def executemany(self, sql, rows, batcherrors=False):
+        _sleep(self.connection.latency, 0)
+
+    def getbatcherrors(self):
+        return []
+
+    def fetchone(self):
+        return self._rows.pop(0) if self._rows else None
+
+    def fetchmany(self, size=None):
+        size = size or self.arraysize
+        rows, self._rows = self._rows[:size], self._rows[size:]
+        return rows
+
+    def close(self):
+        pass
+
+class FakeDbConnection:
+    """oracledbの接続を模倣するクラス（書き込みは破棄する）"""
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        _sleep(self.latency, 0)
+
+    def close(self):
+        pass
+
+class FakeDbPool:
+    """oracledbのコネクションプールを模倣するクラス"""
+
+    def __init__(self, latency=0.01):
+        self.latency = latency
+
+    def acquire(self):
+        return _FakePooledConnection(self.latency)
+
+    def close(self):
+        pass
+
+class _FakePooledConnection(FakeDbConnection):
+    """with文で利用できるプール接続"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+        return False
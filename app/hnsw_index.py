@@ -0,0 +1,206 @@
+import heapq
+import math
+import numpy as np
+
+class HNSWIndex:
+    """内積（正規化済みベクトルではコサイン類似度）で近傍を探すHNSWグラフの近似最近傍インデックス
+
+    各ノードはラベル（画像IDなど）を持ち、search はラベルと内積を類似度の降順で返す。
+    M は各層で張るリンク数（第0層は2M）、ef_construction は挿入時、ef_search は検索時の候補数で、
+    大きくするほど再現率が上がり、挿入・検索は遅くなる。
+    """
+
+    def __init__(self, dimension, M=16, ef_construction=100, ef_search=64, seed=0):
+        self.dimension = dimension
+        self.M = M
+        self.max_links_level0 = 2 * M
+        self.ef_construction = ef_construction
+        self.ef_search = ef_search
+        self.entry_point = None
+        self.max_level = -1
+        self._level_mult = 1 / math.log(M)
+        self._rng = np.random.default_rng(seed)
+        self._vectors = np.zeros((0, dimension), dtype=np.float32)
+        self._labels = np.zeros(0, dtype=np.int64)
+        self._count = 0
+        self._levels = []
+        self._links = []
+
+    def __len__(self):
+        return self._count
+
+    @property
+    def labels(self):
+        return self._labels[:self._count]
+
+    def _reserve(self, size):
+        """ベクトルとラベルの配列の容量を倍々で確保する"""
+        if size <= len(self._vectors):
+            return
+        capacity = max(size, 2 * len(self._vectors), 1024)
+        vectors = np.zeros((capacity, self.dimension), dtype=np.float32)
+        vectors[:self._count] = self._vectors[:self._count]
+        labels = np.zeros(capacity, dtype=np.int64)
+        labels[:self._count] = self._labels[:self._count]
+        self._vectors = vectors
+        self._labels = labels
+
+    def _search_layer(self, query, entry_points, ef, level):
+        """1つの層で貪欲探索を行い、類似度の高い順に最大ef件の (内積, ノード) を返す"""
+        visited = set(entry_points)
+        scores = (self._vectors[entry_points] @ query).tolist()
+        candidates = [(-score, node) for score, node in zip(scores, entry_points)]
+        results = [(score, node) for score, node in zip(scores, entry_points)]
+        heapq.heapify(candidates)
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            negative_score, node = heapq.heappop(candidates)
+            if -negative_score < results[0][0] and len(results) >= ef:
+                break
+            neighbors = [neighbor for neighbor in self._links[node][level] if neighbor not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for score, neighbor in zip((self._vectors[neighbors] @ query).tolist(), neighbors):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    heapq.heappush(results, (score, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, candidates, max_links):
+        """類似度の高い順の候補から、既に選んだノードより自身に近いものを優先してリンク先を選ぶ（ヒューリスティック）"""
+        if len(candidates) <= max_links:
+            return [node for _, node in candidates]
+        nodes = [node for _, node in candidates]
+        # 候補どうしの内積はまとめて計算する
+        pairwise = self._vectors[nodes] @ self._vectors[nodes].T
+        pairwise = pairwise.tolist()
+        selected = []
+        pruned = []
+        for i, (score, _) in enumerate(candidates):
+            if len(selected) >= max_links:
+                break
+            if selected and score <= max(pairwise[i][j] for j in selected):
+                pruned.append(i)
+                continue
+            selected.append(i)
+        # 足りない場合は除外した候補で埋める
+        return [nodes[i] for i in selected + pruned[:max_links - len(selected)]]
+
+    def add(self, vector, label=None):
+        """ベクトルを1件追加し、内部のノード番号を返す"""
+        vector = np.asarray(vector, dtype=np.float32)
+        node = self._count
+        self._reserve(node + 1)
+        self._vectors[node] = vector
+        self._labels[node] = node if label is None else label
+        self._count += 1
+        level = int(-math.log(1.0 - self._rng.random()) * self._level_mult)
+        self._levels.append(level)
+        self._links.append([[] for _ in range(level + 1)])
+
+        if self.entry_point is None:
+            self.entry_point = node
+            self.max_level = level
+            return node
+
+        # 上位の層は最も近い1件だけをたどって降りる
+        entry_points = [self.entry_point]
+        for current_level in range(self.max_level, level, -1):
+            entry_points = [self._search_layer(vector, entry_points, 1, current_level)[0][1]]
+
+        for current_level in range(min(level, self.max_level), -1, -1):
+            candidates = self._search_layer(vector, entry_points, self.ef_construction, current_level)
+            max_links = self.max_links_level0 if current_level == 0 else self.M
+            neighbors = self._select_neighbors(candidates, self.M)
+            self._links[node][current_level] = neighbors
+            for neighbor in neighbors:
+                links = self._links[neighbor][current_level]
+                links.append(node)
+                # リンク数が上限を超えた近傍はリンク先を選び直す
+                if len(links) > max_links:
+                    scores = self._vectors[links] @ self._vectors[neighbor]
+                    order = np.argsort(-scores)
+                    self._links[neighbor][current_level] = self._select_neighbors(
+                        [(float(scores[i]), links[i]) for i in order], max_links
+                    )
+            entry_points = [candidate for _, candidate in candidates]
+
+        if level > self.max_level:
+            self.entry_point = node
+            self.max_level = level
+        return node
+
+    def add_items(self, vectors, labels=None):
+        """複数のベクトルを順に追加する"""
+        self._reserve(self._count + len(vectors))
+        for i, vector in enumerate(vectors):
+            self.add(vector, None if labels is None else labels[i])
+
+    def search(self, query, k=10, ef=None):
+        """内積の大きい順に最大k件の (ラベルの配列, 内積の配列) を返す"""
+        if self.entry_point is None or k <= 0:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        query = np.asarray(query, dtype=np.float32)
+        entry_points = [self.entry_point]
+        for current_level in range(self.max_level, 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, current_level)[0][1]]
+        results = self._search_layer(query, entry_points, max(ef or self.ef_search, k), 0)[:k]
+        nodes = [node for _, node in results]
+        return self._labels[nodes], np.array([score for score, _ in results], dtype=np.float32)
+
+    def save(self, path):
+        """インデックスをnpz形式で保存する"""
+        link_counts = []
+        link_data = []
+        for node_links in self._links:
+            for links in node_links:
+                link_counts.append(len(links))
+                link_data.extend(links)
+        params = [self.dimension, self.M, self.ef_construction, self.ef_search,
+                  -1 if self.entry_point is None else self.entry_point, self.max_level]
+        with open(path, "wb") as index_file:
+            np.savez(
+                index_file,
+                params=np.array(params, dtype=np.int64),
+                vectors=self._vectors[:self._count],
+                labels=self.labels,
+                levels=np.array(self._levels, dtype=np.int32),
+                link_counts=np.array(link_counts, dtype=np.int32),
+                link_data=np.array(link_data, dtype=np.int32)
+            )
+
+    @classmethod
+    def load(cls, path):
+        """save で保存したインデックスを読み込む"""
+        with np.load(path) as data:
+            dimension, M, ef_construction, ef_search, entry_point, max_level = data["params"].tolist()
+            index = cls(dimension, M, ef_construction, ef_search)
+            vectors = data["vectors"]
+            index._reserve(len(vectors))
+            index._count = len(vectors)
+            index._vectors[:index._count] = vectors
+            index._labels[:index._count] = data["labels"]
+            index._levels = data["levels"].tolist()
+            link_counts = data["link_counts"].tolist()
+            link_data = data["link_data"].tolist()
+        position = 0
+        count_index = 0
+        for level in index._levels:
+            node_links = []
+            for _ in range(level + 1):
+                count = link_counts[count_index]
+                node_links.append(link_data[position:position + count])
+                position += count
+                count_index += 1
+            index._links.append(node_links)
+        index.entry_point = None if entry_point < 0 else entry_point
+        index.max_level = max_level
+        # 追加挿入で同じ乱数列を使わないように、既存のノード数から乱数を初期化する
+        index._rng = np.random.default_rng(index._count)
+        return index
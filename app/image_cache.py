@@ -0,0 +1,89 @@
+import threading
+import time
+from collections import OrderedDict
+
+class ImageCache:
+    """画像IDと縮小版画像の種類をキーに、デコード済みの画像を保持するLRUキャッシュ
+
+    プロセス全体で共有し、デコード後の画像サイズの合計が max_bytes を超えないように
+    最も長く使われていない画像から削除する。
+    バックフィルなどで行が書き換えられても古い画像を返し続けないよう、
+    各エントリは ttl 秒（put で個別に指定も可能）で期限切れになる。
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, ttl=300.0):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.expirations = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _image_bytes(image):
+        """デコード済み画像が占有するおおよそのバイト数"""
+        return image.width * image.height * len(image.getbands())
+
+    def get(self, image_id, rendition):
+        """キャッシュされた画像を返す（存在しない場合はNone）"""
+        key = (image_id, rendition)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] <= time.monotonic():
+                # 期限切れのエントリは削除して取得し直させる
+                del self._entries[key]
+                self.current_bytes -= entry[1]
+                self.expirations += 1
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, image_id, rendition, image, ttl=None):
+        """画像をデコードしてキャッシュに追加する（ttlを省略するとキャッシュ全体の既定値）"""
+        image.load()
+        size = self._image_bytes(image)
+        if size > self.max_bytes:
+            return
+        key = (image_id, rendition)
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (image, size, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self.current_bytes += size
+            while self.current_bytes > self.max_bytes:
+                _, (_, evicted_size, _) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes
+            }
+
+    def summary(self):
+        stats = self.stats()
+        return (
+            f"画像キャッシュ: ヒット {stats['hits']} 件, ミス {stats['misses']} 件, ヒット率 {stats['hit_rate']:.1%}, "
+            f"削除 {stats['evictions']} 件, 期限切れ {stats['expirations']} 件, {stats['entries']} 枚, {stats['bytes'] / 1024 / 1024:.1f} MB"
+        )
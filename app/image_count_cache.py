@@ -0,0 +1,64 @@
+import threading
+import time
+
+class ImageCountCache:
+    """画像の総数をキャッシュし、古くなったらバックグラウンドで再取得するクラス
+
+    初回だけは呼び出し元で件数を取得し、以降はキャッシュした値をすぐに返す。
+    取得から max_staleness 秒を過ぎた値を返すときは再取得を1本だけ起動し、
+    同時に多数の要求が来ても COUNT(*) を並行して実行しない。
+    画像の登録・削除は別プロセス（100_register_images.py など）で行うため、
+    変更は max_staleness 秒（IMAGE_COUNT_MAX_STALENESS）以内に反映される。
+    """
+
+    def __init__(self, count_func, max_staleness=30.0):
+        self.count_func = count_func
+        self.max_staleness = max_staleness
+        self.refreshes = 0
+        self.hits = 0
+        self._count = None
+        self._updated = 0.0
+        self._refreshing = False
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+
+    def get(self):
+        """キャッシュした画像の総数を返す（古い場合は再取得をバックグラウンドで開始する）"""
+        with self._lock:
+            count = self._count
+            if count is not None:
+                self.hits += 1
+                if time.monotonic() - self._updated > self.max_staleness and not self._refreshing:
+                    self._refreshing = True
+                    threading.Thread(target=self._refresh_in_background, daemon=True).start()
+                return count
+
+        # 初回は同時に来た要求のうち1つだけが件数を取得し、残りはその結果を待つ
+        with self._load_lock:
+            with self._lock:
+                if self._count is not None:
+                    return self._count
+            return self.refresh()
+
+    def refresh(self):
+        """件数をデータベースから取得してキャッシュを更新する"""
+        count = self.count_func()
+        with self._lock:
+            self._count = count
+            self._updated = time.monotonic()
+            self.refreshes += 1
+        return count
+
+    def _refresh_in_background(self):
+        try:
+            self.refresh()
+        except Exception as e:
+            print(f"画像の総数の再取得中にエラーが発生しました: {e}")
+        finally:
+            with self._lock:
+                self._refreshing = False
+
+    def summary(self):
+        with self._lock:
+            age = time.monotonic() - self._updated if self._count is not None else 0.0
+            return f"画像の総数キャッシュ: {self._count} 枚, 取得から {age:.0f} 秒, ヒット {self.hits} 件, 再取得 {self.refreshes} 回"
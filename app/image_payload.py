@@ -0,0 +1,33 @@
+import base64
+import hashlib
+from io import BytesIO
+from PIL import Image
+
+# JPEGファイルの先頭バイト（SOIマーカー）
+JPEG_MAGIC = b"\xff\xd8\xff"
+
+class ImagePayload:
+    """1枚の画像についてリモート呼び出しに渡すペイロードを一度だけ構築するクラス
+
+    キャプション生成と埋め込みの両方のステージで同じData URLを共有する。
+    元データが既にJPEGの場合はデコード・再エンコードせずにそのままBase64化する。
+    """
+
+    def __init__(self, image_data):
+        self.image_data = image_data
+        self.content_hash = hashlib.sha256(image_data).hexdigest()
+        self.jpeg_bytes = image_data if image_data.startswith(JPEG_MAGIC) else self._to_jpeg(image_data)
+        self.data_url = "data:image/jpeg;base64," + base64.b64encode(self.jpeg_bytes).decode("utf-8")
+
+    @staticmethod
+    def _to_jpeg(image_data):
+        """JPEG以外の画像データをJPEGに変換"""
+        img = Image.open(BytesIO(image_data))
+        buffered = BytesIO()
+        img.convert("RGB").save(buffered, format="JPEG")
+        return buffered.getvalue()
+
+    @property
+    def size(self):
+        """Data URLに含まれる画像のバイト数"""
+        return len(self.jpeg_bytes)
@@ -0,0 +1,36 @@
+from io import BytesIO
+from PIL import Image
+
+# 登録時に生成する縮小版画像（名前: 最大辺のピクセル数）
+RENDITION_SIZES = {
+    "thumbnail": 256,
+    "preview": 768
+}
+
+# 縮小版画像を格納するIMAGES表の列
+RENDITION_COLUMNS = {
+    "thumbnail": "thumbnail_data",
+    "preview": "preview_data",
+    "original": "image_data"
+}
+
+def make_renditions(image_data, quality=80):
+    """画像データからギャラリー用のWebP縮小版画像を生成し、{名前: バイト列} を返す"""
+    renditions = {}
+    with Image.open(BytesIO(image_data)) as img:
+        img = img.convert("RGB")
+        for name, max_size in RENDITION_SIZES.items():
+            resized = img.copy()
+            if max(resized.size) > max_size:
+                resized.thumbnail((max_size, max_size), Image.LANCZOS)
+            buffered = BytesIO()
+            resized.save(buffered, format="WEBP", quality=quality, method=4)
+            renditions[name] = buffered.getvalue()
+    return renditions
+
+def select_rendition(max_pixels):
+    """表示サイズ（最大辺のピクセル数）に収まる最小の縮小版画像の名前を返す"""
+    for name, max_size in sorted(RENDITION_SIZES.items(), key=lambda item: item[1]):
+        if max_pixels <= max_size:
+            return name
+    return "original"
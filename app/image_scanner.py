@@ -0,0 +1,25 @@
+import os
+
+# 登録対象とする画像の拡張子
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".webp")
+
+def scan_images(root, extensions=IMAGE_EXTENSIONS, recursive=True):
+    """os.scandirでディレクトリを走査し、画像ファイルを見つけた順に返すジェネレーター
+
+    (画像のパス, rootからの相対パス) を返す。相対パスの区切り文字は常に「/」。
+    ファイル一覧を事前に作らないため、巨大なディレクトリでもすぐに最初の画像を返せる。
+    """
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            with os.scandir(directory) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if recursive:
+                            pending.append(entry.path)
+                    elif entry.is_file() and entry.name.lower().endswith(extensions):
+                        relative_path = os.path.relpath(entry.path, root).replace(os.sep, "/")
+                        yield entry.path, relative_path
+        except OSError as e:
+            print(f"ディレクトリ '{directory}' の走査中にエラーが発生しました: {e}")
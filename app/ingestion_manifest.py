@@ -0,0 +1,104 @@
+import array
+import hashlib
+import sqlite3
+import threading
+import time
+
+# テーブル構成のバージョン（古いマニフェストは再実行用の記録なので作り直す）
+MANIFEST_SCHEMA_VERSION = 3
+
+class IngestionManifest:
+    """画像のSHA-256ごとに完了したモデル呼び出しの結果を記録するローカルマニフェスト
+
+    SQLiteファイルに追記のみで記録するため、処理が中断しても
+    再実行時に生成済みのキャプション・埋め込みベクトルを再利用できる。
+    モデルやプロンプトを変えた場合に古い結果を使わないよう、
+    キーにはモデルIDとプロンプトのハッシュも含める。
+    キャプションの埋め込みベクトルは画像ではなくキャプション本文のSHA-256で記録するため、
+    キャプションを生成し直した場合は古いキャプションのベクトルを使わない。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        if self._conn.execute("PRAGMA user_version").fetchone()[0] < MANIFEST_SCHEMA_VERSION:
+            # モデルIDを記録していない・キャプションの埋め込みを画像のハッシュで記録した古いマニフェストの結果は使わない
+            self._conn.execute("DROP TABLE IF EXISTS captions")
+            self._conn.execute("DROP TABLE IF EXISTS embeddings")
+            self._conn.execute(f"PRAGMA user_version = {MANIFEST_SCHEMA_VERSION}")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS captions (
+                content_hash TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                caption TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (content_hash, model_id, prompt_hash)
+            )
+        """)
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS embeddings (
+                input_hash TEXT NOT NULL,
+                kind TEXT NOT NULL,
+                model_id TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (input_hash, kind, model_id)
+            )
+        """)
+        self._conn.commit()
+
+    @staticmethod
+    def prompt_hash(prompt):
+        return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+    def get_caption(self, content_hash, model_id, prompt):
+        """記録済みのキャプションを返す（未記録の場合はNone）"""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT caption FROM captions WHERE content_hash = ? AND model_id = ? AND prompt_hash = ?",
+                (content_hash, model_id, self.prompt_hash(prompt))
+            ).fetchone()
+        return row[0] if row else None
+
+    def put_caption(self, content_hash, model_id, prompt, caption):
+        """生成したキャプションを記録する"""
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO captions (content_hash, model_id, prompt_hash, caption, created_at) VALUES (?, ?, ?, ?, ?)",
+                (content_hash, model_id, self.prompt_hash(prompt), caption, time.time())
+            )
+            self._conn.commit()
+
+    def get_embedding(self, input_hash, kind, model_id):
+        """記録済みの埋め込みベクトルをfloat32配列で返す（未記録の場合はNone）
+
+        input_hash は埋め込みの入力のハッシュ（画像はコンテンツハッシュ、キャプションは本文のSHA-256）。
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT vector FROM embeddings WHERE input_hash = ? AND kind = ? AND model_id = ?",
+                (input_hash, kind, model_id)
+            ).fetchone()
+        if row is None:
+            return None
+        vector = array.array('f')
+        vector.frombytes(row[0])
+        return vector
+
+    def put_embedding(self, input_hash, kind, model_id, vector):
+        """生成した埋め込みベクトルをfloat32のバイナリとして記録する"""
+        data = array.array('f', vector).tobytes()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO embeddings (input_hash, kind, model_id, vector, created_at) VALUES (?, ?, ?, ?, ?)",
+                (input_hash, kind, model_id, data, time.time())
+            )
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
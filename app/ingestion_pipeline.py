@@ -0,0 +1,191 @@
+import queue
+import threading
+import time
+
+# ステージ間を流れる終端マーカー
+_SENTINEL = object()
+
+class PipelineStage:
+    """パイプラインの1ステージ（処理関数と並列数）を表すクラス
+
+    batch_sizeが2以上の場合、処理関数はアイテムのリストを受け取り、
+    同じ順序の結果リストを返す。最初のアイテムを受け取ってから
+    batch_timeout秒以内に届いたアイテムを1つのバッチにまとめる。
+    結果リスト中の例外インスタンスは、そのアイテムの失敗として記録される。
+    """
+
+    def __init__(self, name, func, workers=1, batch_size=1, batch_timeout=0.05):
+        self.name = name
+        self.func = func
+        self.workers = max(1, int(workers))
+        self.batch_size = max(1, int(batch_size))
+        self.batch_timeout = batch_timeout
+
+class IngestionPipeline:
+    """ステージごとのワーカープールを有界キューで連結したパイプライン
+
+    各ステージの関数は1件のアイテムを受け取り、次のステージへ渡すアイテムを返す。
+    Noneを返したアイテムはそこで破棄される（スキップ扱い）。
+    キューが満杯のときは上流のステージが待機する（バックプレッシャー）。
+    """
+
+    def __init__(self, stages, queue_size=8, stop_on_error=True):
+        self.stages = stages
+        self.queue_size = max(1, int(queue_size))
+        self.stop_on_error = stop_on_error
+        self.errors = []
+        self.completed = 0
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def _put(self, target_queue, item):
+        """停止要求を確認しながらキューへ投入する"""
+        while not self._stop_event.is_set():
+            try:
+                target_queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, source_queue):
+        """停止要求を確認しながらキューから取り出す"""
+        while not self._stop_event.is_set():
+            try:
+                return source_queue.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _SENTINEL
+
+    def _record_error(self, stage, item, error):
+        with self._lock:
+            self.errors.append((stage.name, item, error))
+        print(f"ステージ '{stage.name}' でエラーが発生しました: {type(error).__name__}: {error}")
+        if self.stop_on_error:
+            self._stop_event.set()
+
+    def _feed(self, items, first_queue, first_stage):
+        """入力アイテムを先頭ステージのキューへ逐次投入する"""
+        try:
+            for item in items:
+                if not self._put(first_queue, item):
+                    break
+        except Exception as e:
+            self._record_error(first_stage, None, e)
+        finally:
+            for _ in range(first_stage.workers):
+                self._put(first_queue, _SENTINEL)
+
+    def _get_batch(self, stage, source_queue):
+        """先頭アイテムの到着から一定時間内に届いたアイテムをまとめて取り出す
+
+        戻り値は (バッチ, 終端を受け取ったか)。
+        """
+        first = self._get(source_queue)
+        if first is _SENTINEL:
+            return [], True
+        batch = [first]
+        deadline = time.time() + stage.batch_timeout
+        while len(batch) < stage.batch_size:
+            remaining_time = deadline - time.time()
+            if remaining_time <= 0:
+                break
+            try:
+                item = source_queue.get(timeout=remaining_time)
+            except queue.Empty:
+                break
+            if item is _SENTINEL:
+                return batch, True
+            batch.append(item)
+        return batch, False
+
+    def _emit(self, out_queue, result):
+        """処理結果を下流へ渡す（最終ステージでは完了数を数える）"""
+        if result is None:
+            return True
+        if out_queue is None:
+            with self._lock:
+                self.completed += 1
+            return True
+        return self._put(out_queue, result)
+
+    def _work(self, stage, in_queue, out_queue, next_workers, remaining):
+        """1ステージのワーカー本体"""
+        try:
+            finished = False
+            while not finished:
+                if stage.batch_size > 1:
+                    items, finished = self._get_batch(stage, in_queue)
+                    if not items:
+                        break
+                    try:
+                        results = stage.func(items)
+                    except Exception as e:
+                        for item in items:
+                            self._record_error(stage, item, e)
+                        continue
+                else:
+                    item = self._get(in_queue)
+                    if item is _SENTINEL:
+                        break
+                    items = [item]
+                    try:
+                        results = [stage.func(item)]
+                    except Exception as e:
+                        self._record_error(stage, item, e)
+                        continue
+
+                for item, result in zip(items, results):
+                    if isinstance(result, Exception):
+                        self._record_error(stage, item, result)
+                    elif not self._emit(out_queue, result):
+                        finished = True
+                        break
+        finally:
+            # ステージの最後のワーカーが下流へ終端を伝える
+            with self._lock:
+                remaining[stage.name] -= 1
+                is_last = remaining[stage.name] == 0
+            if is_last and out_queue is not None:
+                for _ in range(next_workers):
+                    self._put(out_queue, _SENTINEL)
+
+    def run(self, items):
+        """パイプラインを実行し、全ステージの完了を待つ"""
+        start_time = time.time()
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+        remaining = {stage.name: stage.workers for stage in self.stages}
+
+        threads = []
+        for index, stage in enumerate(self.stages):
+            out_queue = queues[index + 1] if index + 1 < len(self.stages) else None
+            next_workers = self.stages[index + 1].workers if out_queue is not None else 0
+            for worker_index in range(stage.workers):
+                thread = threading.Thread(
+                    target=self._work,
+                    args=(stage, queues[index], out_queue, next_workers, remaining),
+                    name=f"{stage.name}-{worker_index}",
+                    daemon=True
+                )
+                thread.start()
+                threads.append(thread)
+
+        feeder = threading.Thread(
+            target=self._feed,
+            args=(items, queues[0], self.stages[0]),
+            name="feeder",
+            daemon=True
+        )
+        feeder.start()
+
+        feeder.join()
+        for thread in threads:
+            thread.join()
+
+        elapsed = time.time() - start_time
+        return {
+            "completed": self.completed,
+            "errors": len(self.errors),
+            "stopped": self._stop_event.is_set(),
+            "elapsed": elapsed
+        }
@@ -0,0 +1,397 @@
+import bisect
+import os
+import re
+import time
+import unicodedata
+from io import BytesIO
+import numpy as np
+from PIL import Image
+from app.embedding_snapshot import load_snapshot
+from app.hnsw_index import HNSWIndex
+from app.image_renditions import RENDITION_SIZES
+from app.vector_quantization import (
+    binary_matrix, hamming_distances, int8_cosine_scores, int8_matrix, int8_row_norms, quantize_binary, quantize_int8
+)
+
+class LocalVectorStore:
+    """DatabaseServiceと同じインターフェースで、プロセス内のNumPy配列に対して検索するバックエンド
+
+    キャプションと画像の埋め込みベクトルをそれぞれ連続したfloat32の行列に保持し、
+    ベクトル検索は行列とクエリーベクトルの内積と argpartition による上位k件の選択で行う。
+    全文検索はキャプションの文字bigram（と1文字）の転置インデックスで候補を絞り込んでから部分一致で判定する。
+    画像は image_dir のファイル、または image_source（DatabaseService）から取得する。
+    ann_index="hnsw" の場合はベクトル検索に全件の内積ではなくHNSWインデックスを使い、
+    ann_index_path を指定するとインデックスを保存して次回の起動時に再利用する。
+    vector_search_mode が "binary" または "int8" の場合は、量子化した行列で top_k × overfetch 件の
+    候補を選んでから、float32の行列で再スコアリングする2段階検索を行う。
+    """
+
+    # ANNインデックスを作成する埋め込みベクトルの列
+    ANN_COLUMNS = ("caption_embedding", "image_embedding")
+
+    def __init__(self, image_source=None, image_dir=None, image_cache=None, ann_index="exact", hnsw_params=None, ann_index_path=None,
+                 vector_search_mode="float", overfetch=10):
+        self.image_source = image_source
+        self.image_dir = image_dir
+        self.image_cache = image_cache
+        self.ann_index = ann_index
+        self.hnsw_params = hnsw_params or {}
+        self.ann_index_path = ann_index_path
+        self.ann_indexes = {}
+        self.vector_search_mode = vector_search_mode
+        self.overfetch = overfetch
+        self.quantized = {}
+        self.image_ids = np.empty(0, dtype=np.int64)
+        self.file_names = []
+        self.captions = []
+        self.upload_dates = []
+        self.caption_matrix = np.empty((0, 0), dtype=np.float32)
+        self.image_matrix = np.empty((0, 0), dtype=np.float32)
+        self._row_by_id = {}
+        self._normalized_captions = []
+        self._bigram_index = {}
+        self._recent_keys = []
+        self._recent_rows = []
+        self._pending_rows = []
+
+    @classmethod
+    def load_from_database(cls, db_pool, batch_size=1000, **kwargs):
+        """IMAGESテーブルから画像以外の列を読み込んでストアを構築する"""
+        store = cls(**kwargs)
+        start = time.monotonic()
+        with db_pool.acquire() as conn:
+            cursor = conn.cursor()
+            try:
+                cursor.arraysize = batch_size
+                # 保存したANNインデックスのノード順と一致させるため、画像IDの順に読み込む
+                cursor.execute("""
+                    SELECT image_id, file_name, caption, caption_embedding, image_embedding, upload_date
+                    FROM IMAGES
+                    ORDER BY image_id
+                """)
+                while True:
+                    rows = cursor.fetchmany()
+                    if not rows:
+                        break
+                    store.add_rows(rows, rebuild=False)
+            finally:
+                cursor.close()
+        store.rebuild()
+        print(f"ローカルベクトルストアに {len(store.file_names)} 件を読み込みました（{time.monotonic() - start:.1f} 秒）")
+        return store
+
+    @classmethod
+    def load_from_snapshot(cls, snapshot_dir, **kwargs):
+        """102_export_embedding_snapshot.py で書き出したスナップショットからストアを構築する
+
+        埋め込みベクトルの行列はメモリマップしたファイルをそのまま使うため、コピーもデシリアライズもしない。
+        """
+        start = time.monotonic()
+        snapshot = load_snapshot(snapshot_dir)
+        store = cls(**kwargs)
+        store.image_ids = np.asarray(snapshot.image_ids)
+        store.caption_matrix = snapshot.caption_embeddings
+        store.image_matrix = snapshot.image_embeddings
+        store._index_metadata(list(snapshot.iter_metadata()), 0)
+        print(f"スナップショット {snapshot.meta['version']} から {snapshot.rows} 件を読み込みました（{time.monotonic() - start:.1f} 秒）")
+        return store
+
+    def add_rows(self, rows, rebuild=True):
+        """(image_id, file_name, caption, caption_embedding, image_embedding, upload_date) の行を追加する"""
+        self._pending_rows.extend(rows)
+        if rebuild:
+            self.rebuild()
+
+    def rebuild(self):
+        """追加された行を行列・転置インデックス・アップロード日時の並びに反映する"""
+        rows = self._pending_rows
+        self._pending_rows = []
+        if not rows:
+            return
+        offset = len(self.file_names)
+        caption_vectors = [np.asarray(row[3], dtype=np.float32) for row in rows]
+        image_vectors = [np.asarray(row[4], dtype=np.float32) for row in rows]
+        self.image_ids = np.concatenate([self.image_ids, np.array([row[0] for row in rows], dtype=np.int64)])
+        self.caption_matrix = self._append_matrix(self.caption_matrix, caption_vectors)
+        self.image_matrix = self._append_matrix(self.image_matrix, image_vectors)
+        self._index_metadata([(row[0], row[1], row[2], row[5]) for row in rows], offset)
+
+    def _index_metadata(self, rows, offset):
+        """(image_id, file_name, caption, upload_date) の行を転置インデックスとアップロード日時の並びに登録する"""
+        for i, (image_id, file_name, caption, upload_date) in enumerate(rows):
+            row_index = offset + i
+            self._row_by_id[image_id] = row_index
+            self.file_names.append(file_name)
+            self.captions.append(caption)
+            self.upload_dates.append(upload_date)
+            normalized = self._normalize(caption or "")
+            self._normalized_captions.append(normalized)
+            # 1文字の語でも検索できるように、bigramに加えて各文字も登録する
+            for gram in self._bigrams(normalized) | set(normalized):
+                self._bigram_index.setdefault(gram, []).append(row_index)
+        # 新しい順のページングに使う (upload_date, image_id) の昇順の並び
+        order = sorted(range(len(self.file_names)), key=lambda row_index: (self.upload_dates[row_index], int(self.image_ids[row_index])))
+        self._recent_rows = order
+        self._recent_keys = [(self.upload_dates[row_index], int(self.image_ids[row_index])) for row_index in order]
+        if self.ann_index == "hnsw":
+            self._update_ann_indexes()
+        if self.vector_search_mode in ("binary", "int8"):
+            self._update_quantized()
+
+    def _update_quantized(self):
+        """2段階検索の1段目で使う量子化した行列を作り直す"""
+        for column, matrix in zip(self.ANN_COLUMNS, (self.caption_matrix, self.image_matrix)):
+            if self.vector_search_mode == "binary":
+                self.quantized[column] = binary_matrix(matrix)
+            else:
+                rows = int8_matrix(matrix)
+                self.quantized[column] = (rows, int8_row_norms(rows))
+
+    def _ann_index_file(self, column):
+        return f"{self.ann_index_path}.{column}.npz"
+
+    def _load_ann_index(self, column, matrix):
+        """保存したインデックスが現在の行の先頭部分と一致する場合だけ読み込む"""
+        if self.ann_index_path is None or not os.path.exists(self._ann_index_file(column)):
+            return None
+        index = HNSWIndex.load(self._ann_index_file(column))
+        if index.dimension != matrix.shape[1] or len(index) > len(self.image_ids) \
+                or not np.array_equal(index.labels, self.image_ids[:len(index)]):
+            print(f"{self._ann_index_file(column)} は現在のデータと一致しないため、インデックスを作り直します")
+            return None
+        return index
+
+    def _update_ann_indexes(self):
+        """HNSWインデックスに未登録の行を追加する（保存済みのインデックスがあれば差分だけ追加する）"""
+        for column, matrix in zip(self.ANN_COLUMNS, (self.caption_matrix, self.image_matrix)):
+            index = self.ann_indexes.get(column) or self._load_ann_index(column, matrix)
+            if index is None:
+                index = HNSWIndex(matrix.shape[1], **self.hnsw_params)
+            added = len(self.image_ids) - len(index)
+            if added > 0:
+                start = time.monotonic()
+                index.add_items(matrix[len(index):], self.image_ids[len(index):])
+                print(f"{column} のHNSWインデックスに {added} 件を追加しました（{time.monotonic() - start:.1f} 秒）")
+                if self.ann_index_path is not None:
+                    index.save(self._ann_index_file(column))
+            self.ann_indexes[column] = index
+
+    @staticmethod
+    def _append_matrix(matrix, vectors):
+        """ベクトルのリストを行列の末尾に追加する（次元がそろわない行はゼロベクトルとする）"""
+        dimension = matrix.shape[1] if matrix.size else max((vector.size for vector in vectors), default=0)
+        block = np.zeros((len(vectors), dimension), dtype=np.float32)
+        for i, vector in enumerate(vectors):
+            if vector.size == dimension:
+                block[i] = vector
+        return np.vstack([matrix, block]) if matrix.size else block
+
+    @staticmethod
+    def _normalize(text):
+        return unicodedata.normalize("NFKC", text).lower()
+
+    @staticmethod
+    def _bigrams(text):
+        if len(text) < 2:
+            return {text} if text else set()
+        return {text[i:i + 2] for i in range(len(text) - 1)}
+
+    def _make_result(self, row_index, distance, search_mode):
+        return {
+            'image_id': int(self.image_ids[row_index]),
+            'file_name': self.file_names[row_index],
+            'caption': self.captions[row_index],
+            'image': None,
+            'distance': distance,
+            'search_mode': search_mode
+        }
+
+    def _vector_search(self, matrix, query_embedding, top_k, vector_threshold, search_mode, column):
+        """内積の上位top_k件のうち、しきい値以上のものを距離（-内積）の昇順で返す"""
+        executed_sql = f"-- ローカルベクトルストア: {column} との内積の上位 {top_k} 件（内積 >= {vector_threshold}）"
+        if not matrix.size or top_k <= 0:
+            return [], executed_sql
+        query = np.asarray(query_embedding, dtype=np.float32)
+        index = self.ann_indexes.get(column)
+        if index is not None:
+            labels, scores = index.search(query, top_k)
+            results = [
+                self._make_result(self._row_by_id[int(label)], -float(score), search_mode)
+                for label, score in zip(labels, scores) if score >= vector_threshold
+            ]
+            return results, executed_sql.replace("内積の上位", "内積のHNSWによる近似上位")
+        if column in self.quantized:
+            return self._two_stage_search(matrix, query, top_k, vector_threshold, search_mode, column), \
+                executed_sql.replace("内積の上位", f"{self.vector_search_mode}量子化で {top_k * self.overfetch} 件に絞り込んだ後の内積の上位")
+        scores = matrix @ query
+        k = min(top_k, scores.size)
+        candidates = np.argpartition(-scores, k - 1)[:k]
+        candidates = candidates[np.argsort(-scores[candidates], kind="stable")]
+        results = [
+            self._make_result(row_index, -float(scores[row_index]), search_mode)
+            for row_index in candidates if scores[row_index] >= vector_threshold
+        ]
+        return results, executed_sql
+
+    def _two_stage_search(self, matrix, query, top_k, vector_threshold, search_mode, column):
+        """量子化した行列で候補を選び、候補の行だけfloat32の内積で再スコアリングする"""
+        if self.vector_search_mode == "binary":
+            stage1_scores = -hamming_distances(self.quantized[column], quantize_binary(query))
+        else:
+            rows, norms = self.quantized[column]
+            stage1_scores = int8_cosine_scores(rows, quantize_int8(query), norms)
+        candidate_count = min(top_k * self.overfetch, stage1_scores.size)
+        # メモリマップした行列を先頭から順に読むように候補の行番号を並べ替えておく
+        candidates = np.sort(np.argpartition(-stage1_scores, candidate_count - 1)[:candidate_count])
+        scores = np.asarray(matrix[candidates] @ query)
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        return [
+            self._make_result(int(candidates[i]), -float(scores[i]), search_mode)
+            for i in order if scores[i] >= vector_threshold
+        ]
+
+    def search_by_caption_vector(self, query_embedding, top_k=5, vector_threshold=0.5):
+        """ベクトル埋め込みによるキャプション検索"""
+        return self._vector_search(self.caption_matrix, query_embedding, top_k, vector_threshold, "ベクトル検索", "caption_embedding")
+
+    def search_by_image_vector(self, query_embedding, top_k=5, vector_threshold=0.5):
+        """画像ベクトルによる検索"""
+        return self._vector_search(self.image_matrix, query_embedding, top_k, vector_threshold, "画像", "image_embedding")
+
+    @staticmethod
+    def _parse_text_query(search_query):
+        """SearchQueryGeneratorが生成したOracle Textのクエリーを [[OR条件の語, ...], ...]（AND条件の並び）に変換する"""
+        clauses = []
+        for clause in re.split(r'\s+AND\s+', search_query.strip()):
+            clause = clause.strip()
+            if clause.startswith('(') and clause.endswith(')') and ' OR ' in clause:
+                terms = re.split(r'\s+OR\s+', clause[1:-1])
+            else:
+                terms = [clause]
+            terms = [re.sub(r'\\(.)', r'\1', term).strip() for term in terms]
+            terms = [term for term in terms if term]
+            if terms:
+                clauses.append(terms)
+        return clauses
+
+    def _term_candidates(self, term):
+        """語のすべてのbigramを含む行の集合"""
+        candidates = None
+        for bigram in self._bigrams(term):
+            rows = self._bigram_index.get(bigram)
+            if rows is None:
+                return set()
+            candidates = set(rows) if candidates is None else candidates & set(rows)
+            if not candidates:
+                return set()
+        return candidates or set()
+
+    def search_by_fulltext(self, search_query, top_k=5, keyword_threshold=0):
+        """全文検索によるキャプション検索
+
+        スコアはOracle Textと同様に0～100とし、語の出現回数×10（上限100）を
+        ORでは最大値、ANDでは最小値で組み合わせた近似値とする。
+        """
+        executed_sql = f"-- ローカルベクトルストア: キャプションのbigram転置インデックスで '{search_query}' を検索（スコア >= {keyword_threshold}）"
+        clauses = [[self._normalize(term) for term in terms] for terms in self._parse_text_query(search_query)]
+        if not clauses:
+            return [], executed_sql
+
+        scores = None
+        for terms in clauses:
+            clause_scores = {}
+            for term in terms:
+                for row_index in self._term_candidates(term):
+                    count = self._normalized_captions[row_index].count(term)
+                    if count:
+                        clause_scores[row_index] = max(clause_scores.get(row_index, 0), min(100, count * 10))
+            if scores is None:
+                scores = clause_scores
+            else:
+                scores = {row_index: min(score, clause_scores[row_index]) for row_index, score in scores.items() if row_index in clause_scores}
+            if not scores:
+                return [], executed_sql
+
+        ranked = sorted(
+            (item for item in scores.items() if item[1] >= keyword_threshold),
+            key=lambda item: (-item[1], int(self.image_ids[item[0]]))
+        )[:top_k]
+        return [self._make_result(row_index, score, "全文検索") for row_index, score in ranked], executed_sql
+
+    def search_hybrid_rrf(self, query_embedding, search_query, top_k=5, vector_threshold=0.5, keyword_threshold=0, rrf_k=60):
+        """ベクトル検索と全文検索の結果をReciprocal Rank Fusionで統合する（DatabaseService.search_hybrid_rrfと同じ形式で返す）"""
+        vector_results, vector_sql = self.search_by_caption_vector(query_embedding, top_k, vector_threshold)
+        keyword_results, keyword_sql = self.search_by_fulltext(search_query, top_k, keyword_threshold)
+        fused = {}
+        for rank, result in enumerate(vector_results, 1):
+            fused[result['image_id']] = dict(result, rrf_score=1 / (rrf_k + rank), vector_distance=result['distance'], keyword_score=None)
+        for rank, result in enumerate(keyword_results, 1):
+            if result['image_id'] in fused:
+                fused[result['image_id']]['rrf_score'] += 1 / (rrf_k + rank)
+                fused[result['image_id']]['keyword_score'] = result['distance']
+            else:
+                fused[result['image_id']] = dict(result, rrf_score=1 / (rrf_k + rank), vector_distance=None, keyword_score=result['distance'])
+        combined_results = sorted(fused.values(), key=lambda result: (-result['rrf_score'], result['image_id']))
+        return combined_results, vector_results, keyword_results, f"{vector_sql}\n{keyword_sql}"
+
+    def _recent_result(self, row_index):
+        result = self._make_result(row_index, None, "最近のアップロード")
+        result['upload_date'] = self.upload_dates[row_index]
+        return result
+
+    def get_recent_images(self, top_k=12, offset=0):
+        """最近アップロードされた画像を取得"""
+        rows = self._recent_rows[::-1][offset:offset + top_k]
+        return [self._recent_result(row_index) for row_index in rows], f"-- ローカルベクトルストア: アップロード日時の新しい順に {offset} 件目から {top_k} 件"
+
+    def get_recent_images_page(self, top_k=12, cursor_key=None, direction="next"):
+        """最近アップロードされた画像をキーセット方式で1ページ分取得（新しい順）"""
+        executed_sql = f"-- ローカルベクトルストア: (upload_date, image_id) が {cursor_key} より{'新しい' if direction == 'prev' else '古い'} {top_k} 件"
+        if cursor_key is None:
+            end = len(self._recent_keys)
+            start = max(0, end - top_k)
+        elif direction == "prev":
+            start = bisect.bisect_right(self._recent_keys, tuple(cursor_key))
+            end = min(len(self._recent_keys), start + top_k)
+        else:
+            end = bisect.bisect_left(self._recent_keys, tuple(cursor_key))
+            start = max(0, end - top_k)
+        rows = self._recent_rows[start:end][::-1]
+        return [self._recent_result(row_index) for row_index in rows], executed_sql
+
+    def get_total_image_count(self):
+        """画像の総数を取得"""
+        return len(self.file_names)
+
+    def fetch_images(self, image_ids, rendition="original", batch_size=500):
+        """画像IDのリストに対応する画像をまとめて取得し、{image_id: PILイメージ} を返す"""
+        if self.image_dir is None:
+            if self.image_source is None:
+                return {}
+            return self.image_source.fetch_images(image_ids, rendition, batch_size)
+
+        images = {}
+        for image_id in dict.fromkeys(image_ids):
+            if self.image_cache is not None:
+                image = self.image_cache.get(image_id, rendition)
+                if image is not None:
+                    images[image_id] = image
+                    continue
+            row_index = self._row_by_id.get(image_id)
+            if row_index is None:
+                continue
+            path = os.path.join(self.image_dir, self.file_names[row_index])
+            try:
+                with open(path, 'rb') as f:
+                    image = Image.open(BytesIO(f.read()))
+            except OSError as e:
+                print(f"画像ファイルを読み込めませんでした: {path} ({e})")
+                continue
+            # 縮小版画像はファイルから都度生成する
+            if rendition in RENDITION_SIZES:
+                image.draft('RGB', (RENDITION_SIZES[rendition], RENDITION_SIZES[rendition]))
+                image.thumbnail((RENDITION_SIZES[rendition], RENDITION_SIZES[rendition]))
+            images[image_id] = image
+            if self.image_cache is not None:
+                self.image_cache.put(image_id, rendition, image)
+        return images
@@ -0,0 +1,131 @@
+import array
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+class ModelOutputCache:
+    """キャプションと埋め込みベクトルを永続化するローカルキャッシュ
+
+    キーは (種類, コンテンツハッシュ, モデルID, プロンプト) から導出する。
+    値はキャプションならUTF-8、埋め込みベクトルならfloat32のバイナリで保存し、
+    合計サイズが max_bytes を超えたら最終アクセスが古い順に削除する。
+    ヒット時の最終アクセス日時はメモリ上に溜め、touch_batch 件ごと・書き込み時・close時にまとめて更新する
+    （再開した実行のヒットのたびにSQLiteへ書き込まない）。
+    """
+
+    def __init__(self, path, max_bytes=2 * 1024 ** 3, touch_batch=256):
+        self.path = os.path.expanduser(path)
+        self.max_bytes = max_bytes
+        self.touch_batch = touch_batch
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        # 未反映の最終アクセス日時（cache_key → 時刻）
+        self._touched = {}
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS entries (
+                cache_key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                size INTEGER NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_entries_last_access ON entries(last_access)")
+        self._conn.commit()
+        self._total_bytes = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+
+    @staticmethod
+    def make_key(kind, content_hash, model_id, prompt=""):
+        return hashlib.sha256(f"{kind}\0{content_hash}\0{model_id}\0{prompt}".encode("utf-8")).hexdigest()
+
+    def _get(self, cache_key):
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM entries WHERE cache_key = ?", (cache_key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._touched[cache_key] = time.time()
+            if len(self._touched) >= self.touch_batch:
+                self._flush_touched_locked()
+                self._conn.commit()
+            return row[0]
+
+    def _flush_touched_locked(self):
+        """溜めておいた最終アクセス日時をまとめて反映する"""
+        if self._touched:
+            self._conn.executemany(
+                "UPDATE entries SET last_access = ? WHERE cache_key = ?",
+                [(last_access, cache_key) for cache_key, last_access in self._touched.items()]
+            )
+            self._touched.clear()
+
+    def _put(self, cache_key, value):
+        with self._lock:
+            old = self._conn.execute("SELECT size FROM entries WHERE cache_key = ?", (cache_key,)).fetchone()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO entries (cache_key, value, size, last_access) VALUES (?, ?, ?, ?)",
+                (cache_key, value, len(value), time.time())
+            )
+            self._total_bytes += len(value) - (old[0] if old else 0)
+            self._touched.pop(cache_key, None)
+            # 削除対象を正しく選べるよう、先に最終アクセス日時を反映する
+            self._flush_touched_locked()
+            self._evict_locked()
+            self._conn.commit()
+
+    def _evict_locked(self):
+        """合計サイズが上限の90%以下になるまで最終アクセスが古いエントリを削除する"""
+        if self._total_bytes <= self.max_bytes:
+            return
+        target = self.max_bytes * 0.9
+        rows = self._conn.execute("SELECT cache_key, size FROM entries ORDER BY last_access").fetchall()
+        for cache_key, size in rows:
+            if self._total_bytes <= target:
+                break
+            self._conn.execute("DELETE FROM entries WHERE cache_key = ?", (cache_key,))
+            self._total_bytes -= size
+            self.evictions += 1
+
+    def get_caption(self, content_hash, model_id, prompt):
+        value = self._get(self.make_key("caption", content_hash, model_id, prompt))
+        return value.decode("utf-8") if value is not None else None
+
+    def put_caption(self, content_hash, model_id, prompt, caption):
+        self._put(self.make_key("caption", content_hash, model_id, prompt), caption.encode("utf-8"))
+
+    def get_embedding(self, content_hash, model_id, input_type):
+        value = self._get(self.make_key("embedding", content_hash, model_id, input_type))
+        if value is None:
+            return None
+        vector = array.array('f')
+        vector.frombytes(value)
+        return vector
+
+    def put_embedding(self, content_hash, model_id, input_type, vector):
+        self._put(self.make_key("embedding", content_hash, model_id, input_type), array.array('f', vector).tobytes())
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "total_bytes": self._total_bytes
+        }
+
+    def close(self):
+        with self._lock:
+            self._flush_touched_locked()
+            self._conn.commit()
+            self._conn.close()
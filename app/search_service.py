@@ -1,12 +1,52 @@
 import array
 import re
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
 from PIL import Image
+from app.image_renditions import select_rendition
 
 class SearchService:
-    def __init__(self, embedding_service, database_service, search_query_generator):
+    def __init__(self, embedding_service, database_service, search_query_generator, gallery_tile_size=256, image_count_cache=None,
+                 hybrid_branch_timeout=10.0, search_workers=8, hybrid_search_mode="parallel"):
         self.embedding_service = embedding_service
         self.database_service = database_service
         self.search_query_generator = search_query_generator
+        self.image_count_cache = image_count_cache
+        # ハイブリッド検索のベクトル検索と全文検索を並行して実行する共有スレッドプール
+        self.hybrid_branch_timeout = hybrid_branch_timeout
+        self.search_executor = ThreadPoolExecutor(max_workers=search_workers, thread_name_prefix="search")
+        # "parallel": 2つの検索を並行実行してPythonで統合、"rrf": 1つのSQLでRRFにより統合
+        self.hybrid_search_mode = hybrid_search_mode
+        # ギャラリーのタイルに収まる最小の縮小版画像を使用する
+        self.gallery_rendition = select_rendition(gallery_tile_size)
+        # 選択した画像の拡大表示にはプレビュー用の縮小版画像を使用する
+        self.detail_rendition = "preview"
+        
+    def get_gallery_images(self, results):
+        """検索結果の画像をまとめて取得し、ギャラリー表示用のPILイメージのリストを返す"""
+        # 画像が未取得の結果だけを対象に、画像IDでまとめて1回で取得する
+        missing_ids = [result['image_id'] for result in results if result.get('image') is None]
+        if missing_ids:
+            images = self.database_service.fetch_images(missing_ids, self.gallery_rendition)
+            for result in results:
+                if result.get('image') is None:
+                    result['image'] = images.get(result['image_id'])
+                    
+        output_images = []
+        for result in results:
+            if isinstance(result['image'], Image.Image):
+                output_images.append(result['image'])
+        return output_images
+        
+    def get_detail_image(self, image_id):
+        """選択された画像を拡大表示用の縮小版画像で返す（取得できない場合はNone）"""
+        return self.database_service.fetch_images([image_id], self.detail_rendition).get(image_id)
+        
+    def get_total_image_count(self):
+        """画像の総数を返す（キャッシュがある場合はキャッシュした値を使う）"""
+        if self.image_count_cache is not None:
+            return self.image_count_cache.get()
+        return self.database_service.get_total_image_count()
         
     def normalize_newlines(self, text):
         """3つ以上連続する改行を2つの改行に変換する"""
@@ -79,18 +119,64 @@ class SearchService:
         )
         return results, "（アップロードされた画像）", executed_sql
         
+    def _wait_for_branch(self, future, search_mode, deadline):
+        """並行して実行した検索の結果を待ち、タイムアウトやエラーの場合は空の結果を返す"""
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"ハイブリッド検索 - {search_mode}が {self.hybrid_branch_timeout} 秒以内に完了しなかったため、結果から除外します")
+            return [], f"（{search_mode}がタイムアウトしました）", ""
+        except Exception as e:
+            print(f"ハイブリッド検索 - {search_mode}中にエラーが発生しました: {e}")
+            return [], f"（{search_mode}でエラーが発生しました）", ""
+        
+    def hybrid_search_rrf(self, query, top_k=5, vector_threshold=0.5, keyword_threshold=10):
+        """ベクトル検索と全文検索を1回のSQL実行で行い、Reciprocal Rank Fusionで統合する"""
+        # クエリの埋め込みベクトル（Cohere）と全文検索クエリ（GiNZA）は並行して生成する
+        embedding_future = self.search_executor.submit(self.embedding_service.get_text_embedding, query, "search_query")
+        search_query = self.search_query_generator.generate(query)
+        query_embedding = array.array('f', embedding_future.result())
+        
+        combined_results, vector_results, keyword_results, executed_sql = self.database_service.search_hybrid_rrf(
+            query_embedding, search_query, top_k, vector_threshold, keyword_threshold
+        )
+        
+        # 両方の検索結果が0件の場合、最新の画像を返す
+        if not combined_results:
+            vector_results, _, _ = self.search_by_caption("", "ベクトル検索", top_k, 0, 0)
+            combined_results = vector_results
+        
+        return (
+            combined_results,
+            vector_results,
+            keyword_results,
+            f"ベクトル検索: {query}\n全文検索: {search_query}",
+            f"ハイブリッド検索（RRF）: {executed_sql}"
+        )
+        
     def hybrid_search(self, query, top_k=5, vector_threshold=0.5, keyword_threshold=10):
         """ベクトル検索と全文検索の結果を統合する"""
-        # ベクトル検索の実行
-        vector_results, vector_query, vector_sql = self.search_by_caption(
-            query, "ベクトル検索", top_k, vector_threshold, 0
+        if self.hybrid_search_mode == "rrf" and query.strip():
+            try:
+                return self.hybrid_search_rrf(query, top_k, vector_threshold, keyword_threshold)
+            except Exception as e:
+                # RRFのSQL（全文検索インデックスのエラーなど）が失敗した場合は、成功した方の結果だけでも返せる並行実行に切り替える
+                print(f"ハイブリッド検索（RRF）でエラーが発生したため、並行実行に切り替えます: {e}")
+            
+        # ベクトル検索（Cohere + ベクトル検索）と全文検索（GiNZA + Oracle Text）を並行して実行
+        vector_future = self.search_executor.submit(
+            self.search_by_caption, query, "ベクトル検索", top_k, vector_threshold, 0
         )
-        
-        # 全文検索の実行
-        keyword_results, keyword_query, keyword_sql = self.search_by_caption(
-            query, "全文検索", top_k, 0, keyword_threshold
+        keyword_future = self.search_executor.submit(
+            self.search_by_caption, query, "全文検索", top_k, 0, keyword_threshold
         )
         
+        # どちらかがタイムアウト・失敗した場合は、もう一方の結果だけで統合する
+        deadline = time.monotonic() + self.hybrid_branch_timeout
+        vector_results, vector_query, vector_sql = self._wait_for_branch(vector_future, "ベクトル検索", deadline)
+        keyword_results, keyword_query, keyword_sql = self._wait_for_branch(keyword_future, "全文検索", deadline)
+        
         # print(f"ハイブリッド検索 - ベクトル検索結果数: {len(vector_results)}, 全文検索結果数: {len(keyword_results)}")
         
         # ベクトル検索と全文検索の両方で結果が0件の場合、最新の画像を返す
@@ -130,10 +216,7 @@ class SearchService:
             )
             
             # 検索結果を整形
-            output_images = []
-            for result in results:
-                if isinstance(result['image'], Image.Image):
-                    output_images.append(result['image'])
+            output_images = self.get_gallery_images(results)
             
             if results:
                 first_result = results[0]
@@ -167,21 +250,13 @@ class SearchService:
             )
             
             # ベクトル検索と全文検索の結果をそれぞれのギャラリー用に整形
-            vector_images = []
-            keyword_images = []
-            
             # print(f"ベクトル検索結果: {len(vector_results)}件")
             # print(f"全文検索結果: {len(keyword_results)}件")
             
-            # ベクトル検索結果の画像を抽出
-            for result in vector_results:
-                if isinstance(result['image'], Image.Image):
-                    vector_images.append(result['image'])
-                    
-            # 全文検索結果の画像を抽出
-            for result in keyword_results:
-                if isinstance(result['image'], Image.Image):
-                    keyword_images.append(result['image'])
+            # 両方の結果の画像を1回でまとめて取得してから、それぞれの画像を抽出
+            self.get_gallery_images(vector_results + keyword_results)
+            vector_images = self.get_gallery_images(vector_results)
+            keyword_images = self.get_gallery_images(keyword_results)
                     
             # print(f"検索結果サマリー - ベクトルギャラリー: {len(vector_images)}枚, 全文検索ギャラリー: {len(keyword_images)}枚")
             # print(f"全文検索結果ファイル名: {[r.get('file_name') for r in keyword_results]}")
@@ -223,10 +298,7 @@ class SearchService:
                     executed_query = "（画像がアップロードされていないため、最近アップロードされた画像を表示しています）"
             
             # 結果を整形
-            output_images = []
-            for result in results:
-                if isinstance(result['image'], Image.Image):
-                    output_images.append(result['image'])
+            output_images = self.get_gallery_images(results)
             
             if results:
                 first_result = results[0]
@@ -254,10 +326,7 @@ class SearchService:
         results, executed_sql = self.database_service.get_recent_images(top_k, 0)  # オフセット0で取得
         
         # 結果を整形
-        output_images = []
-        for result in results:
-            if isinstance(result['image'], Image.Image):
-                output_images.append(result['image'])
+        output_images = self.get_gallery_images(results)
             
         if results:
             first_result = results[0]
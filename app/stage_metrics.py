@@ -0,0 +1,92 @@
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+class StageMetrics:
+    """登録処理のステージごとの所要時間と送信バイト数を記録するクラス"""
+
+    # 外部サービスの応答待ちとして集計するステージ
+    PROVIDER_STAGES = {
+        "oci_genai": ("caption",),
+        "cohere": ("image_embed", "text_embed"),
+        "database": ("insert", "commit")
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = {}
+        self._bytes = {}
+
+    def record(self, stage, seconds, nbytes=0):
+        with self._lock:
+            self._samples.setdefault(stage, []).append(seconds)
+            self._bytes[stage] = self._bytes.get(stage, 0) + nbytes
+
+    @contextmanager
+    def measure(self, stage, nbytes=0):
+        """with文のブロックの所要時間をstageの1サンプルとして記録する"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start, nbytes)
+
+    @staticmethod
+    def _percentile(sorted_samples, percent):
+        if not sorted_samples:
+            return 0.0
+        rank = max(1, math.ceil(len(sorted_samples) * percent / 100))
+        return sorted_samples[rank - 1]
+
+    def report(self, elapsed, images, extra=None):
+        """JSONに書き出せる形式の集計結果を返す"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+            sent_bytes = dict(self._bytes)
+
+        stages = {}
+        for stage, values in samples.items():
+            stages[stage] = {
+                "count": len(values),
+                "total_seconds": sum(values),
+                "p50_seconds": self._percentile(values, 50),
+                "p95_seconds": self._percentile(values, 95),
+                "p99_seconds": self._percentile(values, 99),
+                "max_seconds": values[-1],
+                "bytes": sent_bytes.get(stage, 0)
+            }
+
+        providers = {}
+        for provider, provider_stages in self.PROVIDER_STAGES.items():
+            providers[provider] = {
+                "wait_seconds": sum(stages[stage]["total_seconds"] for stage in provider_stages if stage in stages),
+                "bytes_sent": sum(stages[stage]["bytes"] for stage in provider_stages if stage in stages)
+            }
+
+        report = {
+            "elapsed_seconds": elapsed,
+            "images": images,
+            "images_per_second": images / elapsed if elapsed > 0 else 0.0,
+            "stages": stages,
+            "providers": providers
+        }
+        if extra:
+            report.update(extra)
+        return report
+
+    def write_json(self, path, report):
+        with open(path, "w", encoding="utf-8") as report_file:
+            json.dump(report, report_file, ensure_ascii=False, indent=2)
+
+    def print_summary(self, report):
+        print("\n===== ステージ別の計測値 =====")
+        for stage, values in report["stages"].items():
+            print(
+                f"{stage}: {values['count']} 回, 合計 {values['total_seconds']:.2f} 秒, "
+                f"p50 {values['p50_seconds']:.3f} 秒, p95 {values['p95_seconds']:.3f} 秒, p99 {values['p99_seconds']:.3f} 秒, "
+                f"{values['bytes'] / 1024 / 1024:.1f} MB"
+            )
+        for provider, values in report["providers"].items():
+            print(f"{provider} の応答待ち: 合計 {values['wait_seconds']:.2f} 秒")
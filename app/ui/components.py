@@ -110,7 +110,10 @@ class UIComponents:
         """画像詳細セクションのUIコンポーネントを作成"""
         with gr.Accordion("画像詳細", open=False):
             with gr.Row():        
-                with gr.Column():
+                with gr.Column(scale=1):
+                    # 選択した画像をギャラリーのサムネイルより大きいプレビュー用の縮小版画像で表示
+                    detail_image = gr.Image(show_label=False, type="pil", interactive=False, container=False)
+                with gr.Column(scale=2):
                     with gr.Row():
                         gr.Markdown("**ファイル名：**")
                         filename_text = gr.Textbox(show_label=False, interactive=False, container=False)
@@ -125,7 +128,7 @@ class UIComponents:
                             placeholder="説明"
                         )
                 
-        return filename_text, similarity_text, caption_text, score_label
+        return filename_text, similarity_text, caption_text, score_label, detail_image
         
     def create_query_detail_section(self):
         """クエリ詳細セクションのUIコンポーネントを作成"""
@@ -1,5 +1,4 @@
 import gradio as gr
-from PIL import Image
 import math
 
 class UIEvents:
@@ -80,7 +79,7 @@ class UIEvents:
             outputs=[pagination_row]
         )
         
-    def register_clear_button_events(self, clear_button, query_input, uploaded_image, vector_gallery, keyword_gallery, filename_text, similarity_text, caption_text, state, executed_query_text, executed_sql_text, pagination_row):
+    def register_clear_button_events(self, clear_button, query_input, uploaded_image, vector_gallery, keyword_gallery, filename_text, similarity_text, caption_text, state, executed_query_text, executed_sql_text, pagination_row, detail_image):
         """クリアボタンのイベントを登録"""
         clear_button.click(
             fn=self.clear_results,
@@ -90,6 +89,10 @@ class UIEvents:
             fn=self.hide_pagination,
             inputs=[],
             outputs=[pagination_row]
+        ).then(
+            fn=lambda: None,
+            inputs=[],
+            outputs=[detail_image]
         )
     
     def register_show_all_button_events(self, show_all_button, top_k_slider, vector_gallery, keyword_gallery, filename_text, similarity_text, caption_text, state, executed_query_text, executed_sql_text, pagination_row, page_info, prev_button, next_button):
@@ -118,7 +121,7 @@ class UIEvents:
             outputs=[vector_gallery, page_info, state, keyword_gallery, prev_button_out, next_button_out]
         )
         
-    def register_gallery_selection_events(self, vector_gallery, keyword_gallery, state, filename_text, similarity_text, caption_text):
+    def register_gallery_selection_events(self, vector_gallery, keyword_gallery, state, filename_text, similarity_text, caption_text, detail_image):
         """ギャラリー選択イベントを登録"""
         def handle_vector_selection(evt: gr.SelectData, state_data):
             # vector_galleryを選択した場合の処理
@@ -127,7 +130,7 @@ class UIEvents:
             # stateの構造を確認
             if state_data is None:
                 print("警告: state_dataがNoneです")
-                return "", "", "", gr.Gallery(selected_index=None)
+                return "", "", "", None, gr.Gallery(selected_index=None)
                 
             # state_dataから直接ベクトル検索結果を取得
             vector_results = state_data.get("vector_results", [])
@@ -136,7 +139,7 @@ class UIEvents:
             # インデックスが有効かチェック
             if len(vector_results) <= evt.index:
                 print(f"警告: 無効なインデックス - vector_results長さ={len(vector_results)}, インデックス={evt.index}")
-                return "", "", "", gr.Gallery(selected_index=None)
+                return "", "", "", None, gr.Gallery(selected_index=None)
                 
             # ベクトル検索結果を取得
             selected_result = vector_results[evt.index]
@@ -154,7 +157,7 @@ class UIEvents:
             caption = self.search_service.normalize_newlines(selected_result['caption'])
             
             # ドキュメントに基づいた方法で、選択状態のみをリセットしたギャラリーコンポーネントを返す
-            return file_name, score_text, caption, gr.Gallery(
+            return file_name, score_text, caption, self.search_service.get_detail_image(selected_result['image_id']), gr.Gallery(
                 selected_index=None,
             )
             
@@ -167,7 +170,7 @@ class UIEvents:
             # state_dataの構造を確認
             if state_data is None:
                 print("警告: state_dataがNoneです")
-                return "", "", "", gr.Gallery(selected_index=None)
+                return "", "", "", None, gr.Gallery(selected_index=None)
                 
             # state_dataから直接全文検索結果を取得
             keyword_results = state_data.get("keyword_results", [])
@@ -180,13 +183,13 @@ class UIEvents:
             # 全文検索結果が0件の場合
             if len(keyword_results) == 0:
                 # print("警告: 全文検索結果が0件です")
-                return "", "", "", gr.Gallery(selected_index=None)
+                return "", "", "", None, gr.Gallery(selected_index=None)
                 
             # evt.indexが全文検索結果の範囲内かチェック
             if evt.index >= len(keyword_results):
                 print(f"警告: インデックスが範囲外です - インデックス={evt.index}, 結果数={len(keyword_results)}")
                 # インデックスが範囲外の場合はエラーを返す
-                return "", "", "", gr.Gallery(selected_index=None)
+                return "", "", "", None, gr.Gallery(selected_index=None)
             
             try:
                 # 選択された全文検索結果を直接取得
@@ -205,22 +208,22 @@ class UIEvents:
                 caption = self.search_service.normalize_newlines(selected_result['caption'])
                 
                 # 選択を解除して返す
-                return file_name, score_text, caption, gr.Gallery(selected_index=None)
+                return file_name, score_text, caption, self.search_service.get_detail_image(selected_result['image_id']), gr.Gallery(selected_index=None)
             except Exception as e:
                 print(f"エラー発生: {str(e)}")
                 # エラーが発生した場合は空の値を返す
-                return "", "", "", gr.Gallery(selected_index=None)
+                return "", "", "", None, gr.Gallery(selected_index=None)
             
         vector_gallery.select(
             fn=handle_vector_selection,
             inputs=[state],
-            outputs=[filename_text, similarity_text, caption_text, keyword_gallery]
+            outputs=[filename_text, similarity_text, caption_text, detail_image, keyword_gallery]
         )
         
         keyword_gallery.select(
             fn=handle_keyword_selection,
             inputs=[state],
-            outputs=[filename_text, similarity_text, caption_text, vector_gallery]
+            outputs=[filename_text, similarity_text, caption_text, detail_image, vector_gallery]
         )
         
     # イベントハンドラー関数
@@ -367,15 +370,15 @@ class UIEvents:
                 "keyword_results": []
             }
             
-        # 総画像数を取得
-        total_image_count = self.search_service.database_service.get_total_image_count()
+        # 総画像数を取得（キャッシュした値を使い、毎回 COUNT(*) を実行しない）
+        total_image_count = self.search_service.get_total_image_count()
         
         # スライダーで設定された数分だけ最新の画像を取得
         current_page = 1
         page_size = top_k
         
         # 1ページ目のデータを取得
-        results, executed_sql = self.search_service.database_service.get_recent_images(top_k, (current_page - 1) * top_k)
+        results, executed_sql = self.search_service.database_service.get_recent_images_page(top_k)
         
         # 結果を保存
         all_images = results
@@ -394,12 +397,10 @@ class UIEvents:
             "vector_results": results,
             "keyword_results": []
         })
+        self.update_page_cursors(state_data, results)
         
         # 結果を整形
-        output_images = []
-        for result in results:
-            if isinstance(result['image'], Image.Image):
-                output_images.append(result['image'])
+        output_images = self.search_service.get_gallery_images(results)
             
         if results:
             first_result = results[0]
@@ -462,8 +463,14 @@ class UIEvents:
         if current_page > 1:
             current_page -= 1
             
-            # 前のページのデータを取得
-            results, _ = self.search_service.database_service.get_recent_images(top_k, (current_page - 1) * top_k)
+            # 現在のページの先頭行をカーソルにして前のページのデータを取得
+            cursor_key = state_data.get("page_first_key")
+            if cursor_key is None:
+                # カーソルを持たない状態（更新前に作成された状態など）では、表示とページ番号がずれないよう1ページ目に戻る
+                current_page = 1
+                results, _ = self.search_service.database_service.get_recent_images_page(top_k)
+            else:
+                results, _ = self.search_service.database_service.get_recent_images_page(top_k, cursor_key, "prev")
             all_images = results
             
             # 状態を更新
@@ -471,12 +478,10 @@ class UIEvents:
                 "current_page": current_page,
                 "all_images": all_images
             })
+            self.update_page_cursors(state_data, results)
         
         # 結果を整形
-        output_images = []
-        for result in all_images:
-            if isinstance(result['image'], Image.Image):
-                output_images.append(result['image'])
+        output_images = self.search_service.get_gallery_images(all_images)
         
         # ページング情報を更新
         page_info_text = f"{current_page}/{total_pages} ページ（総合計 {total_image_count} 枚）"
@@ -520,8 +525,14 @@ class UIEvents:
         if current_page < total_pages:
             current_page += 1
             
-            # 次のページのデータを取得
-            results, _ = self.search_service.database_service.get_recent_images(top_k, (current_page - 1) * top_k)
+            # 現在のページの末尾行をカーソルにして次のページのデータを取得
+            cursor_key = state_data.get("page_last_key")
+            if cursor_key is None:
+                # カーソルを持たない状態（更新前に作成された状態など）では、表示とページ番号がずれないよう1ページ目に戻る
+                current_page = 1
+                results, _ = self.search_service.database_service.get_recent_images_page(top_k)
+            else:
+                results, _ = self.search_service.database_service.get_recent_images_page(top_k, cursor_key, "next")
             
             # 結果がない場合は前のページに戻る
             if not results:
@@ -534,10 +545,7 @@ class UIEvents:
                 })
                 
                 # 選択状態をリセットしたギャラリーを返す
-                output_images = []
-                for result in all_images:
-                    if isinstance(result['image'], Image.Image):
-                        output_images.append(result['image'])
+                output_images = self.search_service.get_gallery_images(all_images)
                 
                 # ページングボタンの状態を更新
                 prev_button, next_button = self.update_pagination_buttons(state_data)
@@ -552,12 +560,10 @@ class UIEvents:
                 "current_page": current_page,
                 "all_images": all_images
             })
+            self.update_page_cursors(state_data, results)
         
         # 結果を整形
-        output_images = []
-        for result in all_images:
-            if isinstance(result['image'], Image.Image):
-                output_images.append(result['image'])
+        output_images = self.search_service.get_gallery_images(all_images)
         
         # ページング情報を更新
         page_info_text = f"{current_page}/{total_pages} ページ（総合計 {total_image_count} 枚）"
@@ -575,6 +581,14 @@ class UIEvents:
         # 選択状態をリセットしたギャラリーを返す
         return gr.Gallery(label="全件表示", value=output_images, selected_index=None), page_info_text, state_data, gr.Gallery(visible=False), prev_button, next_button
     
+    def update_page_cursors(self, state_data, results):
+        """表示中のページの先頭行・末尾行の (upload_date, image_id) をページングのカーソルとして保存する関数"""
+        if results:
+            state_data.update({
+                "page_first_key": (results[0]['upload_date'], results[0]['image_id']),
+                "page_last_key": (results[-1]['upload_date'], results[-1]['image_id'])
+            })
+            
     def hide_pagination(self):
         """ページング用UIを非表示にする関数"""
         return gr.update(visible=False)
@@ -616,12 +630,9 @@ class UIEvents:
         )
         
         # 結果を整形
-        output_images = []
-        for result in results:
-            if isinstance(result['image'], Image.Image):
-                output_images.append(result['image'])
-            else:
-                print(f"警告: 画像が期待された形式ではありません: {type(result['image'])}")
+        output_images = self.search_service.get_gallery_images(results)
+        if len(output_images) < len(results):
+            print(f"警告: {len(results) - len(output_images)} 件の画像を取得できませんでした")
         
         if results:
             first_result = results[0]
@@ -0,0 +1,53 @@
+import array
+import numpy as np
+
+# 0～255の各値の立っているビット数（np.bitwise_countがないNumPyで使う）
+_POPCOUNT_TABLE = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+def quantize_int8(vector):
+    """埋め込みベクトルを最大絶対値で -127～127 に線形量子化する（COSINE距離で比較する）"""
+    values = np.asarray(vector, dtype=np.float32)
+    scale = float(np.max(np.abs(values))) if values.size else 0.0
+    if scale == 0.0:
+        return array.array('b', bytes(values.size))
+    return array.array('b', np.round(values / scale * 127).astype(np.int8).tobytes())
+
+def quantize_binary(vector):
+    """埋め込みベクトルの各次元の符号を1ビットにして8次元ずつ1バイトに詰める（Cohereのubinaryと同じ形式）"""
+    values = np.asarray(vector, dtype=np.float32)
+    return array.array('B', np.packbits(values > 0).tobytes())
+
+def int8_matrix(matrix):
+    """行ごとに quantize_int8 と同じ量子化を行った int8 の行列"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    scales = np.max(np.abs(matrix), axis=1, keepdims=True) if matrix.size else np.ones((len(matrix), 1), dtype=np.float32)
+    scales[scales == 0] = 1.0
+    return np.round(matrix / scales * 127).astype(np.int8)
+
+def binary_matrix(matrix):
+    """行ごとに quantize_binary と同じ量子化を行った uint8 の行列（1行 = 次元数/8 バイト）"""
+    return np.packbits(np.asarray(matrix) > 0, axis=1)
+
+def hamming_distances(packed_matrix, packed_query):
+    """ビットを詰めた行列の各行とクエリーのハミング距離"""
+    xor = np.bitwise_xor(packed_matrix, np.asarray(packed_query, dtype=np.uint8))
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(xor).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT_TABLE[xor].sum(axis=1, dtype=np.int32)
+
+def int8_row_norms(int8_rows):
+    """int8の行列の各行のノルム（int8_cosine_scores に渡すために事前に計算しておく）"""
+    return np.sqrt(np.einsum("ij,ij->i", int8_rows, int8_rows, dtype=np.float32))
+
+def int8_cosine_scores(int8_rows, int8_query, row_norms=None, chunk_rows=4096):
+    """int8の行列の各行とクエリーのコサイン類似度（量子化時のスケールに依存しない）"""
+    query = np.asarray(int8_query, dtype=np.float32)
+    if row_norms is None:
+        row_norms = int8_row_norms(int8_rows)
+    scores = np.empty(len(int8_rows), dtype=np.float32)
+    # 一時的なfloat32の行列が大きくならないように一定行数ずつ計算する
+    for start in range(0, len(int8_rows), chunk_rows):
+        scores[start:start + chunk_rows] = int8_rows[start:start + chunk_rows].astype(np.float32) @ query
+    norms = row_norms * (np.linalg.norm(query) or 1.0)
+    norms[norms == 0] = 1.0
+    return scores / norms
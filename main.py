@@ -4,11 +4,23 @@ import threading
 from app.config import Config
 from app.embedding_service import EmbeddingService
 from app.database_service import DatabaseService  
+from app.local_vector_store import LocalVectorStore
+from app.image_cache import ImageCache
+from app.image_count_cache import ImageCountCache
+from app.model_output_cache import ModelOutputCache
 from app.search_service import SearchService
 from app.ui.components import UIComponents
 from app.ui.events import UIEvents
 from app.search_query_generator import SearchQueryGenerator
 
+def report_cache_stats(interval, image_cache, image_count_cache, embedding_service):
+    """定期的に各キャッシュの統計情報を出力するバックグラウンドスレッド"""
+    while True:
+        time.sleep(interval)
+        print(embedding_service.cache_summary())
+        print(image_cache.summary())
+        print(image_count_cache.summary())
+
 def check_db_connection(config, db_pool, interval=60):
     """定期的にデータベース接続の健全性をチェックするバックグラウンドスレッド"""
     while True:
@@ -33,22 +45,67 @@ def check_db_connection(config, db_pool, interval=60):
 def main():
     # 設定と基本サービスを初期化
     config = Config()
-    db_pool = config.get_db_pool()  # コネクションプールを取得
+    # コネクションプールを取得（データベースを使わない構成では作成しない）
+    db_pool = config.get_db_pool() if config.requires_database else None
     cohere_client = config.get_cohere_client()
     search_query_generator = SearchQueryGenerator()
+    image_cache = ImageCache(max_bytes=config.image_cache_max_mb * 1024 * 1024, ttl=config.image_cache_ttl)
     
-    # データベース接続監視スレッドを開始
-    db_monitor_thread = threading.Thread(
-        target=check_db_connection,
-        args=(config, db_pool, 60),  # 60秒ごとにチェック
-        daemon=True  # メインスレッド終了時に自動的に終了
+    # 各サービスを初期化
+    query_embedding_store = ModelOutputCache(config.query_embedding_cache_path) if config.query_embedding_cache_path else None
+    embedding_service = EmbeddingService(
+        cohere_client,
+        cache_size=config.query_embedding_cache_size,
+        persistent_cache=query_embedding_store,
+        batch_window=config.query_embedding_batch_window_ms / 1000,
+        dimension=config.embedding_dimension
+    )
+    database_service = None
+    if db_pool is not None:
+        database_service = DatabaseService(
+            db_pool, image_cache,  # プールと画像キャッシュを渡す
+            vector_search_mode=config.vector_search_mode, overfetch=config.vector_search_overfetch
+        )
+    if config.search_backend == "local":
+        # 起動時に埋め込みベクトルを読み込み、検索はプロセス内で行う（画像は指定ディレクトリまたはデータベースから取得）
+        local_store_options = dict(
+            image_source=database_service, image_dir=config.local_image_dir, image_cache=image_cache,
+            ann_index=config.local_ann_index, hnsw_params=config.hnsw_params, ann_index_path=config.local_ann_index_path,
+            vector_search_mode=config.vector_search_mode, overfetch=config.vector_search_overfetch
+        )
+        if config.local_snapshot_dir:
+            # 102_export_embedding_snapshot.py で書き出したスナップショットをメモリマップして使う
+            database_service = LocalVectorStore.load_from_snapshot(config.local_snapshot_dir, **local_store_options)
+        else:
+            database_service = LocalVectorStore.load_from_database(db_pool, **local_store_options)
+    image_count_cache = ImageCountCache(
+        database_service.get_total_image_count,
+        max_staleness=config.image_count_max_staleness
+    )
+    search_service = SearchService(
+        embedding_service, database_service, search_query_generator,
+        gallery_tile_size=config.gallery_tile_size,
+        image_count_cache=image_count_cache,
+        hybrid_branch_timeout=config.hybrid_branch_timeout,
+        hybrid_search_mode=config.hybrid_search_mode
     )
-    db_monitor_thread.start()
     
-    # 各サービスを初期化
-    embedding_service = EmbeddingService(cohere_client)
-    database_service = DatabaseService(db_pool)  # プールを渡す
-    search_service = SearchService(embedding_service, database_service, search_query_generator)
+    # データベース接続監視スレッドを開始（データベースを使わない構成では不要）
+    if db_pool is not None:
+        db_monitor_thread = threading.Thread(
+            target=check_db_connection,
+            args=(config, db_pool, 60),  # 60秒ごとにチェック
+            daemon=True  # メインスレッド終了時に自動的に終了
+        )
+        db_monitor_thread.start()
+    
+    # キャッシュの統計情報を出力するスレッドを開始（CACHE_STATS_INTERVAL を指定した場合のみ）
+    if config.cache_stats_interval > 0:
+        threading.Thread(
+            target=report_cache_stats,
+            args=(config.cache_stats_interval, image_cache, image_count_cache, embedding_service),
+            daemon=True
+        ).start()
     
     # UIコンポーネントとイベントを初期化
     ui_components = UIComponents()
@@ -80,7 +137,7 @@ def main():
         pagination_row, prev_button, page_info, next_button = ui_components.create_pagination_section()
         
         # 画像詳細セクションのUIコンポーネントを作成
-        filename_text, similarity_text, caption_text, score_label = ui_components.create_detail_section()
+        filename_text, similarity_text, caption_text, score_label, detail_image = ui_components.create_detail_section()
         
         # クエリ詳細セクションのUIコンポーネントを作成
         executed_query_text, execute_query_button, executed_sql_text = ui_components.create_query_detail_section()
@@ -114,7 +171,7 @@ def main():
         ui_events.register_clear_button_events(
             clear_button, query_input, uploaded_image, vector_gallery, 
             keyword_gallery, filename_text, similarity_text, caption_text, 
-            state, executed_query_text, executed_sql_text, pagination_row
+            state, executed_query_text, executed_sql_text, pagination_row, detail_image
         )
         
         ui_events.register_show_all_button_events(
@@ -129,7 +186,7 @@ def main():
         
         ui_events.register_gallery_selection_events(
             vector_gallery, keyword_gallery, state, 
-            filename_text, similarity_text, caption_text
+            filename_text, similarity_text, caption_text, detail_image
         )
         
         # アプリケーションの初期読み込み時のイベントを登録
@@ -0,0 +1,5 @@
+-- 既存のIMAGESテーブルに画像内容のSHA-256ハッシュ列を追加
+-- 既存行のハッシュは適用後に 105_backfill_content_hash.py で生成する（生成するまで既存画像の重複は検出されない）
+ALTER TABLE IMAGES ADD (content_hash VARCHAR2(64));
+
+CREATE INDEX idx_images_content_hash ON IMAGES(content_hash);
@@ -0,0 +1,11 @@
+-- 既存のIMAGESテーブルに埋め込みベクトルのint8・バイナリ量子化版の列を追加
+-- int8はベクトルごとの最大絶対値でスケールしているため COSINE、バイナリは HAMMING で比較する
+-- 既存行の量子化版は 103_backfill_quantized_embeddings.py で生成する
+-- バイナリ版の次元数は EMBEDDING_DIMENSION と合わせる（1536以外の場合は書き換えてから適用する）
+DEFINE embedding_dimension = 1536
+ALTER TABLE IMAGES ADD (
+    caption_embedding_int8 VECTOR(*, INT8),
+    caption_embedding_bin VECTOR(&embedding_dimension, BINARY),
+    image_embedding_int8 VECTOR(*, INT8),
+    image_embedding_bin VECTOR(&embedding_dimension, BINARY)
+);
@@ -0,0 +1,6 @@
+-- 既存のIMAGESテーブルにギャラリー用の縮小版画像の列を追加
+-- 既存行の縮小版画像は 101_backfill_renditions.py で生成する
+ALTER TABLE IMAGES ADD (
+    thumbnail_data BLOB,
+    preview_data BLOB
+);
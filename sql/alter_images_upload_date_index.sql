@@ -0,0 +1,4 @@
+-- キーセット方式のページング（upload_date, image_id）に対応するようインデックスを作り直す
+DROP INDEX idx_images_upload_date;
+
+CREATE INDEX idx_images_upload_date ON IMAGES(upload_date, image_id);
@@ -1,18 +1,31 @@
+-- 埋め込みベクトルの列の次元数（環境変数 EMBEDDING_DIMENSION と同じ値: 256/512/1024/1536 に書き換えてから実行する）
+-- SQL*Plus・SQLcl・SQL Developerの置換変数として以下の列定義で使用する
+-- 登録後に次元数を変える場合は 104_migrate_embedding_dimension.py で列とVector indexを作り直す
+DEFINE embedding_dimension = 1536
+
 -- IMAGES テーブル
 CREATE TABLE IMAGES (
     image_id NUMBER GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
     file_name VARCHAR2(255),
     caption VARCHAR2(4000),
-    caption_embedding VECTOR,
+    caption_embedding VECTOR(&embedding_dimension, FLOAT32),
     image_data BLOB,
-    image_embedding VECTOR,
+    image_embedding VECTOR(&embedding_dimension, FLOAT32),
     upload_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    content_hash VARCHAR2(64),
+    thumbnail_data BLOB,
+    preview_data BLOB,
+    caption_embedding_int8 VECTOR(*, INT8),
+    caption_embedding_bin VECTOR(&embedding_dimension, BINARY),
+    image_embedding_int8 VECTOR(*, INT8),
+    image_embedding_bin VECTOR(&embedding_dimension, BINARY),
     CONSTRAINT image_data_not_null CHECK (image_data IS NOT NULL)
 );
 
 -- インデックスの作成
 CREATE INDEX idx_images_file_name ON IMAGES(file_name);
-CREATE INDEX idx_images_upload_date ON IMAGES(upload_date);
+CREATE INDEX idx_images_upload_date ON IMAGES(upload_date, image_id);
+CREATE INDEX idx_images_content_hash ON IMAGES(content_hash);
 
 -- Vector indexの作成
 CREATE VECTOR INDEX idx_image_embedding
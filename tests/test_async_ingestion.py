@@ -0,0 +1,66 @@
+import asyncio
+from types import SimpleNamespace
+from app.async_ingestion import AsyncEmbeddingBatcher, ProviderGate
+from app.batch_embedder import BatchEmbedder
+
+class ThrottleError(Exception):
+    status = 429
+
+class BadInputError(Exception):
+    status = 400
+
+class ScriptedCohereClient:
+    """テキストの埋め込みとして文字数を返し、指定した回数だけレート制限・"bad" を含むバッチは入力エラーにするクライアント"""
+
+    def __init__(self, throttles=0):
+        self.throttles = throttles
+        self.batch_sizes = []
+
+    def embed(self, texts=None, images=None, model=None, input_type=None, embedding_types=None):
+        self.batch_sizes.append(len(texts))
+        if self.throttles > 0:
+            self.throttles -= 1
+            raise ThrottleError()
+        if "bad" in texts:
+            raise BadInputError()
+        return SimpleNamespace(embeddings=[[float(len(text))] for text in texts])
+
+def run_batched(client, texts, max_batch=96):
+    """asyncモードと同じく AsyncEmbeddingBatcher・ProviderGate・BatchEmbedder を組み合わせて埋め込む"""
+    batch_embedder = BatchEmbedder(client, retry_throttles=False)
+
+    async def main():
+        gate = ProviderGate("Cohere", 1000, 4, 16, backoff=0.01)
+        batcher = AsyncEmbeddingBatcher(
+            lambda batch: gate.call(lambda: asyncio.to_thread(batch_embedder.embed_texts, batch, "search_document")),
+            max_batch, window=0.01
+        )
+        results = await asyncio.gather(*[batcher.embed(text) for text in texts], return_exceptions=True)
+        return results, gate, batcher
+
+    return asyncio.run(main())
+
+def test_concurrent_requests_are_sent_in_provider_sized_batches():
+    """同時に届いた要求は1回あたりの上限ごとにまとめて埋め込まれる"""
+    client = ScriptedCohereClient()
+    texts = [f"text-{i}" for i in range(200)]
+    results, _, batcher = run_batched(client, texts)
+    assert results == [[float(len(text))] for text in texts]
+    assert client.batch_sizes == [96, 96, 8]
+    assert batcher.batches == 3
+
+def test_throttle_is_retried_by_the_gate():
+    """レート制限は BatchEmbedder では再試行せず、ProviderGate が同時実行数を下げて再試行する"""
+    client = ScriptedCohereClient(throttles=2)
+    results, gate, _ = run_batched(client, ["a", "bb", "ccc"])
+    assert results == [[1.0], [2.0], [3.0]]
+    assert gate.stats.throttled == 2
+    assert client.batch_sizes == [3, 3, 3]
+
+def test_bad_input_fails_only_its_own_request():
+    """入力が原因のエラーは二分割で切り分け、その入力を待つ要求だけが失敗する"""
+    client = ScriptedCohereClient()
+    results, _, _ = run_batched(client, ["a", "bad", "ccc", "dddd"])
+    assert results[0] == [1.0]
+    assert isinstance(results[1], BadInputError)
+    assert results[2:] == [[3.0], [4.0]]
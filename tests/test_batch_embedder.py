@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+import pytest
+from app.batch_embedder import BatchEmbedder
+
+class StatusError(Exception):
+    def __init__(self, status):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+class ScriptedCohereClient:
+    """テキストの埋め込みとして文字数を返し、"bad" を含むバッチは400、指定回数だけ503・429を返すクライアント"""
+
+    def __init__(self, failures=()):
+        self.failures = list(failures)
+        self.batches = []
+
+    def embed(self, texts=None, images=None, model=None, input_type=None, embedding_types=None):
+        self.batches.append(list(texts))
+        if self.failures:
+            raise StatusError(self.failures.pop(0))
+        if "bad" in texts:
+            raise StatusError(400)
+        return SimpleNamespace(embeddings=[[float(len(text))] for text in texts])
+
+def test_bad_input_is_isolated_by_bisecting():
+    """入力が原因の失敗は二分割を繰り返し、原因の入力だけを失敗にする"""
+    client = ScriptedCohereClient()
+    texts = ["a", "bb", "ccc", "bad", "eeeee", "ffffff", "g", "hh"]
+    embeddings, errors = BatchEmbedder(client, max_texts_per_call=8).embed_texts(texts)
+
+    assert list(errors) == [3]
+    assert errors[3].status == 400
+    assert [embedding for i, embedding in enumerate(embeddings) if i != 3] == [[float(len(text))] for i, text in enumerate(texts) if i != 3]
+    # 8件 → 4件ずつ → 2件ずつ → 1件ずつと、失敗した側だけを分割する
+    assert client.batches == [texts, texts[:4], texts[:2], texts[2:4], texts[2:3], texts[3:4], texts[4:]]
+
+@pytest.mark.parametrize("status", [429, 503])
+def test_transient_error_retries_the_same_batch_without_splitting(status):
+    """レート制限やサーバーエラーは分割せずに同じバッチを再試行する"""
+    client = ScriptedCohereClient(failures=[status, status])
+    texts = ["a", "bb", "ccc"]
+    embeddings, errors = BatchEmbedder(client, backoff=0.0).embed_texts(texts)
+
+    assert errors == {}
+    assert embeddings == [[1.0], [2.0], [3.0]]
+    assert client.batches == [texts, texts, texts]
+
+def test_transient_error_fails_the_whole_batch_after_retries():
+    """再試行しても解消しない一時的なエラーでは分割せず、バッチ全体を失敗にする"""
+    client = ScriptedCohereClient(failures=[503] * 3)
+    texts = ["a", "bb", "ccc", "dddd"]
+    embeddings, errors = BatchEmbedder(client, max_retries=2, backoff=0.0).embed_texts(texts)
+
+    assert sorted(errors) == [0, 1, 2, 3]
+    assert embeddings == [None] * 4
+    assert len(client.batches) == 3
+
+def test_inputs_are_split_by_the_per_call_limit():
+    """1回あたりの上限ごとに分割して呼び出し、結果を入力順に返す"""
+    client = ScriptedCohereClient()
+    texts = [str(i) * (i % 7 + 1) for i in range(200)]
+    embedder = BatchEmbedder(client)
+    embeddings, errors = embedder.embed_texts(texts)
+
+    assert errors == {}
+    assert embeddings == [[float(len(text))] for text in texts]
+    assert [len(batch) for batch in client.batches] == [96, 96, 8]
+    assert embedder.api_calls == 3
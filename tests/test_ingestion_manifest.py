@@ -0,0 +1,59 @@
+import hashlib
+import importlib
+from app.ingestion_manifest import IngestionManifest
+
+register_images = importlib.import_module("100_register_images")
+
+def run_once(manifest, content_hash, generated_caption):
+    """登録スクリプトと同じ手順で、マニフェストを使ってキャプションとその埋め込みを取得する"""
+    caption = register_images.lookup_caption(manifest, None, content_hash)
+    if caption is None:
+        caption = generated_caption
+        register_images.store_caption(manifest, None, content_hash, caption)
+    record = {"content_hash": content_hash, "caption": caption}
+    vector = register_images.lookup_embedding(manifest, None, record, "caption")
+    if vector is None:
+        # キャプション本文から決まるベクトルを埋め込みの代わりに使う
+        vector = [float(b) for b in hashlib.sha256(caption.encode("utf-8")).digest()[:4]]
+        register_images.store_embedding(manifest, None, record, "caption", vector)
+    return caption, list(vector)
+
+def test_prompt_change_regenerates_caption_and_its_embedding(tmp_path, monkeypatch):
+    """プロンプトを変えて再実行すると、キャプションもその埋め込みも古い結果を使わない"""
+    monkeypatch.setattr(register_images, "MLLM_MODEL_ID", "model-a", raising=False)
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite"))
+    try:
+        first_caption, first_vector = run_once(manifest, "hash-1", "古いキャプション")
+
+        # 同じプロンプトでの再実行は記録済みの結果を使う
+        assert run_once(manifest, "hash-1", "使われないキャプション") == (first_caption, first_vector)
+
+        monkeypatch.setattr(register_images, "CAPTION_PROMPT", register_images.CAPTION_PROMPT + "（変更）")
+        second_caption, second_vector = run_once(manifest, "hash-1", "新しいキャプション")
+        assert second_caption == "新しいキャプション"
+        assert second_vector != first_vector
+        assert second_vector == [float(b) for b in hashlib.sha256("新しいキャプション".encode("utf-8")).digest()[:4]]
+    finally:
+        manifest.close()
+
+def test_model_change_regenerates_caption(tmp_path, monkeypatch):
+    """キャプション生成モデルを変えると記録済みのキャプションを使わない"""
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite"))
+    try:
+        monkeypatch.setattr(register_images, "MLLM_MODEL_ID", "model-a", raising=False)
+        run_once(manifest, "hash-1", "モデルAのキャプション")
+        monkeypatch.setattr(register_images, "MLLM_MODEL_ID", "model-b", raising=False)
+        assert run_once(manifest, "hash-1", "モデルBのキャプション")[0] == "モデルBのキャプション"
+    finally:
+        manifest.close()
+
+def test_image_embedding_is_keyed_by_content_hash(tmp_path):
+    """画像の埋め込みはキャプションが変わっても同じ画像なら再利用する"""
+    manifest = IngestionManifest(str(tmp_path / "manifest.sqlite"))
+    try:
+        register_images.store_embedding(manifest, None, {"content_hash": "hash-1", "caption": "A"}, "image", [1.0, 2.0])
+        vector = register_images.lookup_embedding(manifest, None, {"content_hash": "hash-1", "caption": "B"}, "image")
+        assert list(vector) == [1.0, 2.0]
+        assert register_images.lookup_embedding(manifest, None, {"content_hash": "hash-2", "caption": "A"}, "image") is None
+    finally:
+        manifest.close()
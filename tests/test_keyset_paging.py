@@ -0,0 +1,88 @@
+import random
+import sqlite3
+from datetime import datetime, timedelta
+import pytest
+from app.database_service import DatabaseService
+from app.local_vector_store import LocalVectorStore
+
+PAGE_SIZE = 4
+
+def make_rows(count=23):
+    """アップロード日時が同じ行を多く含み、画像IDの順とアップロード順が一致しない行"""
+    base = datetime(2025, 1, 1)
+    image_ids = list(range(1, count + 1))
+    random.Random(0).shuffle(image_ids)
+    return [(image_id, f"{image_id}.jpg", f"caption {image_id}", base + timedelta(minutes=i // 5)) for i, image_id in enumerate(image_ids)]
+
+class SqliteCursor:
+    """Oracleの FETCH FIRST を LIMIT に置き換えて、同じSQLをSQLiteで実行するカーソル"""
+
+    def __init__(self, conn):
+        self._cursor = conn.cursor()
+
+    def execute(self, sql, params):
+        sql = sql.replace("FETCH FIRST", "LIMIT").replace("ROWS ONLY", "")
+        self._cursor.execute(sql, {str(i + 1): value for i, value in enumerate(params)})
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def close(self):
+        self._cursor.close()
+
+class SqlitePool:
+    def __init__(self, rows):
+        self._conn = sqlite3.connect(":memory:")
+        self._conn.execute("CREATE TABLE IMAGES (image_id INTEGER, file_name TEXT, caption TEXT, upload_date TEXT)")
+        self._conn.executemany("INSERT INTO IMAGES VALUES (?, ?, ?, ?)", [row[:3] + (row[3].isoformat(),) for row in rows])
+
+    def acquire(self):
+        return self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    def cursor(self):
+        return SqliteCursor(self._conn)
+
+def database_backend(rows):
+    return DatabaseService(SqlitePool(rows))
+
+def local_backend(rows):
+    store = LocalVectorStore()
+    store.add_rows([(image_id, file_name, caption, [1.0, 0.0], [0.0, 1.0], upload_date) for image_id, file_name, caption, upload_date in rows])
+    return store
+
+def page_ids(results):
+    return [result["image_id"] for result in results]
+
+def cursor_key(result):
+    return (result["upload_date"], result["image_id"])
+
+@pytest.mark.parametrize("make_backend", [database_backend, local_backend], ids=["database", "local"])
+def test_pages_cover_every_row_once_in_both_directions(make_backend):
+    """同じアップロード日時の行がページの境目にあっても、次へ・前へのどちらでも行の欠落や重複がない"""
+    rows = make_rows()
+    backend = make_backend(rows)
+    expected = [row[0] for row in sorted(rows, key=lambda row: (row[3], row[0]), reverse=True)]
+
+    pages = [backend.get_recent_images_page(PAGE_SIZE)[0]]
+    # カーソルが進まない不具合でも止まるよう、行数より多くはページをめくらない
+    for _ in range(len(rows)):
+        results, _ = backend.get_recent_images_page(PAGE_SIZE, cursor_key(pages[-1][-1]), "next")
+        if not results:
+            break
+        pages.append(results)
+    assert [image_id for page in pages for image_id in page_ids(page)] == expected
+    assert [len(page) for page in pages] == [4, 4, 4, 4, 4, 3]
+
+    # 最終ページから前へ戻ると、同じページが新しい順で得られる
+    for previous, current in zip(reversed(pages[:-1]), reversed(pages[1:])):
+        results, _ = backend.get_recent_images_page(PAGE_SIZE, cursor_key(current[0]), "prev")
+        assert page_ids(results) == page_ids(previous)
+
+    # 先頭ページより前には何もない
+    assert backend.get_recent_images_page(PAGE_SIZE, cursor_key(pages[0][0]), "prev")[0] == []
@@ -0,0 +1,49 @@
+from app.model_output_cache import ModelOutputCache
+
+def last_access(cache, content_hash):
+    key = cache.make_key("caption", content_hash, "model", "prompt")
+    return cache._conn.execute("SELECT last_access FROM entries WHERE cache_key = ?", (key,)).fetchone()[0]
+
+def test_hits_do_not_write_until_a_batch_is_collected(tmp_path):
+    """ヒットのたびには最終アクセス日時を書き込まず、touch_batch 件ごとにまとめて反映する"""
+    cache = ModelOutputCache(str(tmp_path / "cache.sqlite"), touch_batch=3)
+    try:
+        for name in ("a", "b", "c"):
+            cache.put_caption(name, "model", "prompt", f"caption {name}")
+        stored = {name: last_access(cache, name) for name in ("a", "b", "c")}
+
+        changes = cache._conn.total_changes
+        assert cache.get_caption("a", "model", "prompt") == "caption a"
+        assert cache.get_caption("b", "model", "prompt") == "caption b"
+        assert cache._conn.total_changes == changes
+        assert last_access(cache, "a") == stored["a"]
+
+        # 3件目のヒットで溜めた分をまとめて反映する
+        assert cache.get_caption("c", "model", "prompt") == "caption c"
+        assert all(last_access(cache, name) > stored[name] for name in ("a", "b", "c"))
+    finally:
+        cache.close()
+
+def test_pending_hits_are_applied_before_eviction_and_on_close(tmp_path):
+    """溜めておいたヒットは削除対象の選択前と close 時に反映される"""
+    path = str(tmp_path / "cache.sqlite")
+    # 3件目を書き込むと上限を超え、1件を削除すると上限の90%以下に収まる
+    cache = ModelOutputCache(path, max_bytes=250, touch_batch=100)
+    try:
+        cache.put_caption("old", "model", "prompt", "x" * 100)
+        cache.put_caption("recent", "model", "prompt", "x" * 100)
+        # 最初に書き込んだ行をヒットさせてから上限を超えると、ヒットしていない行が削除される
+        assert cache.get_caption("old", "model", "prompt") is not None
+        cache.put_caption("new", "model", "prompt", "x" * 100)
+        assert cache.get_caption("old", "model", "prompt") is not None
+        assert cache.get_caption("recent", "model", "prompt") is None
+        touched = cache._touched.copy()
+    finally:
+        cache.close()
+
+    reopened = ModelOutputCache(path)
+    try:
+        key = reopened.make_key("caption", "old", "model", "prompt")
+        assert last_access(reopened, "old") == touched[key]
+    finally:
+        reopened.close()
@@ -0,0 +1,29 @@
+import os
+import subprocess
+import sys
+from PIL import Image
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+def test_fake_run_leaves_nothing_for_real_run(tmp_path):
+    """フェイクモードの実行結果を、実際の実行が読むキャッシュ・マニフェストに残さない"""
+    image_dir = tmp_path / "images"
+    image_dir.mkdir()
+    for i in range(3):
+        Image.new("RGB", (32, 32), (i * 80, 0, 0)).save(image_dir / f"{i}.jpg")
+    cache_path = tmp_path / "cache" / "model_outputs.sqlite"
+
+    result = subprocess.run(
+        [
+            sys.executable, os.path.join(REPO_DIR, "100_register_images.py"), "--fake",
+            "--image-dir", str(image_dir), "--cache-path", str(cache_path),
+            "--report", str(tmp_path / "report.json")
+        ],
+        cwd=tmp_path, capture_output=True, text=True, timeout=300
+    )
+
+    assert result.returncode == 0, result.stdout + result.stderr
+    # 永続キャッシュは作成されず、実際の実行が使う既定のマニフェストも作成されない
+    assert not cache_path.exists()
+    assert not (tmp_path / "ingestion_manifest.sqlite").exists()
+    assert (tmp_path / "ingestion_manifest_fake.sqlite").exists()
@@ -0,0 +1,82 @@
+import time
+import argparse
+import numpy as np
+from app.embedding_dimension import SUPPORTED_EMBEDDING_DIMENSIONS, truncate_matrix
+from app.embedding_snapshot import load_snapshot
+from app.hnsw_index import HNSWIndex
+from app.vector_quantization import binary_matrix
+from util_benchmark_hnsw import make_clustered_vectors, exact_search, percentile
+
+def make_matryoshka_vectors(n, dimension, noise=2.0, seed=0):
+    """先頭の次元ほど情報を多く持つ合成ベクトル（Matryoshka表現で学習した埋め込みの代わり）"""
+    vectors = make_clustered_vectors(n, dimension, noise=noise, seed=seed)
+    # 後ろの次元ほどばらつきを小さくし、切り詰めても近傍関係が大きく崩れないようにする
+    weights = (1.0 / np.sqrt(1.0 + np.arange(dimension) / 64.0)).astype(np.float32)
+    vectors = vectors * weights
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def benchmark(vectors, queries, k, dimensions, hnsw_params=None):
+    print(f"ベクトル {len(vectors)} 件（{vectors.shape[1]} 次元）, クエリ {len(queries)} 件, k={k}")
+
+    # 正解は元の次元数での全件の内積による上位k件
+    truth = [set(exact_search(vectors, query, k).tolist()) for query in queries]
+
+    header = f"{'次元数':<8}{'float32(MB)':>12}{'binary(MB)':>12}{'recall@' + str(k):>10}{'p50(ms)':>10}{'p95(ms)':>10}"
+    if hnsw_params is not None:
+        header += f"{'HNSW構築(秒)':>14}{'HNSW recall':>13}{'HNSW p50(ms)':>14}"
+    print("\n" + header)
+    for dimension in dimensions:
+        matrix = truncate_matrix(vectors, dimension)
+        reduced_queries = truncate_matrix(queries, dimension)
+        latencies = []
+        hits = 0
+        for query, expected in zip(reduced_queries, truth):
+            start = time.perf_counter()
+            result = exact_search(matrix, query, k)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & set(result.tolist()))
+        line = (
+            f"{dimension:<8}{matrix.nbytes / 1024 / 1024:>12.1f}{binary_matrix(matrix).nbytes / 1024 / 1024:>12.1f}"
+            f"{hits / (len(queries) * k):>10.3f}{percentile(latencies, 50):>10.2f}{percentile(latencies, 95):>10.2f}"
+        )
+
+        if hnsw_params is not None:
+            start = time.perf_counter()
+            index = HNSWIndex(dimension, **hnsw_params)
+            index.add_items(matrix)
+            build_seconds = time.perf_counter() - start
+            hnsw_latencies = []
+            hnsw_hits = 0
+            for query, expected in zip(reduced_queries, truth):
+                start = time.perf_counter()
+                labels, _ = index.search(query, k)
+                hnsw_latencies.append(time.perf_counter() - start)
+                hnsw_hits += len(expected & set(labels.tolist()))
+            line += f"{build_seconds:>14.1f}{hnsw_hits / (len(queries) * k):>13.3f}{percentile(hnsw_latencies, 50):>14.2f}"
+        print(line)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="埋め込みベクトルを切り詰めた次元数ごとのサイズ・検索レイテンシー・再現率（元の次元数の結果との一致率）を比較します。")
+    parser.add_argument("--n", type=int, default=50000, help="検索対象のベクトル数")
+    parser.add_argument("--dim", type=int, default=1536, help="合成ベクトルの次元数")
+    parser.add_argument("--queries", type=int, default=100, help="クエリ数")
+    parser.add_argument("--k", type=int, default=10, help="取得する近傍の件数")
+    parser.add_argument("--dimensions", default=",".join(str(value) for value in SUPPORTED_EMBEDDING_DIMENSIONS), help="比較する次元数（カンマ区切り）")
+    parser.add_argument("--hnsw", action="store_true", help="次元数ごとにHNSWインデックスも構築して比較する（時間がかかるため --n を小さくして使う）")
+    parser.add_argument("--M", type=int, default=16, help="HNSWの各ノードの最大リンク数")
+    parser.add_argument("--ef-construction", type=int, default=100, help="HNSWの構築時の探索幅")
+    parser.add_argument("--ef-search", type=int, default=64, help="HNSWの検索時の探索幅")
+    parser.add_argument("--noise", type=float, default=2.0, help="合成ベクトルのクラスタ中心からのばらつき")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--snapshot", default=None, help="合成ベクトルの代わりに使う埋め込みベクトルのスナップショットのディレクトリ（1536次元で出力したもの）")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        # 登録済み画像のキャプションの埋め込みベクトルを使う（末尾の一部をクエリにする）
+        data = np.asarray(load_snapshot(args.snapshot).caption_embeddings[:args.n + args.queries])
+        args.n = len(data) - min(args.queries, len(data) // 10 or 1)
+    else:
+        data = make_matryoshka_vectors(args.n + args.queries, args.dim, noise=args.noise, seed=args.seed)
+    hnsw_params = {"M": args.M, "ef_construction": args.ef_construction, "ef_search": args.ef_search} if args.hnsw else None
+    dimensions = [int(value) for value in args.dimensions.split(",") if int(value) <= data.shape[1]]
+    benchmark(data[:args.n], data[args.n:], args.k, dimensions, hnsw_params)
@@ -0,0 +1,89 @@
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+from app.embedding_snapshot import load_snapshot
+from app.hnsw_index import HNSWIndex
+
+def make_clustered_vectors(n, dimension, clusters=100, noise=2.0, seed=0):
+    """クラスタ構造を持つ正規化済みの合成ベクトルを生成する（実際の埋め込みに近い分布の代わり）"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((clusters, dimension)).astype(np.float32)
+    vectors = centers[rng.integers(0, clusters, n)] + noise * rng.standard_normal((n, dimension)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+def exact_search(matrix, query, k):
+    """全件の内積から上位k件を求める（正解データと比較対象のレイテンシー）"""
+    scores = matrix @ query
+    candidates = np.argpartition(-scores, k - 1)[:k]
+    return candidates[np.argsort(-scores[candidates])]
+
+def percentile(values, percent):
+    return float(np.percentile(values, percent)) * 1000 if values else 0.0
+
+def benchmark(vectors, queries, k, M, ef_construction, ef_values):
+    print(f"ベクトル {len(vectors)} 件（{vectors.shape[1]} 次元）, クエリ {len(queries)} 件, k={k}, M={M}, ef_construction={ef_construction}")
+
+    start = time.perf_counter()
+    index = HNSWIndex(vectors.shape[1], M=M, ef_construction=ef_construction)
+    index.add_items(vectors)
+    build_seconds = time.perf_counter() - start
+    print(f"インデックス構築: {build_seconds:.1f} 秒（{len(vectors) / build_seconds:.0f} 件/秒）")
+
+    # 保存と読み込みの所要時間・サイズ
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "index.npz")
+        start = time.perf_counter()
+        index.save(path)
+        save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        index = HNSWIndex.load(path)
+        load_seconds = time.perf_counter() - start
+        print(f"保存: {save_seconds:.2f} 秒, 読み込み: {load_seconds:.2f} 秒, サイズ: {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+    truth = []
+    exact_latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(set(exact_search(vectors, query, k).tolist()))
+        exact_latencies.append(time.perf_counter() - start)
+    print(f"\n{'方式':<12}{'recall@' + str(k):>10}{'p50(ms)':>10}{'p95(ms)':>10}")
+    print(f"{'exact':<12}{1.0:>10.3f}{percentile(exact_latencies, 50):>10.2f}{percentile(exact_latencies, 95):>10.2f}")
+
+    for ef in ef_values:
+        latencies = []
+        hits = 0
+        for query, expected in zip(queries, truth):
+            start = time.perf_counter()
+            labels, _ = index.search(query, k, ef=ef)
+            latencies.append(time.perf_counter() - start)
+            hits += len(expected & set(labels.tolist()))
+        recall = hits / (len(queries) * k)
+        print(f"{'hnsw ef=' + str(ef):<12}{recall:>10.3f}{percentile(latencies, 50):>10.2f}{percentile(latencies, 95):>10.2f}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="HNSWインデックスの再現率とレイテンシーを全件スキャンと比較します。")
+    parser.add_argument("--n", type=int, default=10000, help="インデックスに登録するベクトル数")
+    parser.add_argument("--dim", type=int, default=256, help="合成ベクトルの次元数")
+    parser.add_argument("--queries", type=int, default=200, help="クエリ数")
+    parser.add_argument("--k", type=int, default=10, help="取得する近傍の件数")
+    parser.add_argument("--M", type=int, default=16, help="各層のリンク数")
+    parser.add_argument("--ef-construction", type=int, default=100, help="挿入時の候補数")
+    parser.add_argument("--ef", default="16,32,64,128,256", help="検索時の候補数（カンマ区切りで複数指定）")
+    parser.add_argument("--noise", type=float, default=2.0, help="合成ベクトルのクラスタ中心からのばらつき（大きいほど近傍探索が難しくなる）")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--snapshot", default=None, help="合成ベクトルの代わりに使う埋め込みベクトルのスナップショットのディレクトリ")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        # 登録済み画像のキャプションの埋め込みベクトルを使う（先頭 n 件をインデックスに、続く queries 件をクエリにする）
+        data = np.asarray(load_snapshot(args.snapshot).caption_embeddings[:args.n + args.queries])
+        args.n = len(data) - min(args.queries, len(data) // 10 or 1)
+    else:
+        data = make_clustered_vectors(args.n + args.queries, args.dim, noise=args.noise, seed=args.seed)
+    # クエリはインデックスに含まれないベクトルを使う
+    benchmark(
+        data[:args.n], data[args.n:], args.k, args.M, args.ef_construction,
+        [int(ef) for ef in args.ef.split(",")]
+    )
@@ -0,0 +1,84 @@
+import time
+import argparse
+import numpy as np
+from app.embedding_snapshot import load_snapshot
+from app.vector_quantization import (
+    binary_matrix, hamming_distances, int8_cosine_scores, int8_matrix, int8_row_norms, quantize_binary, quantize_int8
+)
+from util_benchmark_hnsw import make_clustered_vectors, exact_search, percentile
+
+def top_candidates(scores, count):
+    count = min(count, scores.size)
+    return np.argpartition(-scores, count - 1)[:count]
+
+def benchmark(vectors, queries, k, overfetch_values):
+    print(f"ベクトル {len(vectors)} 件（{vectors.shape[1]} 次元）, クエリ {len(queries)} 件, k={k}")
+
+    # 量子化と行列のメモリ量
+    start = time.perf_counter()
+    packed = binary_matrix(vectors)
+    binary_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    int8_rows = int8_matrix(vectors)
+    int8_norms = int8_row_norms(int8_rows)
+    int8_seconds = time.perf_counter() - start
+    print(f"float32: {vectors.nbytes / 1024 / 1024:.1f} MB")
+    print(f"int8:    {int8_rows.nbytes / 1024 / 1024:.1f} MB（1/{vectors.nbytes / int8_rows.nbytes:.0f}、量子化 {int8_seconds:.2f} 秒）")
+    print(f"binary:  {packed.nbytes / 1024 / 1024:.1f} MB（1/{vectors.nbytes / packed.nbytes:.0f}、量子化 {binary_seconds:.2f} 秒）")
+
+    truth = []
+    exact_latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        truth.append(set(exact_search(vectors, query, k).tolist()))
+        exact_latencies.append(time.perf_counter() - start)
+
+    stage1 = {
+        "binary": lambda query: -hamming_distances(packed, quantize_binary(query)),
+        "int8": lambda query: int8_cosine_scores(int8_rows, quantize_int8(query), int8_norms)
+    }
+
+    print(f"\n{'方式':<22}{'recall@' + str(k):>10}{'1段目p50(ms)':>14}{'合計p50(ms)':>13}{'合計p95(ms)':>13}")
+    print(f"{'float32 exact':<22}{1.0:>10.3f}{'':>14}{percentile(exact_latencies, 50):>13.2f}{percentile(exact_latencies, 95):>13.2f}")
+    for mode, score_func in stage1.items():
+        for overfetch in overfetch_values:
+            stage1_latencies = []
+            latencies = []
+            hits = 0
+            for query, expected in zip(queries, truth):
+                start = time.perf_counter()
+                candidates = top_candidates(score_func(query), k * overfetch)
+                stage1_done = time.perf_counter()
+                # 2段目: 候補だけfloat32の内積で再スコアリング
+                candidates = np.sort(candidates)
+                scores = vectors[candidates] @ query
+                result = candidates[np.argsort(-scores)[:k]]
+                latencies.append(time.perf_counter() - start)
+                stage1_latencies.append(stage1_done - start)
+                hits += len(expected & set(result.tolist()))
+            recall = hits / (len(queries) * k)
+            label = f"{mode} x{overfetch}" if overfetch > 1 else f"{mode}のみ"
+            print(
+                f"{label:<22}{recall:>10.3f}{percentile(stage1_latencies, 50):>14.2f}"
+                f"{percentile(latencies, 50):>13.2f}{percentile(latencies, 95):>13.2f}"
+            )
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="int8・バイナリ量子化による2段階検索の再現率とレイテンシーをfloat32の全件スキャンと比較します。")
+    parser.add_argument("--n", type=int, default=100000, help="検索対象のベクトル数")
+    parser.add_argument("--dim", type=int, default=1536, help="合成ベクトルの次元数")
+    parser.add_argument("--queries", type=int, default=100, help="クエリ数")
+    parser.add_argument("--k", type=int, default=10, help="取得する近傍の件数")
+    parser.add_argument("--overfetch", default="1,4,10,40", help="1段目で取得する候補数の倍率（カンマ区切りで複数指定、1は再スコアリングなしと同じ）")
+    parser.add_argument("--noise", type=float, default=2.0, help="合成ベクトルのクラスタ中心からのばらつき")
+    parser.add_argument("--seed", type=int, default=0, help="乱数のシード")
+    parser.add_argument("--snapshot", default=None, help="合成ベクトルの代わりに使う埋め込みベクトルのスナップショットのディレクトリ")
+    args = parser.parse_args()
+
+    if args.snapshot:
+        # 登録済み画像のキャプションの埋め込みベクトルを使う（末尾の一部をクエリにする）
+        data = np.asarray(load_snapshot(args.snapshot).caption_embeddings[:args.n + args.queries])
+        args.n = len(data) - min(args.queries, len(data) // 10 or 1)
+    else:
+        data = make_clustered_vectors(args.n + args.queries, args.dim, noise=args.noise, seed=args.seed)
+    benchmark(data[:args.n], data[args.n:], args.k, [int(value) for value in args.overfetch.split(",")])
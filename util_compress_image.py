@@ -1,25 +1,129 @@
 import os
+import json
+import hashlib
+import argparse
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from PIL import Image
 
-def compress_images(input_folder, output_folder):
+# 圧縮済みファイルの元ファイル情報を記録する状態ファイル
+STATE_FILE_NAME = ".compress_state.json"
+
+def compress_image(input_path, max_size=1024, quality=75):
+    """画像を最大辺max_sizeに縮小し、JPEGに変換したバイト列を返す"""
+    with Image.open(input_path) as img:
+        # JPEGは縮小した解像度で直接デコードし、大きな写真のデコード負荷を下げる
+        if img.format == 'JPEG':
+            img.draft('RGB', (max_size, max_size))
+        # リサイズ処理を追加
+        if max(img.size) > max_size:
+            img.thumbnail((max_size, max_size), Image.LANCZOS)
+        buffered = BytesIO()
+        img.convert('RGB').save(buffered, 'JPEG', optimize=True, quality=quality)
+        return buffered.getvalue()
+
+def file_sha256(path):
+    """ファイル内容のSHA-256を返す"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def _compress_file(task):
+    """プロセスプールで実行する1ファイル分の圧縮処理"""
+    input_path, output_path = task
+    # 圧縮に失敗した場合に空の出力ファイルを残さないよう、圧縮してから書き込む
+    data = compress_image(input_path)
+    with open(output_path, 'wb') as output_file:
+        output_file.write(data)
+    stat = os.stat(input_path)
+    return input_path, {
+        "mtime_ns": stat.st_mtime_ns,
+        "size": stat.st_size,
+        "sha256": file_sha256(input_path)
+    }
+
+def _load_state(output_folder):
+    state_path = os.path.join(output_folder, STATE_FILE_NAME)
+    if not os.path.exists(state_path):
+        return {}
+    with open(state_path, encoding='utf-8') as f:
+        return json.load(f)
+
+def _save_state(output_folder, state):
+    state_path = os.path.join(output_folder, STATE_FILE_NAME)
+    with open(state_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(state_path + '.tmp', state_path)
+
+def _is_unchanged(input_path, output_path, entry):
+    """前回圧縮時から元ファイルが変わっていないかを判定（mtime・サイズ、異なればハッシュで確認）"""
+    if entry is None or not os.path.exists(output_path):
+        return False
+    stat = os.stat(input_path)
+    if stat.st_mtime_ns == entry["mtime_ns"] and stat.st_size == entry["size"]:
+        return True
+    if stat.st_size == entry["size"] and file_sha256(input_path) == entry["sha256"]:
+        # 内容は同じなのでmtimeだけ更新する
+        entry["mtime_ns"] = stat.st_mtime_ns
+        return True
+    return False
+
+def list_source_images(input_folder):
+    """圧縮対象の画像ファイル名を返す"""
+    return [
+        filename for filename in os.listdir(input_folder)
+        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.webp', '.bmp', '.gif'))
+    ]
+
+def compress_images(input_folder, output_folder, workers=None, force=False):
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
 
-    for filename in os.listdir(input_folder):
-        if filename.lower().endswith(('.png', '.jpg', '.jpeg', '.bmp', '.gif')):
-            input_path = os.path.join(input_folder, filename)
-            output_filename = f"{filename.split('.')[0]}.jpg"
-            output_path = os.path.join(output_folder, output_filename)
+    state = {} if force else _load_state(output_folder)
+    tasks = []
+    skipped = 0
+    for filename in list_source_images(input_folder):
+        input_path = os.path.join(input_folder, filename)
+        output_filename = f"{filename.split('.')[0]}.jpg"
+        output_path = os.path.join(output_folder, output_filename)
 
-            with Image.open(input_path) as img:
-                # リサイズ処理を追加
-                if max(img.size) > 1024:
-                    img.thumbnail((1024, 1024), Image.LANCZOS)
-                img.convert('RGB').save(output_path, 'JPEG', optimize=True, quality=75)
+        # 前回から変更されていないファイルは再圧縮しない
+        if _is_unchanged(input_path, output_path, state.get(filename)):
+            skipped += 1
+            continue
+        tasks.append((input_path, output_path))
 
-            print(f"{filename} を圧縮・リサイズして {output_filename} として保存しました。")
+    # すべてのCPUコアを使って並列に圧縮
+    # 1ファイルの失敗で全体を止めず、完了した分は途中で中断しても状態ファイルに残す
+    compressed = 0
+    failed = 0
+    try:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(_compress_file, task): task[0] for task in tasks}
+            for future in as_completed(futures):
+                filename = os.path.basename(futures[future])
+                try:
+                    _, entry = future.result()
+                except Exception as e:
+                    print(f"{filename} の圧縮中にエラーが発生しました: {str(e)}")
+                    failed += 1
+                    continue
+                state[filename] = entry
+                compressed += 1
+                print(f"{filename} を圧縮・リサイズして {filename.split('.')[0]}.jpg として保存しました。")
+                if compressed % 100 == 0:
+                    _save_state(output_folder, state)
+    finally:
+        _save_state(output_folder, state)
+    print(f"圧縮: {compressed} 件, 失敗: {failed} 件, 変更なしのためスキップ: {skipped} 件")
 
 if __name__ == "__main__":
-    input_folder = "images_original"
-    output_folder = "images"
-    compress_images(input_folder, output_folder)
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="画像を縮小・JPEG圧縮して保存します。")
+    parser.add_argument("--input", default="images_original", help="元画像のディレクトリ")
+    parser.add_argument("--output", default="images", help="圧縮画像の出力先ディレクトリ")
+    parser.add_argument("--workers", type=int, default=None, help="並列プロセス数（省略時はCPUコア数）")
+    parser.add_argument("--force", action="store_true", help="変更の有無にかかわらずすべて再圧縮する")
+    args = parser.parse_args()
+    compress_images(args.input, args.output, workers=args.workers, force=args.force)